@@ -118,6 +118,20 @@ DATABASES = {
     )
 }
 
+# Caché
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# Por defecto LocMem (una caché por proceso). Si se define DJANGO_CACHE_TABLE se
+# usa una tabla en BD, compartida entre todos los workers de gunicorn y las
+# lambdas de Vercel (la crea `python manage.py createcachetable`).
+_CACHE_TABLE = os.environ.get("DJANGO_CACHE_TABLE", "")
+if _CACHE_TABLE:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': _CACHE_TABLE,
+        }
+    }
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 
@@ -249,8 +263,16 @@ SITE_URL = os.environ.get('SITE_URL', 'http://localhost:8000')
 #   Por defecto 50 (bien por debajo de los límites gratuitos de Gemini). Ponlo a 0 para sin límite.
 GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY", "")
 GEMINI_MODEL = os.environ.get("GEMINI_MODEL", "gemini-flash-lite-latest")
+# Presupuesto (tokens estimados) de datos de la organización en el prompt; las organizaciones
+# grandes reciben solo lo relevante para cada pregunta más un resumen del resto
+GEMINI_CONTEXT_TOKENS = int(os.environ.get("GEMINI_CONTEXT_TOKENS", "6000"))
+# Timeout (s) de cada llamada a Gemini: respuestas del chat y resúmenes del historial
+GEMINI_TIMEOUT = float(os.environ.get("GEMINI_TIMEOUT", "30"))
+GEMINI_SUMMARY_TIMEOUT = float(os.environ.get("GEMINI_SUMMARY_TIMEOUT", "15"))
 
 AEMET_API_KEY = os.environ.get("AEMET_API_KEY", "")
+# Si AEMET cae de forma repetida, desactivar temporalmente el módulo del tiempo (flag WEATHER)
+AEMET_AUTO_DISABLE_WEATHER = os.environ.get("AEMET_AUTO_DISABLE_WEATHER", "True") == "True"
 GEMINI_DAILY_LIMIT = int(os.environ.get("GEMINI_DAILY_LIMIT", "50"))
 
 LOGGING = {
@@ -3,6 +3,7 @@ from django.db import models
 
 _CACHE_KEY = 'feature_flags_all'
 _CACHE_TTL = 60  # segundos — máximo que tarda en propagarse un cambio
+_TRIP_CACHE_PREFIX = 'feature_flag_tripped'  # desactivaciones automáticas temporales
 
 
 # ── Catálogo de flags soportados ──────────────────────────────────────────────
@@ -50,6 +51,9 @@ class FeatureFlag(models.Model):
     def save(self, *args, **kwargs):
         super().save(*args, **kwargs)
         cache.delete(_CACHE_KEY)
+        if self.enabled:
+            # Reactivar desde el admin anula también una desactivación automática
+            reset_flag_trip(self.name)
 
     def delete(self, *args, **kwargs):
         result = super().delete(*args, **kwargs)
@@ -59,11 +63,36 @@ class FeatureFlag(models.Model):
 
 # ── Helpers públicos ──────────────────────────────────────────────────────────
 
+def _trip_key(name: str) -> str:
+    return f'{_TRIP_CACHE_PREFIX}:{name}'
+
+
+def trip_flag(name: str, seconds: int) -> None:
+    """
+    Desactiva un flag durante `seconds` segundos sin tocar la BD (p.ej. cuando
+    la API externa de un módulo lleva un rato caída). Expira sola; tras expirar,
+    el flag puede seguir desactivado hasta _CACHE_TTL segundos más.
+    """
+    cache.set(_trip_key(name), True, timeout=seconds)
+    cache.delete(_CACHE_KEY)
+
+
+def reset_flag_trip(name: str) -> None:
+    cache.delete(_trip_key(name))
+    cache.delete(_CACHE_KEY)
+
+
 def get_all_flags() -> dict[str, bool]:
-    """Devuelve {NAME: enabled} con caché."""
+    """
+    Devuelve {NAME: enabled} con caché, aplicando las desactivaciones automáticas.
+    Estas se leen solo al reconstruir la caché (trip_flag la invalida), así que
+    una petición normal cuesta una única lectura de caché.
+    """
     flags = cache.get(_CACHE_KEY)
     if flags is None:
         flags = dict(FeatureFlag.objects.values_list('name', 'enabled'))
+        tripped = cache.get_many([_trip_key(name) for name in KNOWN_FLAGS])
+        flags.update({key.split(':', 1)[1]: False for key in tripped})
         cache.set(_CACHE_KEY, flags, _CACHE_TTL)
     return flags
 
@@ -3,8 +3,13 @@
 echo "Applying migrations..."
 python manage.py migrate --noinput
 
+echo "Creating cache table (if configured)..."
+python manage.py createcachetable
+
 echo "Collecting static files..."
 python manage.py collectstatic --noinput
 
 echo "Starting server..."
-gunicorn agrogest.wsgi:application --bind 0.0.0.0:8000
+# gthread: una respuesta en streaming del asistente ocupa un hilo, no el worker entero
+gunicorn agrogest.wsgi:application --bind 0.0.0.0:8000 \
+    --worker-class gthread --threads "${GUNICORN_THREADS:-4}"
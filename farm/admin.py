@@ -1,12 +1,18 @@
 from django.contrib import admin
 
-from farm.models import Product, Field, Machine, Treatment, Harvest, TreatmentProduct, ProductType, ExpenseType, StoragePoint
+from farm.models import Product, Field, Machine, Treatment, Harvest, TreatmentProduct, ProductType, ExpenseType, StoragePoint, \
+    AemetMunicipality
 
 
 class TreatmentAdmin(admin.ModelAdmin):
     list_per_page = 20
 
 
+class AemetMunicipalityAdmin(admin.ModelAdmin):
+    list_display = ('name', 'code', 'lat', 'lon', 'updated_at')
+    search_fields = ['name', 'code']
+
+
 class TreatmentProductAdmin(admin.ModelAdmin):
     list_per_page = 20
     list_filter = ('treatment', 'product__name')
@@ -27,3 +33,4 @@ admin.site.register(TreatmentProduct, TreatmentProductAdmin)
 admin.site.register(ProductType)
 admin.site.register(ExpenseType)
 admin.site.register(StoragePoint)
+admin.site.register(AemetMunicipality, AemetMunicipalityAdmin)
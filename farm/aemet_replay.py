@@ -0,0 +1,167 @@
+"""
+Reproducción de respuestas AEMET grabadas, para probar y medir el servicio
+meteorológico sin red ni API key.
+
+- AemetReplayServer: servidor HTTP local que imita a AEMET OpenData. Cada ruta
+  `/opendata/api/...` devuelve el sobre de metadatos ({"estado": 200, "datos": <url>})
+  y la URL `datos` devuelve el payload registrado. Cuenta conexiones TCP y
+  peticiones para poder comprobar la reutilización de conexiones.
+- load_recording / record: leen y graban un directorio de respuestas
+  (municipios.json, horaria_<cod>.json, diaria_<cod>.json).
+- replay_aemet: apunta weather_service al servidor local con una caché en
+  memoria propia, sin tocar la caché ni el catálogo de la aplicación.
+"""
+import json
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest import mock
+
+MUNICIPIOS_PATH = "/api/maestro/municipios"
+PREDICCION_PATH = "/api/prediccion/especifica/municipio/{kind}/{cod}"
+PREDICCION_KINDS = ("horaria", "diaria")
+# Fixtures de ejemplo incluidas en el repositorio
+DEFAULT_RECORDING_DIR = Path(__file__).resolve().parent / "tests" / "fixtures" / "aemet"
+
+
+class AemetReplayServer:
+    def __init__(self, payloads: dict):
+        """
+        `payloads` mapea la ruta de la API (ej. '/api/maestro/municipios') al JSON de datos.
+        Una ruta de predicción con '*' como código (ver PREDICCION_PATH) sirve a cualquier
+        municipio sin grabación propia.
+        """
+        self.payloads = payloads
+        self.connections = 0
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}/opendata"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def payload_for(self, path: str):
+        if path in self.payloads:
+            return self.payloads[path]
+        for kind in PREDICCION_KINDS:
+            prefix = PREDICCION_PATH.format(kind=kind, cod="")
+            if path.startswith(prefix):
+                return self.payloads.get(PREDICCION_PATH.format(kind=kind, cod="*"))
+        return None
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive
+            timeout = 5
+
+            def setup(self):
+                super().setup()
+                with stub._lock:
+                    stub.connections += 1
+
+            def do_GET(self):
+                with stub._lock:
+                    stub.requests += 1
+                path = self.path.split("?")[0].removeprefix("/opendata")
+                if path.startswith("/sh"):
+                    body = stub.payload_for(path.removeprefix("/sh"))
+                    status = 200 if body is not None else 404
+                elif stub.payload_for(path) is not None:
+                    body, status = {"estado": 200, "datos": f"{stub.base_url}/sh{path}"}, 200
+                else:
+                    body, status = {"estado": 404, "descripcion": "No hay datos"}, 404
+                data = json.dumps(body).encode("iso-8859-1", "replace") if body is not None else b""
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json;charset=ISO-8859-1")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+# ── Grabaciones ───────────────────────────────────────────────────────
+def load_recording(directory: Path = DEFAULT_RECORDING_DIR) -> dict:
+    """
+    Lee un directorio de respuestas grabadas y devuelve {ruta de la API: payload}.
+    La primera grabación de cada tipo de predicción se registra también como
+    comodín ('*'), para poder repartir N parcelas por todo el catálogo.
+    """
+    directory = Path(directory)
+    payloads = {}
+    municipios = directory / "municipios.json"
+    if municipios.exists():
+        payloads[MUNICIPIOS_PATH] = json.loads(municipios.read_text(encoding="utf-8"))
+    for kind in PREDICCION_KINDS:
+        for path in sorted(directory.glob(f"{kind}_*.json")):
+            cod = path.stem.split("_", 1)[1]
+            payload = json.loads(path.read_text(encoding="utf-8"))
+            payloads[PREDICCION_PATH.format(kind=kind, cod=cod)] = payload
+            payloads.setdefault(PREDICCION_PATH.format(kind=kind, cod="*"), payload)
+    return payloads
+
+
+def record(directory: Path, codes: list) -> list:
+    """
+    Graba desde AEMET (requiere AEMET_API_KEY) el catálogo de municipios y la
+    predicción horaria y diaria de `codes`. Devuelve los ficheros escritos.
+    """
+    from farm import weather_service
+
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    targets = [(MUNICIPIOS_PATH, directory / "municipios.json")]
+    for cod in codes:
+        for kind in PREDICCION_KINDS:
+            targets.append((PREDICCION_PATH.format(kind=kind, cod=cod), directory / f"{kind}_{cod}.json"))
+    written = []
+    for api_path, file_path in targets:
+        payload = weather_service._aemet_fetch(api_path)
+        if payload is None:
+            continue
+        file_path.write_text(json.dumps(payload, ensure_ascii=False, indent=1), encoding="utf-8")
+        written.append(file_path)
+    return written
+
+
+@contextmanager
+def replay_aemet(payloads: dict, municipios: list | None = None):
+    """
+    Durante el bloque, weather_service descarga de un AemetReplayServer con
+    `payloads` y usa una caché en memoria vacía y propia. Si se pasa `municipios`
+    (ya parseados) se usan como catálogo sin consultar la BD.
+    """
+    from django.test.utils import override_settings
+
+    from farm import weather_service
+
+    caches = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "aemet-replay"}}
+    with AemetReplayServer(payloads) as server, \
+            override_settings(CACHES=caches, AEMET_API_KEY="replay"), \
+            mock.patch.object(weather_service, "AEMET_BASE", server.base_url), \
+            mock.patch.object(weather_service, "_latency_avg", None):
+        if municipios is None:
+            yield server
+            return
+        with mock.patch.object(weather_service, "_municipios_cache", municipios), \
+                mock.patch.object(weather_service, "_municipios_index", None), \
+                mock.patch.object(weather_service, "_municipios_ts", float("inf")):
+            yield server
@@ -0,0 +1,195 @@
+"""
+Contexto de organización que se inyecta en el prompt del asistente.
+
+Caché: cada organización tiene un token de versión de sus datos en la caché de
+Django. Las señales de farm.signals lo renuevan al guardar o borrar productos,
+tipos de producto, parcelas, máquinas o tratamientos, de modo que las entradas
+cacheadas con el token anterior dejan de usarse sin tener que buscarlas ni borrarlas.
+
+Selección: si el contexto completo no cabe en el presupuesto de tokens,
+select_context se queda con las parcelas, productos y tratamientos más
+relevantes para el mensaje del usuario (nombres mencionados y recencia) y
+resume el resto en totales.
+"""
+import json
+import re
+import time
+import unicodedata
+from collections import Counter
+
+from django.core.cache import cache
+
+_VERSION_KEY = 'ai_context_version:{org_id}'
+CONTEXT_CACHE_TTL = 60 * 60 * 24  # por si nadie toca los datos en días
+
+
+def context_version(org_id) -> int:
+    """Token de versión actual de los datos de la organización."""
+    key = _VERSION_KEY.format(org_id=org_id)
+    version = cache.get(key)
+    if version is None:
+        # Un token nuevo (no un contador que vuelva a 1) para no reutilizar
+        # entradas antiguas si la clave de versión se ha perdido de la caché
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_context_version(org_id) -> None:
+    """Invalida el contexto cacheado de la organización."""
+    if org_id is not None:
+        cache.set(_VERSION_KEY.format(org_id=org_id), time.time_ns(), timeout=None)
+
+
+def versioned_key(prefix: str, org_id, *parts) -> str:
+    return ':'.join(str(p) for p in (prefix, org_id, context_version(org_id), *parts))
+
+
+# ── Selección por relevancia ─────────────────────────────────────────
+DEFAULT_TOKEN_BUDGET = 6000
+_CHARS_PER_TOKEN = 4  # estimación habitual para texto/JSON en español
+_WORD_RE = re.compile(r'\w+')
+_STOPWORDS = frozenset(
+    'que los las del con para por una uno unos unas como cual cuales cuando donde '
+    'cuanto cuanta cuantos cuantas esta este estos estas ese esa eso mis tus sus '
+    'hay han has hice hecho ultima ultimo ultimas ultimos vez veces todo todos '
+    'toda todas tengo tiene tienen sobre entre desde hasta pero mas muy algun alguna'.split()
+)
+# Peso de cada tipo de coincidencia
+_NAME_MATCH = 3.0
+_RELATED_MATCH = 2.0
+_TYPE_MATCH = 1.0
+# Parte del presupuesto reservada a cada sección (parcelas, productos, tratamientos),
+# para que una pregunta sin nombres no se quede solo con tratamientos
+_SECTION_SHARE = 0.2
+
+
+def estimate_tokens(data) -> int:
+    return len(json.dumps(data, ensure_ascii=False, separators=(',', ':'))) // _CHARS_PER_TOKEN
+
+
+def _words(text) -> set:
+    """Palabras en minúsculas y sin tildes."""
+    text = unicodedata.normalize('NFKD', str(text).lower())
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return set(_WORD_RE.findall(text))
+
+
+def _keywords(message: str) -> set:
+    return {w for w in _words(message) if len(w) >= 3 and w not in _STOPWORDS and not w.isdigit()}
+
+
+def _matches(keywords: set, text) -> int:
+    """Palabras clave que aparecen en `text` (admitiendo plurales y prefijos: 'insecticidas' ~ 'insecticida')."""
+    words = _words(text)
+    return sum(
+        1 for k in keywords
+        if k in words or (len(k) >= 4 and any(len(w) >= 4 and (w.startswith(k) or k.startswith(w)) for w in words))
+    )
+
+
+def _summary(context: dict) -> dict:
+    fields = context['parcelas']
+    products = context['productos']
+    treatments = context['tratamientos']
+    summary = {
+        'parcelas': {
+            'total': len(fields),
+            'hectáreas': round(sum(f['hectáreas'] for f in fields), 2),
+            'por_cultivo': dict(Counter(f['cultivo'] for f in fields).most_common()),
+        },
+        'productos': {
+            'total': len(products),
+            'por_tipo': dict(Counter(p['tipo'] for p in products).most_common()),
+        },
+        'tratamientos': {
+            'total': len(treatments),
+            'por_tipo': dict(Counter(t['tipo'] for t in treatments).most_common()),
+            'por_estado': dict(Counter(t['estado'] for t in treatments).most_common()),
+        },
+    }
+    if treatments:
+        # vienen del más reciente al más antiguo
+        summary['tratamientos']['desde'] = treatments[-1]['fecha']
+        summary['tratamientos']['hasta'] = treatments[0]['fecha']
+    return summary
+
+
+def _score_entities(context: dict, keywords: set) -> list:
+    """(puntuación, sección, índice) de cada parcela, producto y tratamiento."""
+    scored = []
+    matched_fields = set()
+    matched_products = set()
+    for i, f in enumerate(context['parcelas']):
+        name_hits = _matches(keywords, f['nombre'])
+        if name_hits:
+            matched_fields.add(f['nombre'])
+        scored.append((_NAME_MATCH * name_hits + _TYPE_MATCH * _matches(keywords, f['cultivo']), 'parcelas', i))
+    for i, p in enumerate(context['productos']):
+        name_hits = _matches(keywords, p['nombre'])
+        if name_hits:
+            matched_products.add(p['nombre'])
+        scored.append((_NAME_MATCH * name_hits + _TYPE_MATCH * _matches(keywords, p['tipo']), 'productos', i))
+
+    treatments = context['tratamientos']
+    for i, t in enumerate(treatments):
+        products = t.get('productos', [])
+        score = _NAME_MATCH * _matches(keywords, t['nombre'])
+        if t['parcela'] in matched_fields:
+            score += _RELATED_MATCH
+        if any(line.startswith(name + ' [') for name in matched_products for line in products):
+            score += _RELATED_MATCH
+        score += _TYPE_MATCH * _matches(keywords, ' '.join([t['tipo'], *products]))
+        # Recencia: entre 1 (el más reciente) y casi 0 (el más antiguo); desempata y
+        # rellena el presupuesto con lo último cuando la pregunta no nombra nada
+        score += 1 - i / len(treatments)
+        scored.append((score, 'tratamientos', i))
+    return scored
+
+
+def select_context(context: dict, message: str | None, budget: int = DEFAULT_TOKEN_BUDGET) -> dict:
+    """
+    Contexto que cabe en `budget` tokens (estimados).
+
+    Si el contexto completo cabe se devuelve tal cual (el mismo objeto). Si no,
+    se devuelve una copia con las máquinas (pocas y necesarias para cualquier
+    cálculo de dosis), las parcelas, productos y tratamientos mejor puntuados
+    para `message` en su orden original, y `resumen` con los totales de todo.
+
+    Cada sección tiene reservado _SECTION_SHARE del presupuesto para sus
+    entidades mejor puntuadas; lo que sobra se reparte por puntuación sin más.
+    """
+    if estimate_tokens(context) <= budget:
+        return context
+
+    selected = {key: [] for key in ('productos', 'parcelas', 'tratamientos')}
+    result = {
+        **selected,
+        'máquinas': context.get('máquinas', []),
+        'resumen': _summary(context),
+    }
+    remaining = budget - estimate_tokens(result)
+    reserved = {key: remaining * _SECTION_SHARE for key in selected}
+    chosen = {key: [] for key in selected}
+    ranked = sorted(_score_entities(context, _keywords(message or '')), key=lambda e: -e[0])
+    pending = []
+    for score, section, i in ranked:
+        cost = estimate_tokens(context[section][i]) + 1  # coma separadora
+        if cost <= reserved[section] and cost <= remaining:
+            chosen[section].append(i)
+            reserved[section] -= cost
+            remaining -= cost
+        else:
+            pending.append((section, i, cost))
+    for section, i, cost in pending:
+        if cost <= remaining:
+            chosen[section].append(i)
+            remaining -= cost
+
+    for section, indexes in chosen.items():
+        result[section] = [context[section][i] for i in sorted(indexes)]
+    summary = result['resumen']
+    summary['parcelas']['incluidas'] = len(result['parcelas'])
+    summary['productos']['incluidos'] = len(result['productos'])
+    summary['tratamientos']['incluidos'] = len(result['tratamientos'])
+    return result
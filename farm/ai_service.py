@@ -15,13 +15,16 @@ Obtén tu clave GRATIS en: https://aistudio.google.com/apikey
 import json
 import logging
 import re
+import threading
+import time
+from contextlib import contextmanager
 from datetime import date, datetime, timedelta, timezone as dt_tz
 
 from django.conf import settings
 from django.core.cache import cache
 from django.utils import timezone
-from google import genai
-from google.genai import types
+
+from farm.ai_context import CONTEXT_CACHE_TTL, DEFAULT_TOKEN_BUDGET, select_context, versioned_key
 
 logger = logging.getLogger(__name__)
 
@@ -156,6 +159,17 @@ def get_org_context(organization) -> dict:
     }
 
 
+def _partial_context_note(context: dict) -> str:
+    if 'resumen' not in context:
+        return ''
+    return """
+**Contexto parcial:** por tamaño, solo se incluyen las parcelas, productos y tratamientos
+más relevantes para la pregunta (y los más recientes). `resumen` tiene los totales de toda
+la organización. Si la respuesta necesita un dato que no aparece, dilo y pide al usuario
+que concrete la parcela, el producto o las fechas.
+"""
+
+
 def build_system_prompt(organization, context: dict) -> str:
     today = date.today().strftime('%d/%m/%Y')
     context_json = json.dumps(context, ensure_ascii=False, separators=(',', ':'))
@@ -191,7 +205,7 @@ Fecha actual: {today}
 ```json
 {context_json}
 ```
-
+{_partial_context_note(context)}
 ## Instrucciones de respuesta
 - Responde siempre en español, de forma clara y concisa.
 - En cálculos, muestra los pasos intermedios con los valores concretos.
@@ -276,10 +290,93 @@ Los datos del contexto incluyen un campo `id` para cada entidad. Construye los e
 """
 
 
+def get_cached_org_context(organization) -> dict:
+    """get_org_context cacheado por organización hasta que cambien sus datos (ver farm.ai_context)."""
+    key = versioned_key('ai_context', organization.pk)
+    context = cache.get(key)
+    if context is None:
+        context = get_org_context(organization)
+        cache.set(key, context, CONTEXT_CACHE_TTL)
+    return context
+
+
+def get_system_prompt(organization, user_message: str | None = None) -> str:
+    """
+    Prompt de sistema para responder a `user_message`.
+
+    Si el contexto completo de la organización cabe en GEMINI_CONTEXT_TOKENS, el
+    prompt se cachea por organización, versión de sus datos y día (incluye la
+    fecha actual) y una conversación de N turnos lo construye una sola vez. Si no
+    cabe, el contexto se recorta según el mensaje (ver farm.ai_context.select_context).
+    """
+    context = get_cached_org_context(organization)
+    budget = getattr(settings, 'GEMINI_CONTEXT_TOKENS', DEFAULT_TOKEN_BUDGET)
+    selected = select_context(context, user_message, budget)
+    if selected is not context:
+        return build_system_prompt(organization, selected)
+
+    key = versioned_key('ai_prompt', organization.pk, date.today().isoformat())
+    prompt = cache.get(key)
+    if prompt is None:
+        prompt = build_system_prompt(organization, context)
+        cache.set(key, prompt, CONTEXT_CACHE_TTL)
+    return prompt
+
+
+# ── Contador diario por organización ────────────────────────────────────────
+# Respuestas del asistente de hoy, en la caché (incr atómico en LocMem/Redis).
+# "Hoy" es el día local (TIME_ZONE), igual que el filtro created_at__date de la
+# BD: la clave lleva ese día y caduca a la medianoche local; si no está, se
+# reconstruye con un COUNT de los ChatMessage de rol 'assistant' de hoy.
+_DAILY_COUNT_KEY = 'gemini_daily_count:{org_id}:{day}'
+
+
+def _seconds_until_local_midnight() -> int:
+    """Segundos hasta la próxima medianoche en TIME_ZONE + 90s de margen."""
+    now = timezone.localtime()
+    next_midnight = timezone.make_aware(datetime.combine(now.date() + timedelta(days=1), datetime.min.time()))
+    return int(next_midnight.timestamp() - now.timestamp()) + 90  # timestamps: correcto también en cambios de hora
+
+
+def _daily_count_key(organization) -> str:
+    return _DAILY_COUNT_KEY.format(org_id=organization.pk, day=timezone.localdate().isoformat())
+
+
+def _count_daily_usage(organization) -> int:
+    from farm.models import ChatMessage
+    return ChatMessage.objects.filter(
+        organization=organization,
+        role='assistant',
+        created_at__date=timezone.localdate(),
+    ).count()
+
+
+def get_daily_usage(organization) -> int:
+    """Consultas al asistente que lleva hoy la organización."""
+    key = _daily_count_key(organization)
+    used = cache.get(key)
+    if used is None:
+        used = _count_daily_usage(organization)
+        # add y no set: si otra petición ya lo ha reconstruido (y quizá incrementado), manda la suya
+        cache.add(key, used, timeout=_seconds_until_local_midnight())
+        used = cache.get(key, used)
+    return used
+
+
+def record_daily_usage(organization) -> None:
+    """Suma una consulta al contador de hoy. Llamar después de guardar la respuesta del asistente."""
+    try:
+        cache.incr(_daily_count_key(organization))
+    except ValueError:
+        # Clave ausente: se reconstruye desde la BD, que ya incluye la respuesta recién guardada
+        get_daily_usage(organization)
+
+
 def check_daily_limit(organization) -> tuple[bool, str | None]:
     """
     Comprueba si la organización ha superado el límite diario de consultas al asistente.
-    Usa los ChatMessage de rol 'assistant' de hoy como contador (sin BD extra).
+    Usa el contador diario de la caché (get_daily_usage); la BD solo se consulta
+    para reconstruirlo.
 
     Returns:
         (ok: bool, error_msg: str | None)
@@ -290,13 +387,7 @@ def check_daily_limit(organization) -> tuple[bool, str | None]:
     if daily_limit <= 0:
         return True, None  # sin límite
 
-    from farm.models import ChatMessage
-    today = timezone.now().date()
-    used = ChatMessage.objects.filter(
-        organization=organization,
-        role='assistant',
-        created_at__date=today,
-    ).count()
+    used = get_daily_usage(organization)
 
     if used >= daily_limit:
         reset_hour = "02:00h" if timezone.now().month in range(4, 11) else "01:00h"
@@ -308,86 +399,257 @@ def check_daily_limit(organization) -> tuple[bool, str | None]:
     return True, None
 
 
-def chat_with_ai(organization, user_message: str, history_messages) -> tuple:
-    """
-    Envía un mensaje a Gemini AI y devuelve la respuesta.
+_QUOTA_EXHAUSTED_MSG = (
+    "⚠️ **Consultas del día agotadas.** La cuota gratuita de la API se ha "
+    "alcanzado y el asistente está pausado para todos hasta que Gemini la "
+    "restablezca (cada día a las 00:00 UTC · `02:00h` en verano / `01:00h` "
+    "en invierno en España). ¡Hasta mañana! 🌙"
+)
 
-    Args:
-        organization: instancia de Organization
-        user_message: texto del mensaje del usuario
-        history_messages: QuerySet/lista de ChatMessage anteriores
 
-    Returns:
-        (response_text, None) en éxito
-        (None, error_message) en error
-    """
+def _check_availability(organization) -> str | None:
+    """Mensaje de error si el asistente no puede atender a la organización ahora mismo."""
     api_key = getattr(settings, 'GEMINI_API_KEY', None) or ''
     if not api_key:
-        return None, (
+        return (
             "⚙️ No hay clave de API configurada. "
             "El administrador debe añadir GEMINI_API_KEY en el fichero .env."
         )
 
     # ── Circuit breaker: quota global agotada ─────────────────────────────
     if is_quota_exhausted():
-        return None, (
-            "⚠️ **Consultas del día agotadas.** La cuota gratuita de la API se ha "
-            "alcanzado y el asistente está pausado para todos hasta que Gemini la "
-            "restablezca (cada día a las 00:00 UTC · `02:00h` en verano / `01:00h` "
-            "en invierno en España). ¡Hasta mañana! 🌙"
-        )
+        return _QUOTA_EXHAUSTED_MSG
 
     # ── Límite diario por organización (protección extra) ─────────────────
     ok, limit_error = check_daily_limit(organization)
     if not ok:
-        return None, limit_error
+        return limit_error
+    return None
+
+
+# ── Cliente de Gemini (uno por proceso) ──────────────────────────────────────
+# genai.Client mantiene su propio pool HTTP con keep-alive y es seguro entre
+# hilos, así que se crea una vez y se reutiliza en todas las peticiones.
+DEFAULT_TIMEOUT = 30  # s por llamada (GEMINI_TIMEOUT)
+DEFAULT_SUMMARY_TIMEOUT = 15  # s (GEMINI_SUMMARY_TIMEOUT)
+
+_client_lock = threading.Lock()
+_client = None  # (api_key, genai.Client)
+
+
+def _get_client():
+    api_key = settings.GEMINI_API_KEY
+    current = _client  # una sola lectura: la tupla se sustituye entera
+    if current is not None and current[0] == api_key:
+        return current[1]
+    return _build_client(api_key)
+
+
+def _build_client(api_key: str):
+    global _client
+    with _client_lock:
+        if _client is None or _client[0] != api_key:
+            # El SDK se importa en la primera llamada: cargarlo en el arranque (vía farm.urls →
+            # chat_views) lo pagaría cada worker aunque nadie use el asistente
+            from google import genai
+            _client = (api_key, genai.Client(api_key=api_key))
+        return _client[1]
+
 
+def _http_options(timeout_setting: str, default: float):
+    """Timeout de una llamada (el SDK lo espera en milisegundos)."""
+    from google.genai import types
+    return types.HttpOptions(timeout=int(getattr(settings, timeout_setting, default) * 1000))
+
+
+# ── Latencia del modelo ──────────────────────────────────────────────────────
+_latency_lock = threading.Lock()
+_latency_stats: dict = {}
+
+
+def _record_latency(operation: str, seconds: float, ok: bool = True) -> None:
+    with _latency_lock:
+        stats = _latency_stats.setdefault(
+            operation, {'calls': 0, 'errors': 0, 'total': 0.0, 'max': 0.0, 'last': 0.0},
+        )
+        stats['calls'] += 1
+        stats['errors'] += not ok
+        stats['total'] += seconds
+        stats['max'] = max(stats['max'], seconds)
+        stats['last'] = seconds
+    logger.info("Gemini %s: %.0f ms%s", operation, seconds * 1000, '' if ok else ' (error)')
+
+
+@contextmanager
+def _timed(operation: str):
+    start = time.perf_counter()
+    ok = False
     try:
-        client = genai.Client(api_key=api_key)
+        yield
+        ok = True
+    finally:
+        _record_latency(operation, time.perf_counter() - start, ok)
+
+
+def model_latency_stats() -> dict:
+    """Latencia de las llamadas a Gemini de este proceso, por operación (segundos)."""
+    with _latency_lock:
+        return {
+            op: {**stats, 'avg': stats['total'] / stats['calls']}
+            for op, stats in _latency_stats.items()
+        }
 
-        context = get_org_context(organization)
-        system_prompt = build_system_prompt(organization, context)
 
-        model_name = getattr(settings, 'GEMINI_MODEL', 'gemini-2.0-flash-lite')
+def _open_chat(organization, user_message: str, history_messages, summary: str | None = None):
+    """Sesión de chat de Gemini con el prompt de sistema y el historial de la conversación."""
+    from google.genai import types
 
-        # Convertir historial al formato de la nueva SDK
-        gemini_history = []
-        for msg in history_messages:
-            role = 'user' if msg.role == 'user' else 'model'
-            gemini_history.append(
-                types.Content(role=role, parts=[types.Part(text=msg.content)])
-            )
+    client = _get_client()
+    system_prompt = get_system_prompt(organization, user_message)
+    if summary:
+        system_prompt += f"\n## Resumen de la conversación anterior\n{summary}\n"
+    model_name = getattr(settings, 'GEMINI_MODEL', 'gemini-2.0-flash-lite')
 
-        chat = client.chats.create(
-            model=model_name,
-            config=types.GenerateContentConfig(
-                system_instruction=system_prompt,
-            ),
-            history=gemini_history,
+    # Convertir historial al formato de la nueva SDK
+    gemini_history = []
+    for msg in history_messages:
+        role = 'user' if msg.role == 'user' else 'model'
+        gemini_history.append(
+            types.Content(role=role, parts=[types.Part(text=msg.content)])
         )
 
-        response = chat.send_message(user_message)
+    return client.chats.create(
+        model=model_name,
+        config=types.GenerateContentConfig(
+            system_instruction=system_prompt,
+            http_options=_http_options('GEMINI_TIMEOUT', DEFAULT_TIMEOUT),
+        ),
+        history=gemini_history,
+    )
+
+
+def describe_api_error(organization, exc: Exception) -> str:
+    """Traduce un error de la API de Gemini a un mensaje para el usuario (y activa el breaker si toca)."""
+    error_str = str(exc)
+    logger.warning("Gemini API error [org=%s]: %s", organization.id, error_str)
+
+    if any(k in error_str for k in ('429', 'RESOURCE_EXHAUSTED', 'quota', 'rate limit')):
+        # Intentar extraer retryDelay del mensaje de error
+        retry_seconds = 0
+        m = re.search(r"retryDelay.*?'(\d+)s'", error_str)
+        if m:
+            retry_seconds = int(m.group(1))
+        mark_quota_exhausted(retry_after_seconds=retry_seconds)
+        return _QUOTA_EXHAUSTED_MSG
+    if any(k in error_str for k in ('403', 'API_KEY_INVALID', 'invalid api key')):
+        return "❌ Clave de API no válida. Revisa la configuración en .env (GEMINI_API_KEY)."
+
+    return f"❌ Error inesperado al conectar con el asistente. Detalles: {error_str}"
+
+
+def chat_with_ai(organization, user_message: str, history_messages, summary: str | None = None) -> tuple:
+    """
+    Envía un mensaje a Gemini AI y devuelve la respuesta.
+
+    Args:
+        organization: instancia de Organization
+        user_message: texto del mensaje del usuario
+        history_messages: QuerySet/lista de ChatMessage anteriores
+        summary: resumen de los mensajes más antiguos de la conversación (ver farm.chat_history)
+
+    Returns:
+        (response_text, None) en éxito
+        (None, error_message) en error
+    """
+    error = _check_availability(organization)
+    if error:
+        return None, error
+
+    try:
+        chat = _open_chat(organization, user_message, history_messages, summary)
+        with _timed('chat'):
+            response = chat.send_message(user_message)
         return normalize_ai_response(response.text), None
+    except Exception as exc:
+        return None, describe_api_error(organization, exc)
+
 
+def chat_with_ai_stream(organization, user_message: str, history_messages,
+                        summary: str | None = None) -> tuple:
+    """
+    Como chat_with_ai, pero la respuesta llega por fragmentos según los genera el modelo.
+
+    Returns:
+        (iterador de fragmentos de texto, None) si se puede empezar
+        (None, error_message) si no (sin clave, cuota agotada, error al abrir el chat)
+
+    Los errores a mitad de respuesta los lanza el propio iterador; usa
+    describe_api_error para convertirlos en mensaje.
+    """
+    error = _check_availability(organization)
+    if error:
+        return None, error
+
+    try:
+        chat = _open_chat(organization, user_message, history_messages, summary)
     except Exception as exc:
-        error_str = str(exc)
-        logger.warning("Gemini API error [org=%s]: %s", organization.id, error_str)
-
-        if any(k in error_str for k in ('429', 'RESOURCE_EXHAUSTED', 'quota', 'rate limit')):
-            # Intentar extraer retryDelay del mensaje de error
-            retry_seconds = 0
-            import re as _re
-            m = _re.search(r"retryDelay.*?'(\d+)s'", error_str)
-            if m:
-                retry_seconds = int(m.group(1))
-            mark_quota_exhausted(retry_after_seconds=retry_seconds)
-            return None, (
-                "⚠️ **Consultas del día agotadas.** La cuota gratuita de la API se ha "
-                "alcanzado y el asistente está pausado para todos hasta que Gemini la "
-                "restablezca (cada día a las 00:00 UTC · `02:00h` en verano / `01:00h` "
-                "en invierno en España). ¡Hasta mañana! 🌙"
-            )
-        if any(k in error_str for k in ('403', 'API_KEY_INVALID', 'invalid api key')):
-            return None, "❌ Clave de API no válida. Revisa la configuración en .env (GEMINI_API_KEY)."
+        return None, describe_api_error(organization, exc)
+
+    def chunks():
+        start = time.perf_counter()
+        first = True
+        ok = False
+        try:
+            for chunk in chat.send_message_stream(user_message):
+                if first:
+                    _record_latency('chat_stream_first_chunk', time.perf_counter() - start)
+                    first = False
+                if chunk.text:
+                    yield chunk.text
+            ok = True
+        finally:
+            _record_latency('chat_stream', time.perf_counter() - start, ok)
 
-        return None, f"❌ Error inesperado al conectar con el asistente. Detalles: {error_str}"
+    return chunks(), None
+
+
+SUMMARY_MAX_WORDS = 200
+_SUMMARY_MESSAGE_CHARS = 2000  # los mensajes muy largos se recortan al resumir
+
+
+def summarize_conversation(organization, previous_summary: str | None, messages) -> str | None:
+    """
+    Resumen actualizado de una conversación: `previous_summary` más `messages`
+    (ChatMessage en orden). None si no hay API o falla la llamada.
+    """
+    if not getattr(settings, 'GEMINI_API_KEY', None) or is_quota_exhausted():
+        return None
+
+    transcript = '\n'.join(
+        f"{'Usuario' if m.role == 'user' else 'Asistente'}: {m.content[:_SUMMARY_MESSAGE_CHARS]}"
+        for m in messages
+    )
+    prompt = (
+        "Resume la conversación entre un usuario de AgroGest y su asistente agrícola para "
+        "poder continuarla. Conserva los datos concretos (parcelas, productos, dosis, fechas, "
+        "cálculos y decisiones) y lo que quede pendiente; omite saludos y formato. "
+        f"Máximo {SUMMARY_MAX_WORDS} palabras, en español, en texto plano.\n\n"
+        f"Resumen anterior:\n{previous_summary or '(ninguno)'}\n\n"
+        f"Mensajes nuevos:\n{transcript}"
+    )
+    from google.genai import types
+
+    try:
+        with _timed('summary'):
+            response = _get_client().models.generate_content(
+                model=getattr(settings, 'GEMINI_MODEL', 'gemini-2.0-flash-lite'),
+                contents=prompt,
+                config=types.GenerateContentConfig(
+                    http_options=_http_options('GEMINI_SUMMARY_TIMEOUT', DEFAULT_SUMMARY_TIMEOUT),
+                ),
+            )
+    except Exception as exc:
+        describe_api_error(organization, exc)  # registra el error y activa el breaker si es de cuota
+        return None
+    text = normalize_ai_response(response.text or '').strip()
+    return text or None
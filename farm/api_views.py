@@ -1,4 +1,4 @@
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from decimal import Decimal
 
 from django.db.models import Sum
@@ -6,6 +6,7 @@ from django.http import JsonResponse
 from django.utils.dateparse import parse_date
 
 from .models import Field, Machine, Product, Treatment, TreatmentProduct
+from .treatment_series import expand_series, get_occurrence, series_for_user
 
 
 def _fmt_dose(value):
@@ -74,23 +75,30 @@ def get_calendar_treatments(request):
     # Consulta base
     treatments = Treatment.ownership_objects.get_queryset_for_user(request.user)
 
+    # Series: sus fechas sin materializar se expanden al vuelo dentro del rango
+    series = series_for_user(request.user)
+
     # Filtrar por fecha
     if start_date:
         treatments = treatments.filter(date__gte=start_date)
+        series = series.filter(end_date__gte=start_date)
     if end_date:
         treatments = treatments.filter(date__lte=end_date)
+        series = series.filter(start_date__lte=end_date)
 
     # Filtrar por campos
     if field_ids and field_ids != 'all':
         field_id_list = [int(id) for id in field_ids.split(',') if id.isdigit()]
         if field_id_list:
             treatments = treatments.filter(field_id__in=field_id_list)
+            series = series.filter(template__field_id__in=field_id_list)
 
     # Filtrar por tipo de tratamiento
     if treatment_types:
         type_list = treatment_types.split(',')
         if type_list:
             treatments = treatments.filter(type__in=type_list)
+            series = series.filter(template__type__in=type_list)
 
     # Preparar datos para el calendario
     result = []
@@ -106,9 +114,56 @@ def get_calendar_treatments(request):
 
         result.append(treatment_data)
 
+    occurrences = expand_series(
+        series,
+        parse_date(start_date) if start_date else None,
+        parse_date(end_date) if end_date else None,
+    )
+    for occurrence in occurrences:
+        t = occurrence.treatment
+        result.append({
+            'id': occurrence.key,
+            'name': t.name,
+            'date': occurrence.date.isoformat(),
+            'finish_date': None,
+            'status': t.status,
+            'status_display': t.get_status_display(),
+            'series': occurrence.series.pk,
+            'virtual': True,
+        })
+
     return JsonResponse(result, safe=False)
 
 
+def _treatment_payload(treatment, products):
+    return {
+        'id': treatment.id,
+        'name': treatment.name,
+        'date': treatment.date.isoformat(),
+        'finish_date': treatment.finish_date.isoformat() if treatment.finish_date else None,
+        'status': treatment.status,
+        'status_display': treatment.get_status_display(),
+        'type': treatment.type,
+        'type_display': dict(Treatment.TYPE_CHOICES).get(treatment.type, ''),
+        'field': treatment.field_id,
+        'field_name': treatment.field.name,
+        'machine_name': str(treatment.machine) if treatment.machine else None,
+        'water_per_ha': treatment.water_per_ha,
+        'real_water_per_ha': treatment.real_water_per_ha,
+        'products': [
+            {
+                'id': tp.product.id,
+                'name': tp.product.name,
+                'dose': _fmt_dose(tp.dose),
+                'dose_type': tp.dose_type,
+                'dose_type_display': dict(tp.product.ALL_DOSE_TYPE_CHOICES).get(tp.dose_type, ''),
+                'total_dose': _fmt_dose(tp.total_dose),
+                'total_dose_unit': tp.total_dose_unit
+            } for tp in products
+        ]
+    }
+
+
 def treatment_detail(request, treatment_id):
     try:
         treatment = (Treatment.ownership_objects.get_queryset_for_user(request.user).select_related('field', 'machine')
@@ -116,37 +171,31 @@ def treatment_detail(request, treatment_id):
                      .get(id=treatment_id))
         products = treatment.treatmentproduct_set.all()
 
-        return JsonResponse({
-            'id': treatment.id,
-            'name': treatment.name,
-            'date': treatment.date.isoformat(),
-            'finish_date': treatment.finish_date.isoformat() if treatment.finish_date else None,
-            'status': treatment.status,
-            'status_display': treatment.get_status_display(),
-            'type': treatment.type,
-            'type_display': dict(Treatment.TYPE_CHOICES).get(treatment.type, ''),
-            'field': treatment.field_id,
-            'field_name': treatment.field.name,
-            'machine_name': str(treatment.machine) if treatment.machine else None,
-            'water_per_ha': treatment.water_per_ha,
-            'real_water_per_ha': treatment.real_water_per_ha,
-            'products': [
-                {
-                    'id': tp.product.id,
-                    'name': tp.product.name,
-                    'dose': _fmt_dose(tp.dose),
-                    'dose_type': tp.dose_type,
-                    'dose_type_display': dict(tp.product.ALL_DOSE_TYPE_CHOICES).get(tp.dose_type, ''),
-                    'total_dose': _fmt_dose(tp.total_dose),
-                    'total_dose_unit': tp.total_dose_unit
-                } for tp in products
-            ]
-        })
+        return JsonResponse(_treatment_payload(treatment, products))
 
     except Treatment.DoesNotExist:
         return JsonResponse({'error': 'Tratamiento no encontrado'}, status=404)
 
 
+def series_occurrence_detail(request, series_id, day):
+    """Como treatment_detail, para una fecha de una serie aún sin materializar."""
+    try:
+        occurrence_date = date.fromisoformat(day)
+    except ValueError:
+        occurrence_date = None
+    series = series_for_user(request.user).filter(id=series_id).first()
+    occurrence = (
+        get_occurrence(series, occurrence_date, with_products=True)
+        if series is not None and occurrence_date is not None else None
+    )
+    if occurrence is None:
+        return JsonResponse({'error': 'Tratamiento no encontrado'}, status=404)
+
+    data = _treatment_payload(occurrence.treatment, occurrence.products)
+    data.update({'id': occurrence.key, 'series': series.pk, 'virtual': True})
+    return JsonResponse(data)
+
+
 def field_costs_data(request):
     # Obtener fechas de filtro o usar valores predeterminados (último año)
     end_date = datetime.now().date()
@@ -215,19 +264,43 @@ def field_costs_data(request):
     })
 
 
+def _weather_payload(request):
+    """Formato pedido con ?payload=compact|columns (por defecto, la respuesta completa)."""
+    from .weather_service import PAYLOAD_FULL, PAYLOAD_MODES
+
+    payload = request.GET.get('payload', PAYLOAD_FULL)
+    return payload if payload in PAYLOAD_MODES else PAYLOAD_FULL
+
+
+def _weather_disabled_response():
+    """503 si el módulo del tiempo está desactivado (desde el admin o automáticamente)."""
+    from core.models import is_enabled
+
+    if is_enabled('WEATHER'):
+        return None
+    return JsonResponse({"error": "El módulo del tiempo está desactivado en este momento."}, status=503)
+
+
 def get_field_weather(request, field_id):
     """
     Devuelve la previsión meteorológica de una parcela usando AEMET OpenData.
-    GET /api/fields/<field_id>/weather/
+    GET /api/fields/<field_id>/weather/?payload=compact|columns
     """
-    from .weather_service import get_weather_for_field
+    from .weather_service import get_weather_for_field, is_aemet_unavailable
+
+    disabled = _weather_disabled_response()
+    if disabled:
+        return disabled
 
     try:
         field = Field.ownership_objects.get_queryset_for_user(request.user).get(pk=field_id)
     except Field.DoesNotExist:
         return JsonResponse({"error": "Parcela no encontrada"}, status=404)
 
-    weather = get_weather_for_field(field)
+    weather = get_weather_for_field(field, payload=_weather_payload(request))
+    if weather is None and is_aemet_unavailable():
+        return JsonResponse({"error": "AEMET no responde en este momento; inténtalo de nuevo en unos minutos."},
+                            status=503)
     if weather is None:
         return JsonResponse(
             {"error": "No se pueden obtener datos meteorológicos. La parcela no tiene coordenadas definidas."},
@@ -237,6 +310,53 @@ def get_field_weather(request, field_id):
     return JsonResponse(weather)
 
 
+def get_fields_weather(request):
+    """
+    Previsión meteorológica de varias parcelas en una sola respuesta.
+    GET /api/fields/weather/?ids=1,2,3&payload=compact   (sin ids: todas las parcelas con geometría)
+
+    Cada municipio AEMET se descarga una única vez aunque tenga varias parcelas;
+    ver weather_service.get_weather_for_fields para el formato de la respuesta.
+    """
+    from .weather_service import get_weather_for_fields, is_aemet_unavailable
+
+    disabled = _weather_disabled_response()
+    if disabled:
+        return disabled
+
+    fields = Field.ownership_objects.get_queryset_for_user(request.user).exclude(geometry="")
+    field_ids = request.GET.get('ids', '')
+    if field_ids:
+        fields = fields.filter(id__in=[int(id) for id in field_ids.split(',') if id.isdigit()])
+
+    result = get_weather_for_fields(fields, payload=_weather_payload(request))
+    # Breaker abierto y nada en caché: 503 inmediato para que la página lo muestre como caída de AEMET
+    status = 503 if result["errors"] and not result["municipalities"] and is_aemet_unavailable() else 200
+    return JsonResponse(result, status=status)
+
+
+def get_fields_treatment_windows(request):
+    """
+    Mejores ventanas próximas para aplicar tratamientos en cada parcela, según la previsión horaria.
+    GET /api/fields/treatment-windows/?ids=1,2,3   (sin ids: todas las parcelas con geometría)
+
+    Las ventanas se calculan al refrescar la caché de previsiones; ver
+    weather_service.get_treatment_windows_for_fields para el formato.
+    """
+    from .weather_service import get_treatment_windows_for_fields
+
+    disabled = _weather_disabled_response()
+    if disabled:
+        return disabled
+
+    fields = Field.ownership_objects.get_queryset_for_user(request.user).exclude(geometry="")
+    field_ids = request.GET.get('ids', '')
+    if field_ids:
+        fields = fields.filter(id__in=[int(id) for id in field_ids.split(',') if id.isdigit()])
+
+    return JsonResponse(get_treatment_windows_for_fields(fields))
+
+
 def get_field_product_breakdown(user, fields_or_field, start_date, end_date):
     # Preparar filtro de parcelas
     if hasattr(fields_or_field, '__iter__') and not isinstance(fields_or_field, Field):
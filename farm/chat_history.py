@@ -0,0 +1,133 @@
+"""
+Historial de las conversaciones con el asistente.
+
+Al modelo solo se le envían los últimos mensajes tal cual; los anteriores se
+van plegando en un resumen acumulado por sesión (ChatSummary). Cuando los
+mensajes sin resumir superan COMPACT_AFTER, todos menos los KEEP_RECENT últimos
+se resumen junto con el resumen anterior en una sola llamada al modelo.
+
+La compactación se lanza en un hilo aparte tras responder
+(compact_in_background) para que la llamada de resumen no ocupe la petición.
+
+Las sesiones sin actividad se borran en bloque con
+`python manage.py prune_chat_history` (ver prune_sessions).
+"""
+import logging
+import threading
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import connections
+from django.db.models import Max
+from django.utils import timezone
+
+from farm.models import ChatMessage, ChatSummary
+
+logger = logging.getLogger(__name__)
+
+KEEP_RECENT = 6  # mensajes que siguen enviándose literalmente tras resumir
+COMPACT_AFTER = 14  # mensajes sin resumir a partir de los que se resume
+SUMMARY_MAX_CHARS = 3000  # tope duro por si el modelo se extiende
+COMPACT_LOCK_TTL = 60  # > GEMINI_SUMMARY_TIMEOUT: una sola compactación por sesión a la vez
+RETENTION_DAYS = 90
+PRUNE_BATCH = 500  # sesiones por DELETE
+
+
+def load_history(organization, session_id: str, limit: int) -> tuple:
+    """
+    (resumen o None, últimos `limit` mensajes aún sin resumir en orden cronológico).
+    Si resumir falla durante un tiempo, `limit` sigue acotando lo que se envía.
+    """
+    summary = ChatSummary.objects.filter(organization=organization, session_id=session_id).first()
+    covered = summary.covered_until_id if summary else 0
+    # Django no soporta índices negativos en querysets: ordenamos desc, cortamos y revertimos
+    recent = list(
+        ChatMessage.objects.filter(
+            organization=organization,
+            session_id=session_id,
+            id__gt=covered,
+        ).order_by('-id')[:limit]
+    )[::-1]
+    return (summary.content if summary else None), recent
+
+
+def compact_history(organization, session_id: str) -> bool:
+    """
+    Pliega en el resumen los mensajes antiguos de la sesión si hay más de
+    COMPACT_AFTER sin resumir. Devuelve True si ha actualizado el resumen.
+    No lanza: si el modelo no responde se reintentará en el siguiente turno.
+    """
+    from farm.ai_service import summarize_conversation
+
+    summary = ChatSummary.objects.filter(organization=organization, session_id=session_id).first()
+    covered = summary.covered_until_id if summary else 0
+    pending = list(
+        ChatMessage.objects.filter(
+            organization=organization,
+            session_id=session_id,
+            id__gt=covered,
+        ).order_by('id')
+    )
+    if len(pending) <= COMPACT_AFTER:
+        return False
+
+    to_fold = pending[:-KEEP_RECENT]
+    content = summarize_conversation(organization, summary.content if summary else None, to_fold)
+    if content is None:
+        logger.info("No se pudo resumir el chat [org=%s, sesión=%s]", organization.id, session_id)
+        return False
+
+    ChatSummary.objects.update_or_create(
+        session_id=session_id,
+        defaults={
+            'organization': organization,
+            'content': content[:SUMMARY_MAX_CHARS],
+            'covered_until_id': to_fold[-1].id,
+        },
+    )
+    return True
+
+
+def compact_in_background(organization, session_id: str) -> None:
+    """Lanza compact_history en un hilo para no retener la petición (ni el worker) esperando al modelo."""
+    lock_key = f"chat_compact_lock:{session_id}"
+    if not cache.add(lock_key, 1, timeout=COMPACT_LOCK_TTL):
+        return  # ya hay una compactación en marcha para esta sesión
+
+    def run():
+        try:
+            compact_history(organization, session_id)
+        except Exception:  # noqa: BLE001 — un fallo aquí nunca debe tumbar el worker
+            logger.exception("Error resumiendo el chat [org=%s, sesión=%s]", organization.id, session_id)
+        finally:
+            cache.delete(lock_key)
+            connections.close_all()
+
+    threading.Thread(target=run, name=f"chat-compact-{session_id[:8]}", daemon=True).start()
+
+
+def clear_session(organization, session_id: str) -> None:
+    ChatMessage.objects.filter(organization=organization, session_id=session_id).delete()
+    ChatSummary.objects.filter(organization=organization, session_id=session_id).delete()
+
+
+def stale_sessions(days: int = RETENTION_DAYS) -> list:
+    """Sesiones cuyo último mensaje es anterior a hace `days` días."""
+    cutoff = timezone.now() - timedelta(days=days)
+    return list(
+        ChatMessage.objects
+        .values('session_id')
+        .annotate(last=Max('created_at'))
+        .filter(last__lt=cutoff)
+        .values_list('session_id', flat=True)
+    )
+
+
+def prune_sessions(session_ids: list, batch_size: int = PRUNE_BATCH) -> int:
+    """Borra los mensajes y resúmenes de las sesiones dadas, por lotes. Devuelve los mensajes borrados."""
+    deleted = 0
+    for start in range(0, len(session_ids), batch_size):
+        batch = session_ids[start:start + batch_size]
+        deleted += ChatMessage.objects.filter(session_id__in=batch).delete()[0]
+        ChatSummary.objects.filter(session_id__in=batch).delete()
+    return deleted
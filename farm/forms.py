@@ -6,9 +6,13 @@ from django import forms
 from django.core.exceptions import ValidationError
 from django.forms import BaseInlineFormSet
 from django.forms import inlineformset_factory
+from django.utils.functional import cached_property
+from django.utils.timezone import now
 
 from core.forms import NoPlaceholderModelForm
-from .models import Treatment, TreatmentProduct, Expense, Product, Harvest, ProductType, Field, StoragePoint
+from .ai_context import bump_context_version
+from .models import Treatment, TreatmentProduct, TreatmentSeries, Expense, Product, Harvest, ProductType, Field, \
+    StoragePoint
 
 
 class TreatmentForm(forms.ModelForm):
@@ -85,10 +89,28 @@ def _normalize_dose(value):
     return f"{value:.3f}".rstrip('0').rstrip('.')
 
 
+class PrefetchedModelChoiceField(forms.ModelChoiceField):
+    """
+    ModelChoiceField que resuelve el valor en `prefetched` ({str(pk): objeto}) si
+    el formset lo ha cargado, en vez de hacer una consulta por formulario.
+    """
+    prefetched = None
+
+    def to_python(self, value):
+        if self.prefetched is None or value in self.empty_values:
+            return super().to_python(value)
+        try:
+            return self.prefetched[str(value)]
+        except KeyError:
+            raise ValidationError(self.error_messages['invalid_choice'], code='invalid_choice',
+                                  params={'value': value})
+
+
 class TreatmentProductForm(forms.ModelForm):
     class Meta:
         model = TreatmentProduct
         fields = ['product', 'dose', 'total_dose']
+        field_classes = {'product': PrefetchedModelChoiceField}
         widgets = {
             'dose': forms.NumberInput(attrs={'step': '0.001'}),
             'total_dose': forms.NumberInput(attrs={'step': '0.001'}),
@@ -114,6 +136,14 @@ class TreatmentProductForm(forms.ModelForm):
         """
         pass
 
+    def _get_validation_exclusions(self):
+        # El campo ya ha comprobado que el producto existe en su queryset: así el modelo
+        # no repite la comprobación de la clave ajena con otra consulta por producto.
+        # Esto también salta la unicidad (treatment, product) del formset: la comprueba clean().
+        exclude = super()._get_validation_exclusions()
+        exclude.add('product')
+        return exclude
+
     def clean_dose(self):
         dose = self.cleaned_data.get('dose')
         if dose is not None:
@@ -127,7 +157,8 @@ class BaseTreatmentProductFormSet(BaseInlineFormSet):
         """
         Valida que:
         - Al menos un producto esté siendo usado.
-        - No haya productos duplicados entre los formularios no eliminados.
+        - No haya productos duplicados entre los formularios no eliminados
+          (tengan o no dosis: la BD tiene unique_together en treatment/product).
         """
         super().clean()
 
@@ -142,26 +173,63 @@ class BaseTreatmentProductFormSet(BaseInlineFormSet):
             product = form.cleaned_data.get('product')
             dose = form.cleaned_data.get('dose')
 
-            if product and dose:
-                if product.pk in seen_products:
-                    raise forms.ValidationError(
-                        f"El producto '{product.name}' está duplicado. "
-                        f"Cada producto solo puede aparecer una vez en el tratamiento."
-                    )
-                seen_products[product.pk] = True
+            if not product:
+                continue
+            if product.pk in seen_products:
+                raise forms.ValidationError(
+                    f"El producto '{product.name}' está duplicado. "
+                    f"Cada producto solo puede aparecer una vez en el tratamiento."
+                )
+            seen_products[product.pk] = True
+            if dose:
                 valid_forms += 1
 
         if valid_forms < 1:
             raise forms.ValidationError("Debe agregar al menos un producto al tratamiento.")
 
+    @cached_property
+    def selected_products(self):
+        """{str(pk): Product} de los productos enviados en todos los formularios, en una consulta."""
+        if not self.is_bound:
+            return None
+        ids = {self.data.get(f'{self.add_prefix(i)}-product') for i in range(self.total_form_count())}
+        ids = [pk for pk in ids if pk and str(pk).isdigit()]
+        queryset = self.form.base_fields['product'].queryset
+        return {str(product.pk): product for product in queryset.filter(pk__in=ids)}
+
+    @cached_property
+    def existing_objects(self):
+        """{str(pk): TreatmentProduct} de las filas que ya tiene el tratamiento (consulta del formset)."""
+        if not self.is_bound:
+            return None
+        return {str(obj.pk): obj for obj in self.get_queryset()}
+
+    def add_fields(self, form, index):
+        super().add_fields(form, index)
+        form.fields['product'].prefetched = self.selected_products
+        # El id de las filas existentes se busca entre las ya cargadas por el formset
+        pk_name = self._pk_field.name
+        pk_field = form.fields[pk_name]
+        form.fields[pk_name] = PrefetchedModelChoiceField(
+            pk_field.queryset, initial=pk_field.initial, required=False, widget=pk_field.widget,
+        )
+        form.fields[pk_name].prefetched = self.existing_objects
+
     def save(self, commit=True):
         """
-        Asigna el campo `position` a cada instancia según el orden visual
-        del formulario antes de delegar el guardado al padre.
-        Esto garantiza el orden correcto independientemente del ID asignado por la BD
-        (crítico en PostgreSQL con connection pooling, donde los IDs no son estrictamente secuenciales).
+        Asigna `position` a cada producto según el orden visual del formulario
+        (independiente del ID asignado por la BD, crítico en PostgreSQL con
+        connection pooling, donde los IDs no son estrictamente secuenciales) y
+        guarda en bloque: un DELETE para los borrados, un bulk_update para los
+        modificados y un bulk_create para los nuevos. Dosis y precios se calculan
+        en memoria con el tratamiento del formset (TreatmentProduct.apply_calculations),
+        así que el número de consultas no depende del número de productos.
+
+        Como en Django, los borrados van antes que las inserciones, para que
+        borrar y volver a añadir el mismo producto funcione.
         """
         position = 0
+        moved = set()  # filas existentes que solo cambian de posición
         for form in self.forms:
             if not getattr(form, 'cleaned_data', None):
                 continue
@@ -169,9 +237,47 @@ class BaseTreatmentProductFormSet(BaseInlineFormSet):
                 continue
             if not form.cleaned_data.get('product'):
                 continue
+            if form.instance.pk is not None and form.instance.position != position:
+                moved.add(form)
             form.instance.position = position
             position += 1
-        return super().save(commit=commit)
+        if not commit:
+            return super().save(commit=False)
+
+        self.new_objects, self.changed_objects, self.deleted_objects = [], [], []
+        to_update = []
+        for form in self.initial_forms:
+            obj = form.instance
+            if obj.pk is None:
+                continue
+            if form in self.deleted_forms:
+                self.deleted_objects.append(obj)
+            elif form.has_changed() or form in moved:
+                self.changed_objects.append((obj, form.changed_data))
+                to_update.append(obj)
+        for form in self.extra_forms:
+            if not form.has_changed() or (self.can_delete and self._should_delete_form(form)):
+                continue
+            self.new_objects.append(form.instance)
+
+        updated_at = now()
+        for obj in [*to_update, *self.new_objects]:
+            obj.treatment = self.instance
+            obj.apply_calculations(is_new=obj.pk is None)
+            obj.updated_at = updated_at
+
+        if self.deleted_objects:
+            TreatmentProduct.objects.filter(pk__in=[obj.pk for obj in self.deleted_objects]).delete()
+        if to_update:
+            TreatmentProduct.objects.bulk_update(
+                to_update, [*TreatmentProduct.CALCULATED_FIELDS, 'product', 'position'],
+            )
+        if self.new_objects:
+            TreatmentProduct.objects.bulk_create(self.new_objects)
+        if to_update or self.new_objects:
+            # bulk_update/bulk_create no lanzan señales
+            bump_context_version(self.instance.organization_id)
+        return [*to_update, *self.new_objects]
 
 
 TreatmentProductFormSet = inlineformset_factory(
@@ -187,6 +293,43 @@ TreatmentProductFormSet = inlineformset_factory(
 
 
 
+class TreatmentSeriesForm(forms.ModelForm):
+    class Meta:
+        model = TreatmentSeries
+        fields = ['weekday', 'interval_weeks', 'start_date', 'end_date']
+        labels = {
+            'weekday': 'Día de la semana',
+            'interval_weeks': 'Cada (semanas)',
+            'start_date': 'Desde',
+            'end_date': 'Hasta',
+        }
+        widgets = {
+            'weekday': forms.Select(attrs={'class': 'form-select'}),
+            'interval_weeks': forms.NumberInput(attrs={'class': 'form-control', 'min': '1', 'max': '52'}),
+            'start_date': forms.DateInput(attrs={'type': 'date', 'class': 'form-control'}),
+            'end_date': forms.DateInput(attrs={'type': 'date', 'class': 'form-control'}),
+        }
+
+    def clean_interval_weeks(self):
+        interval = self.cleaned_data.get('interval_weeks')
+        if not interval or interval > 52:
+            raise ValidationError('Indica un intervalo entre 1 y 52 semanas')
+        return interval
+
+    def clean(self):
+        from .treatment_series import MAX_SERIES_DAYS
+
+        cleaned = super().clean()
+        start = cleaned.get('start_date')
+        end = cleaned.get('end_date')
+        if start and end:
+            if end < start:
+                self.add_error('end_date', 'La fecha final no puede ser anterior a la inicial')
+            elif (end - start).days > MAX_SERIES_DAYS:
+                self.add_error('end_date', f'Una repetición puede durar como mucho {MAX_SERIES_DAYS} días')
+        return cleaned
+
+
 class ExpenseForm(forms.ModelForm):
     class Meta:
         model = Expense
@@ -0,0 +1,93 @@
+"""
+Utilidades de geometría para las parcelas (GeoJSON guardado en Field.geometry).
+
+Se calculan al guardar la parcela y se almacenan en columnas propias, de modo
+que el tiempo, los mapas y cualquier consulta espacial leen el centroide y la
+bounding box sin volver a parsear el GeoJSON.
+"""
+import json
+
+
+def _outer_ring(geometry: dict):
+    geo_type = geometry.get("type")
+    coords = geometry.get("coordinates")
+    if not coords:
+        return None
+    if geo_type == "Point":
+        return [coords]
+    if geo_type == "Polygon":
+        return coords[0]
+    if geo_type == "MultiPolygon":
+        return coords[0][0]
+    return None
+
+
+def _all_positions(geometry: dict):
+    geo_type = geometry.get("type")
+    coords = geometry.get("coordinates") or []
+    if geo_type == "Point":
+        return [coords]
+    if geo_type == "Polygon":
+        return [p for ring in coords for p in ring]
+    if geo_type == "MultiPolygon":
+        return [p for polygon in coords for ring in polygon for p in ring]
+    return []
+
+
+def parse_geometry(geometry_json: str) -> dict | None:
+    """Parsea el GeoJSON de una parcela; un Feature se desenvuelve a su geometría."""
+    try:
+        geojson = json.loads(geometry_json)
+    except (json.JSONDecodeError, TypeError):
+        return None
+    if not isinstance(geojson, dict):
+        return None
+    if geojson.get("type") == "Feature":
+        geojson = geojson.get("geometry") or {}
+    return geojson if isinstance(geojson, dict) else None
+
+
+def centroid(geometry: dict) -> tuple[float, float] | None:
+    """
+    (lat, lon) del centroide: media de los vértices del anillo exterior
+    (del primer polígono si es MultiPolygon).
+    """
+    ring = _outer_ring(geometry)
+    if not ring:
+        return None
+    lons = [p[0] for p in ring]
+    lats = [p[1] for p in ring]
+    return sum(lats) / len(lats), sum(lons) / len(lons)
+
+
+def bounding_box(geometry: dict) -> tuple[float, float, float, float] | None:
+    """(min_lat, min_lon, max_lat, max_lon) de todos los vértices de la geometría."""
+    positions = _all_positions(geometry)
+    if not positions:
+        return None
+    lons = [p[0] for p in positions]
+    lats = [p[1] for p in positions]
+    return min(lats), min(lons), max(lats), max(lons)
+
+
+def geometry_summary(geometry_json: str) -> dict:
+    """
+    Valores derivados a guardar en Field: centroid_lat/lon y bbox_*.
+    Todos None si la geometría está vacía o no es válida.
+    """
+    summary = dict.fromkeys(
+        ("centroid_lat", "centroid_lon", "bbox_min_lat", "bbox_min_lon", "bbox_max_lat", "bbox_max_lon")
+    )
+    geometry = parse_geometry(geometry_json) if geometry_json else None
+    if not geometry:
+        return summary
+    try:
+        center = centroid(geometry)
+        bbox = bounding_box(geometry)
+    except (TypeError, IndexError, KeyError):
+        return summary
+    if center:
+        summary["centroid_lat"], summary["centroid_lon"] = center
+    if bbox:
+        summary["bbox_min_lat"], summary["bbox_min_lon"], summary["bbox_max_lat"], summary["bbox_max_lon"] = bbox
+    return summary
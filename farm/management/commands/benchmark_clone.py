@@ -0,0 +1,94 @@
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from accounts.models import Organization
+from farm.models import Field, Machine, Product, ProductType, Treatment, TreatmentProduct
+from farm.services import CloneTarget, clone_treatments
+
+_COMPARED_FIELDS = ('dose', 'dose_type', 'total_dose', 'total_dose_unit', 'unit_price', 'total_price', 'price_per_ha')
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark del clonado de tratamientos: un clone_to_field por destino frente a "
+        "clone_treatments en bloque (repetir cada semana y clonar a varias parcelas). "
+        "Trabaja con datos de prueba dentro de una transacción que se deshace al terminar."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dates', type=int, default=26, help='Repeticiones semanales (misma parcela)')
+        parser.add_argument('--fields', type=int, default=10, help='Parcelas de destino del clonado')
+        parser.add_argument('--products', type=int, default=6, help='Productos del tratamiento original')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            treatment, fields = self._fixture(options['fields'], options['products'])
+            start = treatment.date
+            scenarios = [
+                (f"Repetir {options['dates']} semanas",
+                 [CloneTarget(treatment.field, start + timedelta(weeks=i + 1)) for i in range(options['dates'])]),
+                (f"Clonar a {len(fields)} parcelas", [CloneTarget(f) for f in fields]),
+            ]
+            self.stdout.write(f"Tratamiento con {options['products']} productos")
+            for label, targets in scenarios:
+                row_result, row_queries, row_s = self._measure(lambda: [
+                    treatment.clone_to_field(t.field, new_date=t.new_date, new_name=t.new_name) for t in targets
+                ])
+                bulk_result, bulk_queries, bulk_s = self._measure(lambda: clone_treatments(treatment, targets))
+
+                self.stdout.write(f"  {label}")
+                self.stdout.write(f"    Uno a uno:  {row_queries:5d} consultas · {row_s * 1000:8.1f} ms")
+                self.stdout.write(f"    En bloque:  {bulk_queries:5d} consultas · {bulk_s * 1000:8.1f} ms")
+                if self._products(row_result) == self._products(bulk_result):
+                    self.stdout.write(self.style.SUCCESS("    Dosis y precios idénticos"))
+                else:
+                    self.stdout.write(self.style.ERROR("    Dosis o precios distintos entre ambos métodos"))
+            transaction.set_rollback(True)
+
+    @staticmethod
+    def _measure(fn):
+        with CaptureQueriesContext(connection) as ctx:
+            t0 = time.perf_counter()
+            result = fn()
+            elapsed = time.perf_counter() - t0
+        return result, len(ctx.captured_queries), elapsed
+
+    @staticmethod
+    def _products(treatments):
+        return [
+            list(TreatmentProduct.objects.filter(treatment=t).order_by('position').values_list(*_COMPARED_FIELDS))
+            for t in treatments
+        ]
+
+    @staticmethod
+    def _fixture(n_fields, n_products):
+        organization = Organization.objects.create(name="Benchmark clonado")
+        fields = [
+            Field.objects.create(organization=organization, name=f"Parcela {i}", area=2.5 + i,
+                                 crop="Olivo", planting_year=2015)
+            for i in range(n_fields + 1)
+        ]
+        machine = Machine.objects.create(organization=organization, name="Atomizador", type="Pulverizador",
+                                         capacity=2000)
+        product_type = ProductType.objects.create(organization=organization, name="Fungicida")
+        treatment = Treatment.objects.create(
+            organization=organization, field=fields[0], machine=machine, name="Programa semanal",
+            type='spraying', date=date.today(), water_per_ha=800,
+        )
+        dose_types = ['l_per_1000l', 'kg_per_ha', 'pct', 'kg_per_1000l', 'l_per_ha']
+        for i in range(n_products):
+            dose_type = dose_types[i % len(dose_types)]
+            product = Product.objects.create(
+                organization=organization, product_type=product_type, name=f"Producto {i}",
+                spraying_dose=Decimal('1.5'), spraying_dose_type=dose_type, price=Decimal('18.40'),
+            )
+            TreatmentProduct.objects.create(
+                treatment=treatment, product=product, dose=Decimal('1.5') + i, dose_type=dose_type,
+                total_dose=0, total_dose_unit='L', position=i,
+            )
+        return treatment, fields[1:]
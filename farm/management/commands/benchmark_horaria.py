@@ -0,0 +1,224 @@
+import json
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from farm.aemet_replay import DEFAULT_RECORDING_DIR
+from farm.weather_service import _parse_float_precip, _parse_horaria, _periodo_range, _sky_info
+
+DEFAULT_PAYLOADS = sorted(DEFAULT_RECORDING_DIR.glob("horaria_*.json"))
+
+
+# ── Implementación de referencia ──────────────────────────────────────
+# Copia del parser anterior, para medir la mejora y comprobar que la salida es idéntica.
+
+def _interpolate_map(known: dict, h_start: int, h_end: int) -> dict:
+    """Interpola linealmente los valores de temp/hum entre horas conocidas."""
+    result = dict(known)
+    hours = sorted(known.keys())
+    if len(hours) < 2:
+        return result
+    for i in range(len(hours) - 1):
+        h0, h1 = hours[i], hours[i + 1]
+        if h1 <= h0:
+            continue
+        v0, v1 = known[h0], known[h1]
+        for hh in range(h0 + 1, h1):
+            t = (hh - h0) / (h1 - h0)
+            result[hh] = round(v0 + (v1 - v0) * t, 1)
+    return result
+
+
+def parse_horaria_reference(raw_list) -> list:
+    """Implementación anterior de weather_service._parse_horaria (un dict por variable y hora)."""
+    if not raw_list or not isinstance(raw_list, list):
+        return []
+    pred_root = raw_list[0]
+    dias = pred_root.get("prediccion", {}).get("dia", [])
+    hourly_list = []
+    for dia in dias:
+        fecha_str = (dia.get("fecha") or "")[:10]
+        if not fecha_str:
+            continue
+
+        # ── Temperatura instante (puede venir cada 1 o 2 horas) ──
+        temp_map_raw = {}
+        for t in dia.get("temperatura", []):
+            h = t.get("hora")
+            v = t.get("value")
+            if h is not None and v not in (None, ""):
+                try:
+                    temp_map_raw[int(h)] = float(v)
+                except (ValueError, TypeError):
+                    pass
+        # Interpolar temperatura para todas las horas intermedias
+        temp_map = _interpolate_map(temp_map_raw, 0, 24) if temp_map_raw else {}
+
+        # ── Humedad instante ──
+        hum_map_raw = {}
+        for hm in dia.get("humedadRelativa", []):
+            h = hm.get("hora")
+            v = hm.get("value")
+            if h is not None and v not in (None, ""):
+                try:
+                    hum_map_raw[int(h)] = float(v)
+                except (ValueError, TypeError):
+                    pass
+        hum_map = _interpolate_map(hum_map_raw, 0, 24) if hum_map_raw else {}
+
+        # ── Precipitación por periodo — expandir a todas las horas del bloque ──
+        # El valor del periodo se reparte entre las horas (solo se muestra en la
+        # hora de inicio del bloque para no inflar el total).
+        precip_map = {}  # hora → mm (solo hora inicio del bloque)
+        for p in dia.get("precipitacion", []):
+            rng = _periodo_range(str(p.get("periodo", "")))
+            v = _parse_float_precip(p.get("value"))
+            if rng is not None and v is not None:
+                h_start, h_end = rng
+                # Asignar el total del bloque a la hora de inicio
+                precip_map[h_start] = precip_map.get(h_start, 0.0) + v
+
+        # ── Probabilidad precipitación — expandir bloques a horas ──
+        prob_map = {}
+        for p in dia.get("probPrecipitacion", []):
+            rng = _periodo_range(str(p.get("periodo", "")))
+            v = p.get("value")
+            if rng is None or v in (None, ""):
+                continue
+            try:
+                val = int(v)
+            except (ValueError, TypeError):
+                continue
+            h_start, h_end = rng
+            for hh in range(h_start, max(h_end, h_start + 1)):
+                prob_map[hh] = val
+
+        # ── Viento por periodo — expandir a todas las horas del bloque ──
+        wind_map = {}
+        gust_map = {}
+        for w in dia.get("vientoAndRachaMax", []):
+            rng = _periodo_range(str(w.get("periodo", "")))
+            if rng is None:
+                continue
+            h_start, h_end = rng
+            vels = w.get("velocidad", [])
+            wind_val = None
+            if vels:
+                try:
+                    wind_val = float(vels[0])
+                except (ValueError, TypeError, IndexError):
+                    pass
+            racha = w.get("value")
+            gust_val = None
+            if racha is not None:
+                try:
+                    gust_val = float(racha)
+                except (ValueError, TypeError):
+                    pass
+            for hh in range(h_start, max(h_end, h_start + 1)):
+                if wind_val is not None:
+                    wind_map[hh] = wind_val
+                if gust_val is not None:
+                    gust_map[hh] = gust_val
+
+        # ── Estado cielo por periodo — expandir a todas las horas del bloque ──
+        sky_map = {}
+        for s in dia.get("estadoCielo", []):
+            rng = _periodo_range(str(s.get("periodo", "")))
+            v = s.get("value", "")
+            if rng is not None and v:
+                h_start, h_end = rng
+                for hh in range(h_start, max(h_end, h_start + 1)):
+                    if hh not in sky_map:  # no sobreescribir si ya hay dato más específico
+                        sky_map[hh] = v
+
+        # ── Generar horas 0-23 completas cuando hay datos de temperatura ──
+        if temp_map:
+            all_hours = list(range(24))
+        else:
+            all_hours = sorted(
+                set(list(hum_map) + list(precip_map) + list(wind_map) + list(sky_map))
+            )
+
+        for hr in all_hours:
+            sky_code = sky_map.get(hr, "")
+            # Buscar sky_code en horas cercanas si no hay dato exacto
+            if not sky_code:
+                for delta in range(1, 7):
+                    if hr - delta >= 0 and sky_map.get(hr - delta):
+                        sky_code = sky_map[hr - delta]
+                        break
+            sky = _sky_info(sky_code)
+            p_mm = precip_map.get(hr, 0.0)
+            p_prob = prob_map.get(hr, 0)
+            w_kmh = wind_map.get(hr, 0.0)
+            # Para horas sin viento exacto, usar el más cercano anterior
+            if w_kmh == 0.0 and hr > 0:
+                for delta in range(1, 7):
+                    if wind_map.get(hr - delta, 0.0) > 0:
+                        w_kmh = wind_map[hr - delta]
+                        break
+            g_kmh = gust_map.get(hr, w_kmh)
+            temp = temp_map.get(hr)
+            hum = int(hum_map[hr]) if hr in hum_map else None
+            wind_level = 0 if w_kmh <= 10 else 1 if w_kmh <= 15 else 2 if w_kmh < 20 else 3
+            treatment_ok = p_prob < 20 and w_kmh <= 20.0
+            hour_str = f"{hr:02d}:00"
+            hourly_list.append({
+                "datetime": f"{fecha_str}T{hour_str}",
+                "date": fecha_str,
+                "hour": hour_str,
+                "precipitation": round(p_mm, 1),
+                "precipitation_probability": p_prob,
+                "wind_speed": round(w_kmh, 1),
+                "wind_gusts": round(g_kmh, 1),
+                "wind_level": wind_level,
+                "temperature": round(temp, 1) if temp is not None else None,
+                "humidity": hum,
+                "weather_code": sky_code,
+                "icon": sky["icon"],
+                "label": sky["label"],
+                "adverse": sky["adverse"],
+                "treatment_ok": treatment_ok,
+            })
+    return hourly_list
+
+
+class Command(BaseCommand):
+    help = (
+        "Micro-benchmark del parser de la predicción horaria AEMET: implementación "
+        "anterior (dicts por variable) frente a la actual (arrays de 24 horas)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('payloads', nargs='*', help='Respuestas horaria de AEMET guardadas en JSON')
+        parser.add_argument('--iterations', type=int, default=500)
+
+    def handle(self, *args, **options):
+        paths = [Path(p) for p in options['payloads']] or DEFAULT_PAYLOADS
+        n = options['iterations']
+        for path in paths:
+            try:
+                payload = json.loads(path.read_text(encoding='utf-8'))
+            except (OSError, ValueError) as exc:
+                raise CommandError(f"No se pudo leer {path}: {exc}")
+
+            t0 = time.perf_counter()
+            for _ in range(n):
+                expected = parse_horaria_reference(payload)
+            reference_s = time.perf_counter() - t0
+
+            t0 = time.perf_counter()
+            for _ in range(n):
+                result = _parse_horaria(payload)
+            current_s = time.perf_counter() - t0
+
+            self.stdout.write(f"{path.name}: {len(result)} horas · {n} iteraciones")
+            self.stdout.write(f"  Anterior: {reference_s / n * 1e6:9.1f} µs/parseo")
+            self.stdout.write(f"  Actual:   {current_s / n * 1e6:9.1f} µs/parseo")
+            self.stdout.write(f"  Aceleración: x{reference_s / current_s:.2f}")
+            if result == expected:
+                self.stdout.write(self.style.SUCCESS("  Salida idéntica a la implementación anterior"))
+            else:
+                self.stdout.write(self.style.ERROR("  La salida difiere de la implementación anterior"))
@@ -0,0 +1,59 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from farm.weather_service import MunicipioIndex
+
+
+def _synthetic_municipios(n, seed):
+    """Catálogo sintético repartido por la bounding box de la España peninsular y Baleares."""
+    rnd = random.Random(seed)
+    return [
+        {"cod": f"{i:05d}", "nombre": f"Municipio {i}", "lat": rnd.uniform(36.0, 43.8), "lon": rnd.uniform(-9.3, 4.3)}
+        for i in range(n)
+    ]
+
+
+class Command(BaseCommand):
+    help = (
+        "Micro-benchmark de la búsqueda del municipio AEMET más cercano: "
+        "recorrido lineal del catálogo frente al índice espacial en rejilla."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--municipios', type=int, default=8100, help='Tamaño del catálogo sintético')
+        parser.add_argument('--queries', type=int, default=2000, help='Número de búsquedas a cronometrar')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        municipios = _synthetic_municipios(options['municipios'], options['seed'])
+        rnd = random.Random(options['seed'] + 1)
+        points = [(rnd.uniform(36.0, 43.8), rnd.uniform(-9.3, 4.3)) for _ in range(options['queries'])]
+
+        t0 = time.perf_counter()
+        index = MunicipioIndex(municipios)
+        build_ms = (time.perf_counter() - t0) * 1000
+
+        t0 = time.perf_counter()
+        scan_results = [
+            min(municipios, key=lambda m: (m["lat"] - lat) ** 2 + (m["lon"] - lon) ** 2)
+            for lat, lon in points
+        ]
+        scan_s = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        index_results = [index.nearest(lat, lon)[0] for lat, lon in points]
+        index_s = time.perf_counter() - t0
+
+        mismatches = sum(1 for a, b in zip(scan_results, index_results) if a is not b)
+        n = len(points)
+        self.stdout.write(f"Catálogo: {len(municipios)} municipios · {n} búsquedas")
+        self.stdout.write(f"  Construcción del índice: {build_ms:.1f} ms")
+        self.stdout.write(f"  Recorrido lineal:        {scan_s / n * 1e6:9.1f} µs/búsqueda")
+        self.stdout.write(f"  Índice en rejilla:       {index_s / n * 1e6:9.1f} µs/búsqueda")
+        self.stdout.write(f"  Aceleración:             x{scan_s / index_s:.0f}")
+        if mismatches:
+            self.stdout.write(self.style.ERROR(f"  {mismatches} resultados distintos del recorrido lineal"))
+        else:
+            self.stdout.write(self.style.SUCCESS("  Resultados idénticos al recorrido lineal"))
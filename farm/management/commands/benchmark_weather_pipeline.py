@@ -0,0 +1,112 @@
+import random
+import statistics
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+
+from farm import weather_service
+from farm.aemet_replay import (
+    DEFAULT_RECORDING_DIR, MUNICIPIOS_PATH, PREDICCION_PATH, load_recording, record, replay_aemet,
+)
+from farm.management.commands.benchmark_weather import _synthetic_municipios
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark del servicio meteorológico sin red: reproduce respuestas AEMET grabadas "
+        "y cronometra carga del catálogo, búsqueda del municipio, parseo, ensamblado y la "
+        "petición completa de N parcelas contra un servidor AEMET local."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recording', default=str(DEFAULT_RECORDING_DIR),
+                            help='Directorio con municipios.json, horaria_<cod>.json y diaria_<cod>.json')
+        parser.add_argument('--fields', type=int, default=200, help='Parcelas simuladas')
+        parser.add_argument('--catalog-size', type=int, default=8100,
+                            help='Completa el catálogo grabado con municipios sintéticos hasta este tamaño')
+        parser.add_argument('--iterations', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--record', nargs='*', metavar='COD',
+                            help='Graba antes desde AEMET (requiere AEMET_API_KEY) el catálogo y estos municipios')
+
+    def handle(self, *args, **options):
+        directory = Path(options['recording'])
+        if options['record'] is not None:
+            written = record(directory, options['record'] or ['41091'])
+            if not written:
+                raise CommandError("No se pudo grabar nada de AEMET (¿AEMET_API_KEY?).")
+            self.stdout.write(f"Grabados {len(written)} ficheros en {directory}")
+
+        payloads = load_recording(directory)
+        if MUNICIPIOS_PATH not in payloads or PREDICCION_PATH.format(kind="horaria", cod="*") not in payloads:
+            raise CommandError(f"{directory} no contiene municipios.json y al menos una horaria_<cod>.json")
+
+        n = options['iterations']
+        rnd = random.Random(options['seed'])
+        horaria = payloads[PREDICCION_PATH.format(kind="horaria", cod="*")]
+        diaria = payloads.get(PREDICCION_PATH.format(kind="diaria", cod="*"))
+
+        # ── Catálogo ──
+        def load_catalog():
+            municipios = weather_service._parse_municipios(payloads[MUNICIPIOS_PATH])
+            padding = options['catalog_size'] - len(municipios)
+            if padding > 0:
+                municipios += _synthetic_municipios(padding, options['seed'])
+            return municipios, weather_service.MunicipioIndex(municipios)
+
+        catalog_times = self._time(load_catalog, n)
+        municipios, index = load_catalog()
+        recorded = weather_service._parse_municipios(payloads[MUNICIPIOS_PATH])
+        fields = []
+        for pk in range(options['fields']):
+            base = rnd.choice(recorded)  # parcelas alrededor de municipios reales del catálogo grabado
+            fields.append(SimpleNamespace(pk=pk, geometry="replay", centroid=(
+                base["lat"] + rnd.uniform(-0.2, 0.2), base["lon"] + rnd.uniform(-0.2, 0.2),
+            )))
+
+        lookup_times = self._time(lambda: [index.nearest(*f.centroid) for f in fields], n)
+        parse_times = self._time(
+            lambda: (weather_service._parse_horaria(horaria), weather_service._parse_diaria(diaria)), n,
+        )
+        assemble_times = self._time(lambda: weather_service._build_forecast(recorded[0], horaria, diaria), n)
+
+        # ── Petición completa contra el servidor AEMET local ──
+        with replay_aemet(payloads, municipios=municipios) as server:
+            def cold():
+                cache.clear()
+                return weather_service.get_weather_for_fields(fields)
+
+            cold_times = self._time(cold, n)
+            result = cold()
+            requests_per_run = server.requests // (n + 1)
+            warm_times = self._time(lambda: weather_service.get_weather_for_fields(fields), n)
+
+        self.stdout.write(
+            f"Grabación: {directory} · catálogo {len(municipios)} municipios · "
+            f"{len(fields)} parcelas en {len(result['municipalities'])} municipios · {n} iteraciones"
+        )
+        self._report("Carga del catálogo + índice", catalog_times)
+        self._report(f"Búsqueda de municipio ({len(fields)} parcelas)", lookup_times)
+        self._report("Parseo horaria + diaria", parse_times)
+        self._report("Ensamblado de la previsión", assemble_times)
+        self._report(f"Lote en frío ({requests_per_run} peticiones HTTP)", cold_times)
+        self._report("Lote con caché", warm_times)
+        if result['errors']:
+            self.stdout.write(self.style.WARNING(f"  {len(result['errors'])} parcelas sin previsión"))
+
+    @staticmethod
+    def _time(fn, iterations):
+        times = []
+        for _ in range(iterations):
+            t0 = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - t0)
+        return times
+
+    def _report(self, label, times):
+        self.stdout.write(
+            f"  {label:<40} mediana {statistics.median(times) * 1000:9.2f} ms · mín {min(times) * 1000:9.2f} ms"
+        )
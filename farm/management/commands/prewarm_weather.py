@@ -0,0 +1,46 @@
+import statistics
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from farm.models import Field
+from farm.weather_service import prewarm_forecasts
+
+
+class Command(BaseCommand):
+    help = (
+        "Precalienta la caché de previsiones AEMET: recorre las parcelas con geometría de todas "
+        "las organizaciones, las agrupa por municipio y descarga cada municipio una vez."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=4,
+                            help='Municipios que se descargan a la vez (AEMET limita las consultas por minuto)')
+        parser.add_argument('--max-age', type=int, default=None,
+                            help='Segundos: se saltan los municipios cacheados hace menos de esto')
+        parser.add_argument('--force', action='store_true', help='Refresca todos los municipios')
+
+    def handle(self, *args, **options):
+        if not getattr(settings, 'AEMET_API_KEY', ''):
+            raise CommandError("AEMET_API_KEY no configurada.")
+
+        fields = Field.objects.exclude(geometry='').only('id', 'geometry', 'centroid_lat', 'centroid_lon')
+        result = prewarm_forecasts(
+            fields.iterator(),
+            concurrency=options['concurrency'],
+            max_age=0 if options['force'] else options['max_age'],
+        )
+
+        self.stdout.write(
+            f"{result.fields} parcelas · {result.municipalities} municipios · "
+            f"{result.refreshed} refrescados · {result.skipped_fresh} ya frescos · "
+            f"{result.skipped_locked} en curso · {result.failed} fallidos"
+        )
+        if result.timings:
+            self.stdout.write(
+                f"Descarga por municipio: media {statistics.mean(result.timings):.2f}s · "
+                f"mediana {statistics.median(result.timings):.2f}s · máx {max(result.timings):.2f}s"
+            )
+        self.stdout.write(f"Tiempo total: {result.elapsed:.2f}s")
+        if result.failed:
+            self.stdout.write(self.style.WARNING(f"{result.failed} municipio(s) sin datos de AEMET."))
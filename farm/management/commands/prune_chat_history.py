@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from farm.chat_history import RETENTION_DAYS, prune_sessions, stale_sessions
+
+
+class Command(BaseCommand):
+    help = (
+        "Borra en bloque las conversaciones con el asistente sin actividad en los últimos "
+        "N días (mensajes y resumen), para que la tabla de mensajes no crezca sin límite."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=RETENTION_DAYS,
+                            help=f'Días sin actividad para borrar una sesión (por defecto {RETENTION_DAYS})')
+        parser.add_argument('--dry-run', action='store_true', help='Solo cuenta, no borra')
+
+    def handle(self, *args, **options):
+        sessions = stale_sessions(options['days'])
+        if options['dry_run']:
+            self.stdout.write(f"{len(sessions)} sesiones sin actividad en {options['days']} días.")
+            return
+
+        deleted = prune_sessions(sessions)
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(sessions)} sesiones borradas ({deleted} mensajes)."
+        ))
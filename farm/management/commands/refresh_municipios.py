@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from farm.weather_service import download_municipios, reset_municipios_cache, store_municipios
+
+
+class Command(BaseCommand):
+    help = (
+        "Descarga el catálogo de municipios de AEMET (maestro/municipios) y lo guarda en BD, "
+        "para que los workers lo carguen con una sola consulta en lugar de descargarlo."
+    )
+
+    def handle(self, *args, **options):
+        municipios = download_municipios()
+        if not municipios:
+            raise CommandError("No se pudo descargar el catálogo de municipios de AEMET. ¿Está configurada AEMET_API_KEY?")
+
+        count = store_municipios(municipios)
+        reset_municipios_cache()
+        self.stdout.write(self.style.SUCCESS(f"{count} municipios guardados."))
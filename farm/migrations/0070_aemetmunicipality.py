@@ -0,0 +1,29 @@
+# Generated by Django 5.1.15 on 2026-10-18 14:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('farm', '0069_alter_treatment_zone_notes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AemetMunicipality',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.CharField(max_length=10, unique=True)),
+                ('name', models.CharField(max_length=100)),
+                ('lat', models.FloatField()),
+                ('lon', models.FloatField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Municipio AEMET',
+                'verbose_name_plural': 'Municipios AEMET',
+                'ordering': ['id'],
+            },
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.1.15 on 2026-10-18 14:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('farm', '0070_aemetmunicipality'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='field',
+            name='bbox_max_lat',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='field',
+            name='bbox_max_lon',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='field',
+            name='bbox_min_lat',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='field',
+            name='bbox_min_lon',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='field',
+            name='centroid_lat',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='field',
+            name='centroid_lon',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,85 @@
+import json
+
+from django.db import migrations
+
+DERIVED_FIELDS = ['centroid_lat', 'centroid_lon', 'bbox_min_lat', 'bbox_min_lon', 'bbox_max_lat', 'bbox_max_lon']
+
+
+# Copia de farm.geo.geometry_summary tal y como estaba al crear esta migración:
+# las migraciones no deben depender de código que puede cambiar después.
+def _parse_geometry(geometry_json):
+    try:
+        geojson = json.loads(geometry_json)
+    except (json.JSONDecodeError, TypeError):
+        return None
+    if not isinstance(geojson, dict):
+        return None
+    if geojson.get('type') == 'Feature':
+        geojson = geojson.get('geometry') or {}
+    return geojson if isinstance(geojson, dict) else None
+
+
+def _outer_ring(geometry):
+    geo_type = geometry.get('type')
+    coords = geometry.get('coordinates')
+    if not coords:
+        return None
+    if geo_type == 'Point':
+        return [coords]
+    if geo_type == 'Polygon':
+        return coords[0]
+    if geo_type == 'MultiPolygon':
+        return coords[0][0]
+    return None
+
+
+def _all_positions(geometry):
+    geo_type = geometry.get('type')
+    coords = geometry.get('coordinates') or []
+    if geo_type == 'Point':
+        return [coords]
+    if geo_type == 'Polygon':
+        return [p for ring in coords for p in ring]
+    if geo_type == 'MultiPolygon':
+        return [p for polygon in coords for ring in polygon for p in ring]
+    return []
+
+
+def _geometry_summary(geometry_json):
+    summary = dict.fromkeys(DERIVED_FIELDS)
+    geometry = _parse_geometry(geometry_json) if geometry_json else None
+    if not geometry:
+        return summary
+    try:
+        ring = _outer_ring(geometry)
+        positions = _all_positions(geometry)
+        if ring:
+            summary['centroid_lat'] = sum(p[1] for p in ring) / len(ring)
+            summary['centroid_lon'] = sum(p[0] for p in ring) / len(ring)
+        if positions:
+            lats = [p[1] for p in positions]
+            lons = [p[0] for p in positions]
+            summary['bbox_min_lat'], summary['bbox_min_lon'] = min(lats), min(lons)
+            summary['bbox_max_lat'], summary['bbox_max_lon'] = max(lats), max(lons)
+    except (TypeError, IndexError, KeyError):
+        return dict.fromkeys(DERIVED_FIELDS)
+    return summary
+
+
+def backfill_geometry_summary(apps, schema_editor):
+    Field = apps.get_model('farm', 'Field')
+    fields = list(Field.objects.exclude(geometry=''))
+    for field in fields:
+        for name, value in _geometry_summary(field.geometry).items():
+            setattr(field, name, value)
+    Field.objects.bulk_update(fields, DERIVED_FIELDS, batch_size=500)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('farm', '0071_field_centroid_bbox'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_geometry_summary, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.1.15 on 2026-10-18 15:09
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0006_notification_preferences_channels'),
+        ('farm', '0072_backfill_field_centroid_bbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('session_id', models.CharField(max_length=100, unique=True)),
+                ('content', models.TextField()),
+                ('covered_until_id', models.PositiveBigIntegerField(default=0)),
+                ('organization', models.ForeignKey(on_delete=django.db.models.deletion.RESTRICT, related_name='%(class)ss', to='accounts.organization')),
+            ],
+            options={
+                'verbose_name': 'Resumen de chat',
+                'verbose_name_plural': 'Resúmenes de chat',
+            },
+        ),
+    ]
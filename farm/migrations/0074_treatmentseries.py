@@ -0,0 +1,49 @@
+# Generated by Django 5.1.15 on 2026-10-18 15:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0006_notification_preferences_channels'),
+        ('farm', '0073_chatsummary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='treatment',
+            name='series_date',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='TreatmentSeries',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('weekday', models.PositiveSmallIntegerField(choices=[(0, 'Lunes'), (1, 'Martes'), (2, 'Miércoles'), (3, 'Jueves'), (4, 'Viernes'), (5, 'Sábado'), (6, 'Domingo')])),
+                ('interval_weeks', models.PositiveSmallIntegerField(default=1, help_text='Cada cuántas semanas')),
+                ('start_date', models.DateField()),
+                ('end_date', models.DateField()),
+                ('excluded_dates', models.JSONField(blank=True, default=list)),
+                ('organization', models.ForeignKey(on_delete=django.db.models.deletion.RESTRICT, related_name='%(class)ss', to='accounts.organization')),
+                ('template', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='series_rules', to='farm.treatment')),
+            ],
+            options={
+                'verbose_name': 'Serie de tratamientos',
+                'verbose_name_plural': 'Series de tratamientos',
+                'ordering': ['start_date'],
+            },
+        ),
+        migrations.AddField(
+            model_name='treatment',
+            name='series',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='occurrences', to='farm.treatmentseries'),
+        ),
+        migrations.AddConstraint(
+            model_name='treatment',
+            constraint=models.UniqueConstraint(fields=('series', 'series_date'), name='unique_series_occurrence'),
+        ),
+    ]
@@ -1,4 +1,4 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 from decimal import Decimal
 
 from django.db import models, transaction
@@ -54,6 +54,17 @@ class Field(OrganizationOwnedModel):
     )
     # Geometría de la parcela almacenada como GeoJSON (opcional)
     geometry = models.TextField(blank=True, help_text="GeoJSON del contorno de la parcela")
+    # Derivados de `geometry`, calculados en save() para no parsear el GeoJSON en cada lectura
+    centroid_lat = models.FloatField(null=True, blank=True, editable=False)
+    centroid_lon = models.FloatField(null=True, blank=True, editable=False)
+    bbox_min_lat = models.FloatField(null=True, blank=True, editable=False)
+    bbox_min_lon = models.FloatField(null=True, blank=True, editable=False)
+    bbox_max_lat = models.FloatField(null=True, blank=True, editable=False)
+    bbox_max_lon = models.FloatField(null=True, blank=True, editable=False)
+
+    GEOMETRY_DERIVED_FIELDS = [
+        'centroid_lat', 'centroid_lon', 'bbox_min_lat', 'bbox_min_lon', 'bbox_max_lat', 'bbox_max_lon',
+    ]
 
     def __str__(self):
         return self.name
@@ -61,6 +72,35 @@ class Field(OrganizationOwnedModel):
     class Meta:
         ordering = ['name']
 
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'geometry' in update_fields:
+            self.update_geometry_summary()
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | set(self.GEOMETRY_DERIVED_FIELDS)
+        super().save(*args, **kwargs)
+
+    def update_geometry_summary(self):
+        """Recalcula centroide y bounding box a partir de `geometry`."""
+        from .geo import geometry_summary
+
+        for name, value in geometry_summary(self.geometry).items():
+            setattr(self, name, value)
+
+    @property
+    def centroid(self):
+        """(lat, lon) del centroide guardado, o None si la parcela no tiene geometría."""
+        if self.centroid_lat is None or self.centroid_lon is None:
+            return None
+        return self.centroid_lat, self.centroid_lon
+
+    @property
+    def bounding_box(self):
+        """(min_lat, min_lon, max_lat, max_lon) guardada, o None."""
+        if self.bbox_min_lat is None:
+            return None
+        return self.bbox_min_lat, self.bbox_min_lon, self.bbox_max_lat, self.bbox_max_lon
+
     def pending_treatments_count(self):
         # Cuenta los tratamientos pendientes para este campo
         objs = Treatment.objects.filter(field=self, status='pending')
@@ -379,11 +419,58 @@ class Treatment(OrganizationOwnedModel):
     )
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
 
+    # Si el tratamiento es una fecha de una serie que se ha materializado al editarla o
+    # finalizarla: la serie y la fecha que sustituye (aunque después se cambie `date`).
+    series = models.ForeignKey('farm.TreatmentSeries', on_delete=models.SET_NULL, null=True, blank=True,
+                               related_name='occurrences')
+    series_date = models.DateField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['series', 'series_date'], name='unique_series_occurrence'),
+        ]
+
+    # Campos de los que dependen las dosis de los productos: si cambian, save() las recalcula.
+    # Sus valores al cargar de la BD se guardan en _loaded_dose_values (ver from_db).
+    DOSE_FIELDS = ('water_per_ha', 'real_water_per_ha', 'field_id', 'applied_area')
+
     def __str__(self):
         return f"{self.name} - {self.date}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._snapshot_dose_values()
+        return instance
+
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        self._snapshot_dose_values()
+
+    def _snapshot_dose_values(self):
+        deferred = self.get_deferred_fields()
+        if any(name in deferred for name in self.DOSE_FIELDS):
+            self._loaded_dose_values = None  # no se puede comparar sin otra consulta
+        else:
+            self._loaded_dose_values = {name: getattr(self, name) for name in self.DOSE_FIELDS}
+
+    def _dose_values_changed(self) -> bool:
+        old = getattr(self, '_loaded_dose_values', None)
+        if old is None:
+            # Instancia creada a mano con pk o con campos diferidos: leemos la fila
+            old = Treatment.objects.filter(pk=self.pk).values(*self.DOSE_FIELDS).first()
+            if old is None:
+                return True
+        old_actual_water = old['real_water_per_ha'] if old['real_water_per_ha'] else old['water_per_ha']
+        return (
+                old_actual_water != self.actual_water_per_ha() or
+                old['real_water_per_ha'] != self.real_water_per_ha or
+                old['field_id'] != self.field_id or
+                old['applied_area'] != self.applied_area
+        )
+
     def save(self, *args, **kwargs):
-        self.organization = self.field.organization  # Asignar la organización de la parcela
+        self.organization_id = self.field.organization_id  # Asignar la organización de la parcela
 
         # Si se borra finish_date, el tratamiento deja de estar completado:
         # limpiar real_water_per_ha para que los costes se recalculen con el agua planificada.
@@ -392,18 +479,17 @@ class Treatment(OrganizationOwnedModel):
 
         # Determinamos si es un nuevo objeto o uno existente
         is_new = self.pk is None
+        update_fields = kwargs.get('update_fields')
 
-        # Si no es nuevo, obtenemos el objeto antiguo para comparar
-        if not is_new:
-            old_obj = Treatment.objects.get(pk=self.pk)
-            needs_recalculation = (
-                    old_obj.actual_water_per_ha() != self.actual_water_per_ha() or
-                    old_obj.real_water_per_ha != self.real_water_per_ha or
-                    old_obj.field_id != self.field_id or
-                    old_obj.applied_area != self.applied_area
-            )
-        else:
+        if is_new:
             needs_recalculation = True
+        elif update_fields is not None and not {'water_per_ha', 'real_water_per_ha', 'field', 'field_id',
+                                                 'applied_area'} & set(update_fields):
+            # Guardado parcial que no toca mojado, parcela ni superficie (ej. solo el estado)
+            needs_recalculation = False
+        else:
+            # Comparamos con los valores cargados de la BD, sin volver a consultarla
+            needs_recalculation = self._dose_values_changed()
 
         if self.is_fertigation():
             self.water_per_ha = self.real_water_per_ha = 0
@@ -413,17 +499,37 @@ class Treatment(OrganizationOwnedModel):
 
         # Guardamos el objeto
         super().save(*args, **kwargs)
+        if update_fields is None:
+            self._snapshot_dose_values()
+        elif getattr(self, '_loaded_dose_values', None) is not None:
+            # Solo lo que se ha escrito de verdad
+            saved = {'field_id' if name == 'field' else name for name in update_fields}
+            self._loaded_dose_values.update(
+                {name: getattr(self, name) for name in self.DOSE_FIELDS if name in saved}
+            )
 
         # Solo recalculamos si es necesario
         if needs_recalculation:
             self.recalculate_product_doses()
 
+    def prepare_for_insert(self):
+        """
+        Ajustes que save() hace a un tratamiento nuevo (organización, mojado y estado),
+        para crearlo con bulk_create. Mantener en sincronía con save().
+        """
+        self.organization_id = self.field.organization_id
+        if not self.is_fertigation() and self.finish_date is None:
+            self.real_water_per_ha = None
+        if self.is_fertigation():
+            self.water_per_ha = self.real_water_per_ha = 0
+        self.update_status()
+
     def recalculate_product_doses(self):
         """
-        Recalcula las dosis totales de todos los productos asociados a este tratamiento.
+        Recalcula las dosis totales de todos los productos asociados a este tratamiento
+        (en bloque: ver TreatmentProduct.bulk_recalculate).
         """
-        for treatment_product in self.treatmentproduct_set.all():
-            treatment_product.save()  # Esto activará el cálculo en el save() de TreatmentProduct
+        TreatmentProduct.bulk_recalculate([self])
 
     def update_status(self):
         """Actualiza el campo status basado en las fechas y condiciones actuales"""
@@ -629,6 +735,62 @@ class Treatment(OrganizationOwnedModel):
         return new_treatment
 
 
+class TreatmentSeries(OrganizationOwnedModel):
+    """
+    Repetición periódica de un tratamiento ("cada viernes entre dos fechas") sin
+    crear una fila por fecha. Las fechas se calculan al vuelo a partir de la regla
+    y se muestran como copias del tratamiento plantilla; solo se crea un Treatment
+    cuando una fecha se edita o se finaliza (ver farm.treatment_series).
+    """
+    WEEKDAY_CHOICES = [
+        (0, 'Lunes'),
+        (1, 'Martes'),
+        (2, 'Miércoles'),
+        (3, 'Jueves'),
+        (4, 'Viernes'),
+        (5, 'Sábado'),
+        (6, 'Domingo'),
+    ]
+
+    template = models.ForeignKey('Treatment', on_delete=models.CASCADE, related_name='series_rules')
+    weekday = models.PositiveSmallIntegerField(choices=WEEKDAY_CHOICES)
+    interval_weeks = models.PositiveSmallIntegerField(default=1, help_text="Cada cuántas semanas")
+    start_date = models.DateField()
+    end_date = models.DateField()
+    # Fechas de la regla que el usuario ha quitado (ISO 'YYYY-MM-DD')
+    excluded_dates = models.JSONField(default=list, blank=True)
+
+    class Meta:
+        ordering = ['start_date']
+        verbose_name = "Serie de tratamientos"
+        verbose_name_plural = "Series de tratamientos"
+
+    def __str__(self):
+        return f"{self.template.name} – {self.describe()}"
+
+    def save(self, *args, **kwargs):
+        self.organization_id = self.template.organization_id
+        super().save(*args, **kwargs)
+
+    def describe(self):
+        day = self.get_weekday_display().lower()
+        every = "Cada" if self.interval_weeks == 1 else f"Cada {self.interval_weeks} semanas, el"
+        return (f"{every} {day} del {self.start_date.strftime('%d/%m/%Y')} "
+                f"al {self.end_date.strftime('%d/%m/%Y')}")
+
+    def rule_dates(self, start=None, end=None):
+        """Fechas de la regla dentro de [start, end] (ambos opcionales), sin quitar excepciones."""
+        first = self.start_date + timedelta(days=(self.weekday - self.start_date.weekday()) % 7)
+        step = 7 * self.interval_weeks
+        if start is not None and start > first:
+            first += timedelta(days=-(-(start - first).days // step) * step)  # primera >= start
+        last = self.end_date if end is None else min(end, self.end_date)
+        current = first
+        while current <= last:
+            yield current
+            current += timedelta(days=step)
+
+
 class TreatmentProduct(OrganizationOwnedModel):
     treatment = models.ForeignKey("Treatment", on_delete=models.CASCADE)
     product = models.ForeignKey("Product", on_delete=models.RESTRICT)
@@ -702,12 +864,44 @@ class TreatmentProduct(OrganizationOwnedModel):
 
         return round(value, 4)
 
+    # Campos que escriben apply_calculations (para bulk_update)
+    CALCULATED_FIELDS = [
+        'dose', 'dose_type', 'total_dose', 'total_dose_unit', 'unit_price', 'total_price', 'price_per_ha',
+        'organization', 'updated_at',
+    ]
+
     def save(self, *args, **kwargs):
+        self.apply_calculations(is_new=self.pk is None)
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def bulk_recalculate(cls, treatments) -> int:
+        """
+        Recalcula en memoria los productos de `treatments` igual que save() y los
+        escribe con un solo bulk_update. Una consulta para leer (con el producto) y
+        otra para escribir, sea cual sea el número de productos.
+
+        Los tratamientos deben traer su parcela cargada (select_related('field')) si
+        son muchos: effective_area la usa. Devuelve el número de productos actualizados.
+        """
+        by_id = {t.pk: t for t in treatments}
+        if not by_id:
+            return 0
+        items = list(cls.objects.filter(treatment_id__in=by_id).select_related('product'))
+        updated_at = now()
+        for item in items:
+            item.treatment = by_id[item.treatment_id]
+            item.apply_calculations(is_new=False)
+            item.updated_at = updated_at
+        if items:
+            cls.objects.bulk_update(items, cls.CALCULATED_FIELDS)
+        return len(items)
+
+    def apply_calculations(self, is_new: bool):
+        """Calcula tipo de dosis, unidad, dosis/total y precios con el tratamiento y el producto en memoria."""
         # Calculamos la dosis total antes de guardar
         self.set_dose_units()
 
-        is_new = self.pk is None
-
         if is_new or not self.total_overridden:
             # Fuente de verdad: dose → calculamos total
             self.calculate_total_dose()
@@ -724,9 +918,7 @@ class TreatmentProduct(OrganizationOwnedModel):
         # Calculamos los precios finales
         self.calculate_prices()
 
-        self.organization = self.treatment.organization
-
-        super().save(*args, **kwargs)
+        self.organization_id = self.treatment.organization_id
 
     def calculate_prices(self):
         if self.unit_price == 0:
@@ -926,6 +1118,45 @@ class ChatMessage(OrganizationOwnedModel):
         return f"[{self.role}] {self.content[:60]}"
 
 
+class ChatSummary(OrganizationOwnedModel):
+    """
+    Resumen acumulado de la parte antigua de una conversación con el asistente.
+    Los mensajes de la sesión con id <= covered_until_id ya están resumidos aquí
+    y no se vuelven a enviar al modelo (ver farm.chat_history).
+    """
+    session_id = models.CharField(max_length=100, unique=True)
+    content = models.TextField()
+    covered_until_id = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        verbose_name = "Resumen de chat"
+        verbose_name_plural = "Resúmenes de chat"
+
+    def __str__(self):
+        return f"[{self.session_id}] {self.content[:60]}"
+
+
+class AemetMunicipality(models.Model):
+    """
+    Catálogo de municipios de AEMET (maestro/municipios) ya parseado.
+    Se guarda en BD para que los workers nuevos no tengan que descargarlo y
+    parsearlo de nuevo; se refresca con `python manage.py refresh_municipios`.
+    """
+    code = models.CharField(max_length=10, unique=True)
+    name = models.CharField(max_length=100)
+    lat = models.FloatField()
+    lon = models.FloatField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['id']
+        verbose_name = "Municipio AEMET"
+        verbose_name_plural = "Municipios AEMET"
+
+    def __str__(self):
+        return f"{self.name} ({self.code})"
+
+
 class Harvest(OrganizationOwnedModel):
     field = models.ForeignKey(Field, on_delete=models.RESTRICT)
     date = models.DateField()
@@ -15,7 +15,8 @@ from django.db.models.functions import Coalesce
 from django.urls import reverse
 from django.utils.timezone import now
 
-from .models import Product, ProductPriceHistory, TreatmentProduct
+from .ai_context import bump_context_version
+from .models import Product, ProductPriceHistory, Treatment, TreatmentProduct
 
 
 # ── Utilidades de email ────────────────────────────────────────────────────────
@@ -302,7 +303,10 @@ def get_shopping_list(user, field_ids=None, treatment_ids=None):
     ----------
     user           : usuario autenticado
     field_ids      : lista de IDs de parcela para filtrar (None = todas)
-    treatment_ids  : lista de IDs de tratamiento para filtrar (None = todos)
+    treatment_ids  : lista de IDs de tratamiento para filtrar (None = todos).
+                     Puede incluir fechas aún no materializadas de las series
+                     por su occurrence_key ('serie-<id>-<fecha>'); sin filtro
+                     se suman todas (farm.treatment_series).
 
     Devuelve
     --------
@@ -324,11 +328,29 @@ def get_shopping_list(user, field_ids=None, treatment_ids=None):
     if field_ids:
         queryset = queryset.filter(treatment__field_id__in=field_ids)
 
+    from .treatment_series import expand_series, parse_occurrence_key, series_for_user
+
+    occurrence_keys = set()
     if treatment_ids:
-        queryset = queryset.filter(treatment_id__in=treatment_ids)
+        occurrence_keys = {str(tid) for tid in treatment_ids if parse_occurrence_key(tid)}
+        queryset = queryset.filter(treatment_id__in=[tid for tid in treatment_ids if str(tid).isdigit()])
+
+    items = list(queryset)
+    if not treatment_ids or occurrence_keys:
+        series = series_for_user(user)
+        if field_ids:
+            series = series.filter(template__field_id__in=field_ids)
+        if occurrence_keys:
+            series = series.filter(pk__in={parse_occurrence_key(key)[0] for key in occurrence_keys})
+        occurrences = expand_series(series, with_products=True)
+        if occurrence_keys:
+            occurrences = [o for o in occurrences if o.key in occurrence_keys]
+        virtual = [tp for occurrence in occurrences for tp in occurrence.products]
+        if virtual:
+            items = sorted(items + virtual, key=lambda tp: (tp.treatment.field.name, tp.treatment.date))
 
     product_totals = {}
-    for item in queryset:
+    for item in items:
         key = (item.product_id, item.total_dose_unit)
         if key not in product_totals:
             product_totals[key] = {
@@ -458,6 +480,95 @@ def get_shopping_list(user, field_ids=None, treatment_ids=None):
     return result
 
 
+# ── Clonado en bloque ─────────────────────────────────────────────────────────
+
+MAX_CLONE_TARGETS = 400  # tope por petición (una temporada semanal son ~52)
+CLONE_BATCH_SIZE = 500
+
+
+@dataclass
+class CloneTarget:
+    field: object  # Field de destino
+    new_date: date | None = None  # None → fecha del original
+    new_name: str | None = None  # None → nombre del original
+
+
+def build_clones(treatment, source_products, targets):
+    """
+    Copias en memoria (sin guardar) de `treatment` para cada CloneTarget, con sus
+    productos ya calculados para la parcela de destino. `source_products` son los
+    TreatmentProduct del original con el producto cargado (select_related('product')).
+
+    Devuelve (tratamientos, productos); cada producto apunta a su copia en `treatment`.
+    """
+    new_treatments = []
+    new_products = []
+    for target in targets:
+        new_treatment = Treatment(
+            field=target.field,
+            name=target.new_name or treatment.name,
+            type=treatment.type,
+            date=target.new_date or treatment.date,
+            machine_id=treatment.machine_id,
+            water_per_ha=treatment.water_per_ha,
+        )
+        new_treatment.prepare_for_insert()
+        new_treatments.append(new_treatment)
+        for position, source in enumerate(source_products):
+            treatment_product = TreatmentProduct(
+                treatment=new_treatment,
+                product=source.product,
+                dose=source.dose,
+                dose_type=source.dose_type,
+                total_dose=0,  # apply_calculations lo recalcula desde dose
+                total_dose_unit=source.total_dose_unit,
+                unit_price=source.unit_price,
+                position=position,
+            )
+            treatment_product.apply_calculations(is_new=True)
+            new_products.append(treatment_product)
+    return new_treatments, new_products
+
+
+@transaction.atomic
+def clone_treatments(treatment, targets, series=None):
+    """
+    Clona un tratamiento a varias parcelas y/o fechas de una vez, con el mismo
+    resultado que Treatment.clone_to_field para cada destino: las dosis por
+    unidad se conservan y totales y precios se recalculan para cada parcela.
+
+    Todo se calcula en memoria (build_clones) y se escribe con dos bulk_create
+    (tratamientos y productos), así que las consultas no dependen del número de
+    destinos ni de productos. bulk_create no lanza señales: se invalida a mano el
+    contexto del asistente.
+
+    Parámetros
+    ----------
+    treatment : Treatment a clonar
+    targets   : lista de CloneTarget (como mucho MAX_CLONE_TARGETS)
+    series    : TreatmentSeries si las copias materializan fechas de una serie
+
+    Devuelve
+    --------
+    Los nuevos Treatment, en el orden de `targets`.
+    """
+    if len(targets) > MAX_CLONE_TARGETS:
+        raise ValueError(f'Como mucho se pueden crear {MAX_CLONE_TARGETS} tratamientos de una vez.')
+
+    source_products = list(treatment.treatmentproduct_set.select_related('product'))
+    new_treatments, new_products = build_clones(treatment, source_products, targets)
+    if series is not None:
+        for new_treatment in new_treatments:
+            new_treatment.series = series
+            new_treatment.series_date = new_treatment.date
+    Treatment.objects.bulk_create(new_treatments, batch_size=CLONE_BATCH_SIZE)
+    TreatmentProduct.objects.bulk_create(new_products, batch_size=CLONE_BATCH_SIZE)
+
+    for org_id in {t.organization_id for t in new_treatments}:
+        bump_context_version(org_id)
+    return new_treatments
+
+
 def clone_treatment(treatment, target_field, new_date=None, new_name=None):
     """
     Clona un tratamiento a otra parcela recalculando las dosis totales
@@ -474,4 +585,4 @@ def clone_treatment(treatment, target_field, new_date=None, new_name=None):
     --------
     El nuevo Treatment creado.
     """
-    return treatment.clone_to_field(target_field, new_date, new_name)
+    return clone_treatments(treatment, [CloneTarget(target_field, new_date, new_name)])[0]
@@ -0,0 +1,17 @@
+from django.db.models.signals import post_delete, post_save
+
+from accounts.models import Organization
+from farm.ai_context import bump_context_version
+from farm.models import Field, Machine, Product, ProductType, Treatment, TreatmentProduct
+
+# Modelos cuyos datos forman parte del contexto del asistente (ai_service.get_org_context)
+AI_CONTEXT_MODELS = (Field, Machine, Product, ProductType, Treatment, TreatmentProduct)
+
+
+def invalidate_ai_context(sender, instance, **kwargs):
+    bump_context_version(instance.pk if sender is Organization else instance.organization_id)
+
+
+for _model in (*AI_CONTEXT_MODELS, Organization):
+    for _signal in (post_save, post_delete):
+        _signal.connect(invalidate_ai_context, sender=_model, dispatch_uid=f'ai_context_{_model.__name__}')
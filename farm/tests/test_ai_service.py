@@ -0,0 +1,561 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+from datetime import datetime, timezone as dt_timezone
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+import pytest
+from django.core.cache import cache
+from django.core.management import call_command
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import User
+from farm import ai_service
+from farm.ai_context import estimate_tokens, select_context
+from farm import chat_history
+from farm.models import ChatMessage, ChatSummary
+from farm.tests.factories import (
+    FieldFactory, MachineFactory, OrganizationFactory, ProductFactory, TreatmentFactory,
+)
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    cache.clear()
+    yield
+    cache.clear()
+
+
+@pytest.fixture
+def organization(db):
+    org = OrganizationFactory(name="Org Asistente")
+    FieldFactory(organization=org, name="Los Llanos")
+    ProductFactory(organization=org, name="Cobre Nordox")
+    return org
+
+
+# ── Caché del contexto ─────────────────────────────────────────────────
+def test_prompt_is_built_once_per_conversation(organization):
+    with patch.object(ai_service, "get_org_context", wraps=ai_service.get_org_context) as build:
+        prompts = {ai_service.get_system_prompt(organization) for _ in range(10)}
+
+    assert build.call_count == 1
+    assert len(prompts) == 1
+    assert "Los Llanos" in prompts.pop()
+
+
+@pytest.mark.parametrize("change", [
+    lambda org: FieldFactory(organization=org, name="Nuevo Dato"),
+    lambda org: ProductFactory(organization=org, name="Nuevo Dato"),
+    lambda org: MachineFactory(organization=org, name="Nuevo Dato"),
+    lambda org: TreatmentFactory(organization=org, field=FieldFactory(organization=org), name="Nuevo Dato"),
+])
+def test_changes_to_org_data_invalidate_the_prompt(organization, change):
+    assert "Nuevo Dato" not in ai_service.get_system_prompt(organization)
+
+    change(organization)
+
+    assert "Nuevo Dato" in ai_service.get_system_prompt(organization)
+
+
+def test_deleting_and_renaming_invalidate_the_prompt(organization):
+    ai_service.get_system_prompt(organization)
+
+    organization.fields.get(name="Los Llanos").delete()
+    organization.name = "Org Renombrada"
+    organization.save()
+
+    prompt = ai_service.get_system_prompt(organization)
+    assert "Los Llanos" not in prompt
+    assert "Org Renombrada" in prompt
+
+
+def test_other_organizations_keep_their_cached_prompt(organization):
+    other = OrganizationFactory(name="Otra Org")
+    ai_service.get_system_prompt(other)
+
+    with patch.object(ai_service, "get_org_context", wraps=ai_service.get_org_context) as build:
+        FieldFactory(organization=organization)
+        ai_service.get_system_prompt(other)
+
+    build.assert_not_called()
+
+
+# ── Contexto con presupuesto de tokens ─────────────────────────────────
+def _big_context(n_fields=60, n_products=80, n_treatments=100):
+    fields = [
+        {"id": i, "nombre": f"Parcela {i:02d}", "hectáreas": 2.0, "cultivo": "Olivo" if i % 2 else "Naranjo",
+         "año_plantación": 2010}
+        for i in range(n_fields)
+    ]
+    fields[17]["nombre"] = "Los Llanos"
+    products = [
+        {"id": i, "nombre": f"Producto {i:02d}", "tipo": "Fungicida" if i % 3 else "Insecticida",
+         "dosis_pulverización": "2.5 L/1000L"}
+        for i in range(n_products)
+    ]
+    products[42]["nombre"] = "Confidor"
+    treatments = [
+        {"id": i, "nombre": f"Tratamiento {i:03d}", "parcela": f"Parcela {i % n_fields:02d}",
+         "tipo": "Pulverización", "fecha": f"{28 - i % 28:02d}/{12 - i // 28:02d}/2025", "estado": "Finalizado",
+         "productos": [f"Producto {i % n_products:02d} [tipo: Fungicida]: 2.5 L/1000L (total 10 L)"]}
+        for i in range(n_treatments)
+    ]
+    treatments[90]["parcela"] = "Los Llanos"
+    treatments[95]["productos"] = ["Confidor [tipo: Insecticida]: 0.5 L/1000L (total 2 L)"]
+    return {"productos": products, "parcelas": fields, "máquinas": [{"nombre": "Atomizador", "tipo": "spraying",
+            "capacidad_litros": 2000}], "tratamientos": treatments}
+
+
+def test_small_context_is_used_whole():
+    context = _big_context()
+
+    assert select_context(context, "¿Qué tal Los Llanos?", budget=estimate_tokens(context)) is context
+
+
+def test_large_context_fits_the_budget_and_keeps_relevant_entities():
+    context = _big_context()
+    assert estimate_tokens(context) > 3000
+
+    selected = select_context(context, "¿Cuándo traté Los Llanos con Confidor?", budget=1500)
+
+    assert estimate_tokens(selected) <= 1500
+    assert "Los Llanos" in [f["nombre"] for f in selected["parcelas"]]
+    assert "Confidor" in [p["nombre"] for p in selected["productos"]]
+    treatment_ids = [t["id"] for t in selected["tratamientos"]]
+    assert {90, 95} <= set(treatment_ids)  # antiguos, pero mencionan la parcela y el producto
+    assert treatment_ids == sorted(treatment_ids)  # conserva el orden (más reciente primero)
+    assert selected["máquinas"] == context["máquinas"]
+
+
+def test_large_context_is_summarized():
+    context = _big_context()
+
+    summary = select_context(context, "hola", budget=1500)["resumen"]
+
+    assert summary["parcelas"]["total"] == 60
+    assert summary["parcelas"]["hectáreas"] == 120.0
+    assert summary["parcelas"]["por_cultivo"] == {"Naranjo": 30, "Olivo": 30}
+    assert summary["productos"]["por_tipo"]["Insecticida"] == 27
+    assert summary["tratamientos"]["total"] == 100
+    assert summary["tratamientos"]["hasta"] == context["tratamientos"][0]["fecha"]
+    assert summary["tratamientos"]["incluidos"] < 100
+
+
+def test_without_keywords_every_section_gets_a_share_of_the_budget():
+    for message in ("dame un resumen", "cuantas hectareas tengo"):
+        selected = select_context(_big_context(), message, budget=3000)
+
+        assert len(selected["parcelas"]) >= 5
+        assert len(selected["productos"]) >= 5
+        ids = [t["id"] for t in selected["tratamientos"]]
+        assert ids and ids == list(range(len(ids)))  # los más recientes
+
+
+def test_dose_question_keeps_the_product_catalog():
+    selected = select_context(_big_context(), "¿qué dosis de cobre en olivo?", budget=3000)
+
+    assert len(selected["productos"]) >= 5
+
+
+def test_keyword_matching_ignores_accents_case_and_plurals():
+    context = _big_context()
+    context["productos"][45]["nombre"] = "Azufre Micronizado"
+
+    selected = select_context(context, "¿Me quedan AZUFRES micronizados?", budget=800)
+
+    assert "Azufre Micronizado" in [p["nombre"] for p in selected["productos"]]
+
+
+def test_prompt_for_large_organization_uses_selected_context(organization, settings):
+    settings.GEMINI_CONTEXT_TOKENS = 150
+    for i in range(10):
+        FieldFactory(organization=organization, name=f"Bancal {i}")
+
+    prompt = ai_service.get_system_prompt(organization, "¿Qué cultivo tiene Los Llanos?")
+
+    assert "Contexto parcial" in prompt
+    assert '"nombre":"Los Llanos"' in prompt
+    assert "Bancal 3" not in prompt
+    assert '"total":11' in prompt
+
+
+# ── Contador diario ────────────────────────────────────────────────────
+def _assistant_messages(org, n):
+    for _ in range(n):
+        ChatMessage.objects.create(organization=org, session_id="s", role="assistant", content="ok")
+
+
+def test_daily_counter_is_rebuilt_from_db_once(organization, django_assert_num_queries):
+    _assistant_messages(organization, 3)
+
+    with django_assert_num_queries(1):
+        assert ai_service.get_daily_usage(organization) == 3
+    with django_assert_num_queries(0):
+        for _ in range(5):
+            assert ai_service.check_daily_limit(organization) == (True, None)
+
+
+def test_record_daily_usage_increments_the_counter(organization, django_assert_num_queries):
+    ai_service.get_daily_usage(organization)
+    _assistant_messages(organization, 1)
+
+    with django_assert_num_queries(0):
+        ai_service.record_daily_usage(organization)
+    assert ai_service.get_daily_usage(organization) == 1
+
+    cache.clear()  # p. ej. reinicio del proceso con LocMem: vuelve a contar en la BD
+    _assistant_messages(organization, 1)
+    ai_service.record_daily_usage(organization)
+    assert ai_service.get_daily_usage(organization) == 2
+
+
+def test_daily_counter_follows_the_local_day(organization, settings):
+    settings.TIME_ZONE = "Europe/Madrid"
+    just_after_local_midnight = datetime(2026, 6, 1, 22, 30, tzinfo=dt_timezone.utc)  # 00:30 del 2/6 en Madrid
+    with patch.object(timezone, "now", return_value=just_after_local_midnight):
+        _assistant_messages(organization, 1)
+
+        assert ai_service._daily_count_key(organization).endswith(":2026-06-02")
+        assert ai_service.get_daily_usage(organization) == 1
+        assert ai_service._seconds_until_local_midnight() == 23 * 3600 + 30 * 60 + 90
+
+
+def test_daily_limit_uses_the_counter(organization, settings):
+    settings.GEMINI_DAILY_LIMIT = 2
+    ai_service.get_daily_usage(organization)
+    ai_service.record_daily_usage(organization)
+    assert ai_service.check_daily_limit(organization)[0]
+
+    ai_service.record_daily_usage(organization)
+
+    ok, error = ai_service.check_daily_limit(organization)
+    assert not ok
+    assert "`2/2`" in error
+
+
+def test_daily_counters_are_per_organization(organization):
+    other = OrganizationFactory()
+    ai_service.get_daily_usage(organization)
+    ai_service.record_daily_usage(organization)
+
+    assert ai_service.get_daily_usage(other) == 0
+
+
+# ── Respuestas en streaming ────────────────────────────────────────────
+class FakeChat:
+    def __init__(self, chunks, fail_after=None):
+        self.chunks = chunks
+        self.fail_after = fail_after
+        self.sent = []
+
+    def send_message(self, message):
+        self.sent.append(message)
+        return SimpleNamespace(text="".join(self.chunks))
+
+    def send_message_stream(self, message):
+        self.sent.append(message)
+        for i, chunk in enumerate(self.chunks):
+            if i == self.fail_after:
+                raise RuntimeError("503 UNAVAILABLE")
+            yield SimpleNamespace(text=chunk)
+
+
+class FakeClient:
+    """Sustituye a genai.Client: chats.create devuelve siempre el mismo FakeChat."""
+
+    def __init__(self, chat, summary="Resumen de prueba"):
+        self.chat = chat
+        self.summary = summary
+        self.created = []
+        self.prompts = []
+        self.chats = SimpleNamespace(create=self._create)
+        self.models = SimpleNamespace(generate_content=self._generate)
+
+    def _create(self, **kwargs):
+        self.created.append(kwargs)
+        return self.chat
+
+    def _generate(self, model, contents, config=None):
+        self.prompts.append(contents)
+        self.config = config
+        if isinstance(self.summary, Exception):
+            raise self.summary
+        return SimpleNamespace(text=self.summary)
+
+
+@pytest.fixture
+def fake_client(settings):
+    settings.GEMINI_API_KEY = "fake"
+    client = FakeClient(FakeChat(["Hola, ", "tienes **1** parcela", " \\u00e1gil."]))
+    with patch.object(ai_service, "_get_client", return_value=client):
+        yield client
+
+
+@pytest.fixture
+def fake_chat(fake_client):
+    return fake_client.chat
+
+
+@pytest.fixture
+def chat_client(client, organization):
+    user = User.objects.create_user(username="chat", password="pass", organization=organization)
+    client.force_login(user)
+    return client
+
+
+def _post_chat(client, **data):
+    return client.post(reverse("chat"), json.dumps(data), content_type="application/json")
+
+
+def _events(response) -> list:
+    body = b"".join(response.streaming_content).decode()
+    events = []
+    for block in filter(None, body.split("\n\n")):
+        lines = dict(line.split(": ", 1) for line in block.split("\n"))
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def test_stream_sends_chunks_and_saves_answer_at_the_end(chat_client, fake_chat):
+    response = _post_chat(chat_client, message="¿Cuántas parcelas tengo?", stream=True)
+
+    assert response["Content-Type"] == "text/event-stream"
+    assert response["Cache-Control"] == "no-cache"
+    assert ChatMessage.objects.filter(role="assistant").count() == 0  # aún no se ha consumido
+
+    events = _events(response)
+
+    assert [e for e, _ in events] == ["delta", "delta", "delta", "done"]
+    assert "".join(d["text"] for e, d in events if e == "delta") == "Hola, tienes **1** parcela \\u00e1gil."
+    assert events[-1][1]["response"] == "Hola, tienes **1** parcela ágil."
+    saved = ChatMessage.objects.get(role="assistant")
+    assert saved.content == "Hola, tienes **1** parcela ágil."
+    assert fake_chat.sent == ["¿Cuántas parcelas tengo?"]
+    assert ai_service.get_daily_usage(saved.organization) == 1
+
+
+def test_stream_error_midway_does_not_save_partial_answer(chat_client, fake_chat, organization):
+    fake_chat.fail_after = 2
+
+    events = _events(_post_chat(chat_client, message="Hola", stream=True))
+
+    assert [e for e, _ in events] == ["delta", "delta", "error"]
+    assert "Error inesperado" in events[-1][1]["error"]
+    assert not ChatMessage.objects.filter(role="assistant").exists()
+    assert ai_service.get_daily_usage(organization) == 0
+    assert ChatMessage.objects.filter(role="user", content="Hola").exists()
+
+
+def test_stream_precondition_errors_are_plain_json(chat_client, fake_chat):
+    ai_service.mark_quota_exhausted(retry_after_seconds=60)
+
+    response = _post_chat(chat_client, message="Hola", stream=True)
+
+    assert response["Content-Type"] == "application/json"
+    assert "Consultas del día agotadas" in response.json()["error"]
+    assert fake_chat.sent == []
+
+
+def test_non_stream_mode_still_returns_json(chat_client, fake_chat):
+    response = _post_chat(chat_client, message="Hola")
+
+    assert response.json() == {"response": "Hola, tienes **1** parcela ágil."}
+    assert ChatMessage.objects.filter(role="assistant").count() == 1
+
+
+# ── Compactación del historial ─────────────────────────────────────────
+def _conversation(org, session_id, turns, start=0):
+    for i in range(start, start + turns):
+        ChatMessage.objects.create(organization=org, session_id=session_id, role="user", content=f"pregunta {i}")
+        ChatMessage.objects.create(organization=org, session_id=session_id, role="assistant", content=f"respuesta {i}")
+
+
+def _system_prompt(fake_client):
+    return fake_client.created[-1]["config"].system_instruction
+
+
+def test_old_turns_are_folded_into_the_summary(organization, fake_client):
+    _conversation(organization, "s1", 8)  # 16 mensajes > COMPACT_AFTER
+
+    assert chat_history.compact_history(organization, "s1")
+
+    summary = ChatSummary.objects.get(session_id="s1")
+    assert summary.content == "Resumen de prueba"
+    assert "pregunta 0" in fake_client.prompts[0] and "respuesta 4" in fake_client.prompts[0]
+    assert "pregunta 5" not in fake_client.prompts[0]
+    text, recent = chat_history.load_history(organization, "s1", limit=20)
+    assert text == "Resumen de prueba"
+    assert [m.content for m in recent] == [
+        "pregunta 5", "respuesta 5", "pregunta 6", "respuesta 6", "pregunta 7", "respuesta 7",
+    ]
+
+
+def test_compaction_waits_for_enough_new_messages(organization, fake_client):
+    _conversation(organization, "s1", 7)
+
+    assert not chat_history.compact_history(organization, "s1")
+    assert fake_client.prompts == []
+
+
+def test_next_compaction_builds_on_the_previous_summary(organization, fake_client):
+    _conversation(organization, "s1", 8)
+    chat_history.compact_history(organization, "s1")
+    fake_client.summary = "Resumen 2"
+    _conversation(organization, "s1", 5, start=8)
+
+    assert chat_history.compact_history(organization, "s1")
+
+    assert "Resumen de prueba" in fake_client.prompts[1]
+    assert "pregunta 0" not in fake_client.prompts[1]
+    assert ChatSummary.objects.get(session_id="s1").content == "Resumen 2"
+
+
+def test_failed_summary_keeps_history_bounded(organization, fake_client):
+    fake_client.summary = RuntimeError("500 INTERNAL")
+    _conversation(organization, "s1", 15)
+
+    assert not chat_history.compact_history(organization, "s1")
+    text, recent = chat_history.load_history(organization, "s1", limit=20)
+    assert text is None
+    assert len(recent) == 20
+
+
+def test_chat_sends_summary_and_recent_turns_only(chat_client, organization, fake_client):
+    session = chat_client.session
+    session["chat_session_id"] = "s1"
+    session.save()
+    _conversation(organization, "s1", 8)
+
+    # La compactación va en un hilo aparte; aquí se ejecuta en línea para verla en el siguiente turno
+    with patch("farm.views.chat_views.compact_in_background", chat_history.compact_history):
+        _post_chat(chat_client, message="¿Y la dosis?")  # guarda 2 mensajes más y compacta
+        _post_chat(chat_client, message="Gracias")
+
+    assert "## Resumen de la conversación anterior\nResumen de prueba" in _system_prompt(fake_client)
+    history = fake_client.created[-1]["history"]
+    assert len(history) == chat_history.KEEP_RECENT
+    assert [c.parts[0].text for c in history[:4]] == ["pregunta 6", "respuesta 6", "pregunta 7", "respuesta 7"]
+
+
+def test_compaction_runs_off_the_request_thread(organization):
+    release = threading.Event()
+    threads = []
+
+    def slow_compact(org, session_id):
+        threads.append(threading.current_thread())
+        release.wait(5)
+
+    with patch.object(chat_history, "compact_history", side_effect=slow_compact) as compact:
+        chat_history.compact_in_background(organization, "s1")
+        chat_history.compact_in_background(organization, "s1")  # ya en marcha: no lanza otra
+        release.set()
+        for thread in threading.enumerate():
+            if thread.name.startswith("chat-compact-"):
+                thread.join(5)
+
+    assert compact.call_count == 1
+    assert threads[0] is not threading.current_thread()
+    assert cache.get("chat_compact_lock:s1") is None
+
+
+def test_prune_removes_inactive_sessions_in_bulk(organization):
+    _conversation(organization, "old", 2)
+    _conversation(organization, "recent", 2)
+    ChatSummary.objects.create(organization=organization, session_id="old", content="x", covered_until_id=1)
+    ChatMessage.objects.filter(session_id="old").update(created_at=timezone.now() - timezone.timedelta(days=120))
+
+    call_command("prune_chat_history", "--dry-run")
+    assert ChatMessage.objects.filter(session_id="old").count() == 4
+
+    call_command("prune_chat_history", "--days", "90")
+
+    assert not ChatMessage.objects.filter(session_id="old").exists()
+    assert not ChatSummary.objects.filter(session_id="old").exists()
+    assert ChatMessage.objects.filter(session_id="recent").count() == 4
+
+
+# ── Arranque sin el SDK de Gemini ──────────────────────────────────────
+_STARTUP = (
+    "import django; django.setup(); "
+    "from django.urls import get_resolver; get_resolver().url_patterns; "
+    "import sys; print('genai_loaded=%s' % ('google.genai' in sys.modules))"
+)
+
+
+def test_startup_does_not_import_genai():
+    env = {**os.environ, "DJANGO_SETTINGS_MODULE": "agrogest.settings", "DJANGO_SECRET_KEY": "test"}
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _STARTUP],
+        cwd=Path(__file__).resolve().parents[2], env=env, capture_output=True, text=True, timeout=120,
+    )
+
+    assert result.returncode == 0, result.stderr[-2000:]
+    imported = [line.rsplit("|", 1)[-1].strip() for line in result.stderr.splitlines() if line.startswith("import time:")]
+    assert "farm.views.chat_views" in imported  # las URLs se han cargado de verdad
+    assert not [name for name in imported if name.startswith("google.genai")]
+    assert "genai_loaded=False" in result.stdout
+
+
+# ── Cliente reutilizable y latencia ────────────────────────────────────
+@pytest.fixture
+def genai_client_class(settings):
+    settings.GEMINI_API_KEY = "key-1"
+    with patch.object(ai_service, "_client", None), \
+            patch("google.genai.Client", side_effect=lambda **kw: MagicMock(api_key=kw["api_key"])) as cls:
+        yield cls
+
+
+def test_client_is_built_once_per_process(genai_client_class):
+    clients = []
+    threads = [threading.Thread(target=lambda: clients.append(ai_service._get_client())) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert genai_client_class.call_count == 1
+    assert len({id(c) for c in clients}) == 1
+    assert ai_service._get_client() is clients[0]
+
+
+def test_client_is_rebuilt_when_the_api_key_changes(genai_client_class, settings):
+    first = ai_service._get_client()
+    settings.GEMINI_API_KEY = "key-2"
+
+    second = ai_service._get_client()
+
+    assert second is not first
+    assert second.api_key == "key-2"
+
+
+def test_calls_use_configured_timeouts(chat_client, organization, fake_client, settings):
+    settings.GEMINI_TIMEOUT = 12
+    settings.GEMINI_SUMMARY_TIMEOUT = 4.5
+
+    _post_chat(chat_client, message="Hola")
+    ai_service.summarize_conversation(organization, None, ChatMessage.objects.all())
+
+    assert fake_client.created[-1]["config"].http_options.timeout == 12000
+    assert fake_client.config.http_options.timeout == 4500
+
+
+def test_model_latency_is_recorded_per_call(chat_client, fake_client):
+    with patch.object(ai_service, "_latency_stats", {}):
+        _post_chat(chat_client, message="Hola")
+        _events(_post_chat(chat_client, message="Hola", stream=True))
+        fake_client.chat.fail_after = 1
+        _events(_post_chat(chat_client, message="Hola", stream=True))
+
+        stats = ai_service.model_latency_stats()
+
+    assert stats["chat"]["calls"] == 1
+    assert stats["chat_stream_first_chunk"]["calls"] == 2
+    assert stats["chat_stream"]["calls"] == 2
+    assert stats["chat_stream"]["errors"] == 1
+    assert stats["chat"]["avg"] == stats["chat"]["last"] >= 0
@@ -0,0 +1,62 @@
+import json
+from unittest.mock import patch
+
+import pytest
+
+from farm import weather_service
+from farm.tests.factories import FieldFactory
+
+POLYGON = {
+    "type": "Polygon",
+    "coordinates": [[[-5.0, 37.0], [-4.0, 37.0], [-4.0, 38.0], [-5.0, 38.0]]],
+}
+
+
+@pytest.mark.django_db
+def test_field_save_stores_centroid_and_bbox():
+    field = FieldFactory(geometry=json.dumps(POLYGON))
+    field.refresh_from_db()
+
+    assert field.centroid == (37.5, -4.5)
+    assert field.bounding_box == (37.0, -5.0, 38.0, -4.0)
+
+
+@pytest.mark.django_db
+def test_feature_and_multipolygon_geometries():
+    feature = FieldFactory(geometry=json.dumps({"type": "Feature", "properties": {}, "geometry": POLYGON}))
+    multi = FieldFactory(geometry=json.dumps({
+        "type": "MultiPolygon",
+        "coordinates": [POLYGON["coordinates"], [[[-3.0, 39.0], [-2.0, 39.0], [-2.0, 40.0]]]],
+    }))
+
+    assert feature.centroid == (37.5, -4.5)
+    # El centroide sale del primer polígono; la bbox abarca todos
+    assert multi.centroid == (37.5, -4.5)
+    assert multi.bounding_box == (37.0, -5.0, 40.0, -2.0)
+
+
+@pytest.mark.django_db
+def test_clearing_geometry_clears_derived_values():
+    field = FieldFactory(geometry=json.dumps(POLYGON))
+    field.geometry = ""
+    field.save(update_fields=["geometry"])
+    field.refresh_from_db()
+
+    assert field.centroid is None
+    assert field.bounding_box is None
+
+
+@pytest.mark.django_db
+def test_invalid_geometry_is_ignored():
+    field = FieldFactory(geometry="{no es json")
+
+    assert field.centroid is None
+
+
+@pytest.mark.django_db
+def test_weather_uses_stored_centroid_without_parsing_geojson():
+    field = FieldFactory(geometry=json.dumps(POLYGON))
+
+    with patch.object(weather_service, "parse_geometry") as parse:
+        assert weather_service._field_coords(field) == (37.5, -4.5)
+    parse.assert_not_called()
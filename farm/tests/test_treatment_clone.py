@@ -0,0 +1,140 @@
+from datetime import date, timedelta
+from decimal import Decimal
+
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from accounts.models import User
+from farm import services
+from farm.ai_context import context_version
+from farm.models import Treatment, TreatmentProduct
+from farm.services import CloneTarget, clone_treatments
+from farm.tests.factories import (
+    FieldFactory, MachineFactory, OrganizationFactory, SprayingProductFactory, TreatmentFactory,
+    TreatmentProductFactory,
+)
+
+COMPARED = ('position', 'dose', 'dose_type', 'total_dose', 'total_dose_unit', 'unit_price', 'total_price',
+            'price_per_ha')
+
+
+@pytest.fixture
+def treatment(db):
+    org = OrganizationFactory()
+    field = FieldFactory(organization=org, area=4.0)
+    source = TreatmentFactory(
+        organization=org, field=field, machine=MachineFactory(organization=org, capacity=1500),
+        water_per_ha=600, date=date.today() + timedelta(days=3),
+    )
+    for i, dose_type in enumerate(['l_per_1000l', 'kg_per_ha', 'pct', 'kg_per_1000l', 'l_per_ha', 'l_per_1000l']):
+        product = SprayingProductFactory(
+            organization=org, spraying_dose=Decimal('1.0'), spraying_dose_type=dose_type, price=Decimal('9.90'),
+        )
+        TreatmentProductFactory(
+            treatment=source, product=product, dose=Decimal('1.25') + i, dose_type=dose_type,
+            unit_price=Decimal('0') if i % 2 else Decimal('11.00'), organization=org, position=i,
+            total_overridden=(i == 3),
+        )
+    return source
+
+
+def _products(treatment):
+    return list(TreatmentProduct.objects.filter(treatment=treatment).order_by('position').values_list(*COMPARED))
+
+
+def test_bulk_clone_matches_clone_to_field(treatment):
+    targets = [
+        CloneTarget(FieldFactory(organization=treatment.organization, area=area), new_date, new_name)
+        for area, new_date, new_name in [
+            (7.5, None, None),
+            (1.2, date.today() - timedelta(days=10), "Copia atrasada"),
+        ]
+    ]
+
+    bulk = clone_treatments(treatment, targets)
+    one_by_one = [treatment.clone_to_field(t.field, t.new_date, t.new_name) for t in targets]
+
+    for new, reference in zip(bulk, one_by_one):
+        new.refresh_from_db()
+        reference.refresh_from_db()
+        for name in ('name', 'type', 'date', 'field_id', 'machine_id', 'water_per_ha', 'status', 'organization_id'):
+            assert getattr(new, name) == getattr(reference, name)
+        assert _products(new) == _products(reference)
+    assert bulk[1].status == Treatment.STATUS_DELAYED
+
+
+def test_bulk_clone_queries_do_not_depend_on_targets(treatment):
+    counts = []
+    # Hasta ~70 productos por INSERT en SQLite (límite de parámetros); en PostgreSQL un solo lote
+    for n in (2, 10):
+        targets = [CloneTarget(treatment.field, date.today() + timedelta(weeks=i + 1)) for i in range(n)]
+        with CaptureQueriesContext(connection) as ctx:
+            clone_treatments(treatment, targets)
+        counts.append(len(ctx.captured_queries))
+
+    assert counts[0] == counts[1] <= 7
+    assert TreatmentProduct.objects.count() == 6 * (1 + 2 + 10)
+
+
+def test_bulk_clone_invalidates_assistant_context(treatment):
+    before = context_version(treatment.organization_id)
+
+    clone_treatments(treatment, [CloneTarget(treatment.field, date.today())])
+
+    assert context_version(treatment.organization_id) != before
+
+
+def test_too_many_targets_is_rejected(treatment, monkeypatch):
+    monkeypatch.setattr(services, "MAX_CLONE_TARGETS", 3)
+
+    with pytest.raises(ValueError):
+        clone_treatments(treatment, [CloneTarget(treatment.field)] * 4)
+    assert Treatment.objects.count() == 1
+
+
+@pytest.fixture
+def logged_client(client, treatment):
+    user = User.objects.create_user(username="clone", password="pass", organization=treatment.organization)
+    client.force_login(user)
+    return client
+
+
+def test_repeat_view_creates_every_date_with_bounded_queries(logged_client, treatment):
+    dates = [(date.today() + timedelta(weeks=i + 1)).isoformat() for i in range(26)]
+
+    with CaptureQueriesContext(connection) as ctx:
+        response = logged_client.post(reverse('treatment-repeat', args=[treatment.pk]), {'dates': dates})
+
+    assert response.status_code == 302
+    assert Treatment.objects.filter(field=treatment.field).count() == 27
+    assert TreatmentProduct.objects.count() == 6 * 27
+    assert len(ctx.captured_queries) <= 20
+
+
+def test_clone_view_uses_each_field_options(logged_client, treatment):
+    org = treatment.organization
+    first, second = FieldFactory(organization=org, area=2.0), FieldFactory(organization=org, area=3.0)
+
+    response = logged_client.post(reverse('treatment-clone', args=[treatment.pk]), {
+        'field_id': [first.pk, second.pk],
+        'date': '2030-05-01',
+        f'name_{second.pk}': 'Copia B',
+        f'date_{second.pk}': '2030-06-01',
+    })
+
+    assert response.status_code == 302
+    assert Treatment.objects.get(field=first).date == date(2030, 5, 1)
+    clone = Treatment.objects.get(field=second)
+    assert (clone.name, clone.date) == ('Copia B', date(2030, 6, 1))
+    assert clone.treatmentproduct_set.count() == 6
+
+
+def test_clone_view_rejects_fields_of_other_organizations(logged_client, treatment):
+    foreign = FieldFactory(organization=OrganizationFactory(name="Otra organización"))
+
+    response = logged_client.post(reverse('treatment-clone', args=[treatment.pk]), {'field_id': [foreign.pk]})
+
+    assert response.status_code == 404
+    assert Treatment.objects.count() == 1
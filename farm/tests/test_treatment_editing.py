@@ -3,7 +3,9 @@ from decimal import Decimal
 
 import pytest
 from django.contrib.auth import get_user_model
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
 from accounts.models import Organization
@@ -155,3 +157,135 @@ class TreatmentEditViewTest(TestCase):
         updated_tp_1 = TreatmentProduct.objects.get(treatment=self.treatment, product=self.product_1)
         self.assertEqual(updated_tp_1.dose, Decimal("3.00"))
 
+
+@pytest.mark.django_db
+class TreatmentProductFormSetQueriesTest(TestCase):
+    """Guardar el formset cuesta las mismas consultas con 2 que con 8 productos."""
+
+    def setUp(self):
+        self.organization = Organization.objects.create(name="Org Formset Queries")
+        self.user = User.objects.create_user(
+            username="formset-queries",
+            password="pass123",
+            organization=self.organization,
+        )
+        self.client.force_login(self.user)
+        # Primera petición fuera de la medición: el middleware actualiza last_activity una vez por minuto
+        self.client.get(reverse("treatment-list"))
+        self.field = Field.objects.create(
+            name="Parcela Q", area=4.0, crop="Olivo", planting_year=2020, organization=self.organization,
+        )
+        self.machine = Machine.objects.create(
+            name="Atomizador", type="Pulverizador", capacity=1500, organization=self.organization,
+        )
+        product_type = ProductType.objects.create(name="Fungicida", organization=self.organization)
+        self.products = [
+            Product.objects.create(
+                name=f"Producto {i}", product_type=product_type, spraying_dose=Decimal("1.00"),
+                spraying_dose_type="l_per_ha" if i % 2 else "l_per_1000l", price=Decimal("12.50"),
+                organization=self.organization,
+            )
+            for i in range(16)
+        ]
+
+    def _data(self, treatment_name, rows, initial=0):
+        data = {
+            "name": treatment_name,
+            "type": "spraying",
+            "date": (date.today() + timedelta(days=2)).isoformat(),
+            "field": str(self.field.pk),
+            "machine": str(self.machine.pk),
+            "water_per_ha": "800",
+            "finish_date": "",
+            "treatmentproduct_set-TOTAL_FORMS": str(len(rows)),
+            "treatmentproduct_set-INITIAL_FORMS": str(initial),
+            "treatmentproduct_set-MIN_NUM_FORMS": "1",
+            "treatmentproduct_set-MAX_NUM_FORMS": "1000",
+        }
+        for i, (pk, product, dose, delete) in enumerate(rows):
+            prefix = f"treatmentproduct_set-{i}"
+            data.update({
+                f"{prefix}-id": str(pk or ""),
+                f"{prefix}-product": str(product.pk),
+                f"{prefix}-dose": dose,
+                f"{prefix}-total_dose": "0",  # se recalcula desde la dosis
+                f"{prefix}-DELETE": "on" if delete else "",
+            })
+        return data
+
+    def _count(self, url, data):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 302)
+        return len(ctx.captured_queries)
+
+    def test_create_costs_constant_queries(self):
+        counts = []
+        for n in (2, 8):
+            rows = [(None, product, "1.500", False) for product in self.products[:n]]
+            counts.append(self._count(reverse("treatment-create"), self._data(f"Nuevo {n}", rows)))
+            treatment = Treatment.objects.get(name=f"Nuevo {n}")
+            self.assertEqual(treatment.treatmentproduct_set.count(), n)
+
+        self.assertEqual(counts[0], counts[1])
+
+    def _treatment_with_products(self, name, products):
+        treatment = Treatment.objects.create(
+            name=name, type="spraying", date=date.today() + timedelta(days=2),
+            field=self.field, machine=self.machine, water_per_ha=800, organization=self.organization,
+        )
+        existing = [
+            TreatmentProduct.objects.create(
+                treatment=treatment, product=product, dose=Decimal("1.000"), dose_type="l_per_ha",
+                total_dose=0, total_dose_unit="L", position=i,
+            )
+            for i, product in enumerate(products)
+        ]
+        return treatment, existing
+
+    def test_edit_costs_constant_queries_and_matches_model_save(self):
+        fields = ("product_id", "dose", "dose_type", "total_dose", "total_dose_unit", "unit_price",
+                  "total_price", "price_per_ha", "organization_id")
+        counts = []
+        for n in (2, 8):
+            treatment, existing = self._treatment_with_products(f"Edición {n}", self.products[:n])
+            # Cambia la dosis de todos menos el último, borra el último y añade n nuevos
+            rows = [(tp.pk, tp.product, "2.250", False) for tp in existing[:-1]]
+            rows.append((existing[-1].pk, existing[-1].product, "1.000", True))
+            rows += [(None, product, "0.750", False) for product in self.products[8:8 + n]]
+            url = reverse("treatment-edit", kwargs={"pk": treatment.pk})
+            counts.append(self._count(url, self._data(f"Edición {n}", rows, initial=n)))
+
+            # Referencia: los mismos cambios guardando fila a fila con TreatmentProduct.save()
+            reference, reference_existing = self._treatment_with_products(f"Referencia {n}", self.products[:n])
+            for tp in reference_existing[:-1]:
+                tp.dose = Decimal("2.250")
+                tp.save()
+            reference_existing[-1].delete()
+            for i, product in enumerate(self.products[8:8 + n], start=n - 1):
+                TreatmentProduct.objects.create(
+                    treatment=reference, product=product, dose=Decimal("0.750"), total_dose=0,
+                    total_dose_unit="L", position=i,
+                )
+
+            saved = list(TreatmentProduct.objects.filter(treatment=treatment).order_by("position"))
+            self.assertEqual([tp.position for tp in saved], list(range(2 * n - 1)))
+            self.assertNotIn(existing[-1].pk, [tp.pk for tp in saved])
+            expected = TreatmentProduct.objects.filter(treatment=reference).order_by("position")
+            self.assertEqual(
+                [tuple(getattr(tp, name) for name in fields) for tp in saved],
+                list(expected.values_list(*fields)),
+            )
+
+        self.assertEqual(counts[0], counts[1])
+
+    def test_duplicated_product_is_a_form_error_even_without_dose(self):
+        treatment, (existing,) = self._treatment_with_products("Duplicado", self.products[:1])
+        rows = [(existing.pk, self.products[0], "1.000", False), (None, self.products[0], "0", False)]
+
+        response = self.client.post(reverse("treatment-edit", kwargs={"pk": treatment.pk}),
+                                    self._data("Duplicado", rows, initial=1))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "está duplicado")
+        self.assertEqual(treatment.treatmentproduct_set.count(), 1)
@@ -156,3 +156,106 @@ class TestTreatmentProductDoseCalculations:
         treatment.refresh_from_db()
         assert treatment.water_per_ha == 0
         assert treatment.real_water_per_ha == 0
+
+    def _treatment_with_products(self, n_products=4):
+        field = FieldFactory(area=5.0)
+        treatment = SprayingTreatmentFactory(field=field, water_per_ha=400, organization=field.organization)
+        dose_types = ['l_per_1000l', 'kg_per_ha', 'pct', 'kg_per_1000l']
+        for i in range(n_products):
+            dose_type = dose_types[i % len(dose_types)]
+            product = SprayingProductFactory(
+                spraying_dose=Decimal('2.0'), spraying_dose_type=dose_type,
+                price=Decimal('12.50'), organization=field.organization,
+            )
+            TreatmentProductFactory(
+                treatment=treatment, product=product, dose=Decimal('2.0') + i, dose_type=dose_type,
+                total_dose=Decimal('0'), unit_price=Decimal('0'), organization=field.organization,
+                total_overridden=(i == 1),
+            )
+        return treatment
+
+    def test_bulk_recalculation_matches_per_row_save(self):
+        # Given: dos tratamientos idénticos a los que se cambia el mojado y la superficie
+        bulk_treatment = self._treatment_with_products()
+        row_treatment = self._treatment_with_products()
+        for treatment in (bulk_treatment, row_treatment):
+            treatment.real_water_per_ha = 650
+            treatment.applied_area = 3.5
+
+        # When: uno se recalcula en bloque y el otro producto a producto
+        Treatment.objects.filter(pk__in=[bulk_treatment.pk, row_treatment.pk]).update(
+            real_water_per_ha=650, applied_area=3.5, finish_date=date.today(),
+        )
+        TreatmentProduct.bulk_recalculate([bulk_treatment])
+        for treatment_product in row_treatment.treatmentproduct_set.all():
+            treatment_product.save()
+
+        # Then: mismos resultados
+        fields = ['dose', 'dose_type', 'total_dose', 'total_dose_unit', 'unit_price', 'total_price', 'price_per_ha']
+        bulk = list(bulk_treatment.treatmentproduct_set.order_by('position', 'id').values_list(*fields))
+        rows = list(row_treatment.treatmentproduct_set.order_by('position', 'id').values_list(*fields))
+        assert bulk == rows
+        assert all(total_price > 0 for *_, total_price, _ in bulk)
+
+    def test_recalculation_uses_constant_queries(self, django_assert_num_queries):
+        few = self._treatment_with_products(2)
+        many = self._treatment_with_products(12)
+
+        for treatment in (few, many):
+            treatment.water_per_ha = 800
+            # 1 SELECT de productos + 1 UPDATE en bloque
+            with django_assert_num_queries(2):
+                treatment.recalculate_product_doses()
+
+        assert many.treatmentproduct_set.get(dose_type='l_per_1000l', dose=Decimal('2.0')).total_dose == Decimal('8.0')
+
+    def test_bulk_recalculation_of_many_treatments(self, django_assert_num_queries):
+        treatments = [self._treatment_with_products(3) for _ in range(5)]
+        treatments = list(Treatment.objects.filter(pk__in=[t.pk for t in treatments]).select_related('field'))
+        for treatment in treatments:
+            treatment.water_per_ha = 1000
+
+        with django_assert_num_queries(2):
+            assert TreatmentProduct.bulk_recalculate(treatments) == 15
+
+    def test_saving_a_loaded_treatment_does_not_reread_it(self, django_assert_num_queries):
+        treatment = self._treatment_with_products(3)
+        treatment = Treatment.objects.select_related('field').get(pk=treatment.pk)
+
+        # Sin cambios en mojado/parcela/superficie: solo el UPDATE del tratamiento
+        treatment.name = "Renombrado"
+        with django_assert_num_queries(1):
+            treatment.save()
+
+        # Con cambio de mojado: UPDATE + recálculo en bloque (SELECT + UPDATE)
+        treatment.water_per_ha = 800
+        with django_assert_num_queries(3):
+            treatment.save()
+        assert treatment.treatmentproduct_set.get(dose_type='l_per_1000l').total_dose == Decimal('8.0')
+
+        # El snapshot se renueva al guardar: volver a guardar no recalcula
+        with django_assert_num_queries(1):
+            treatment.save()
+
+    def test_partial_save_skips_change_detection(self, django_assert_num_queries):
+        treatment = Treatment.objects.select_related('field').get(pk=self._treatment_with_products(2).pk)
+        treatment.water_per_ha = 900
+        treatment.status = Treatment.STATUS_DELAYED
+
+        with django_assert_num_queries(1):
+            treatment.save(update_fields=['status'])
+
+        # El mojado no se ha guardado, así que sigue pendiente de recalcular
+        with django_assert_num_queries(3):
+            treatment.save()
+
+    def test_instance_without_snapshot_falls_back_to_the_database(self):
+        original = self._treatment_with_products(2)
+        detached = Treatment(**{
+            f.attname: getattr(original, f.attname) for f in Treatment._meta.concrete_fields
+        })
+        detached.water_per_ha = 800
+
+        detached.save()
+
+        assert original.treatmentproduct_set.get(dose_type='l_per_1000l').total_dose == Decimal('8.0')
@@ -0,0 +1,245 @@
+from datetime import date, timedelta
+from decimal import Decimal
+
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from accounts.models import User
+from farm.models import Treatment, TreatmentProduct, TreatmentSeries
+from farm.services import CloneTarget, clone_treatments, get_shopping_list
+from farm.tests.factories import (
+    FieldFactory, MachineFactory, OrganizationFactory, SprayingProductFactory, TreatmentFactory,
+    TreatmentProductFactory,
+)
+from farm.treatment_series import expand_series, materialize_occurrence, occurrence_key, series_for_user
+
+# Viernes de la semana que viene: la plantilla y el primer día de la serie
+FRIDAY = date.today() + timedelta(days=(4 - date.today().weekday()) % 7 + 7)
+
+
+@pytest.fixture
+def treatment(db):
+    org = OrganizationFactory()
+    field = FieldFactory(organization=org, area=4.0)
+    template = TreatmentFactory(
+        organization=org, field=field, machine=MachineFactory(organization=org, capacity=1500),
+        water_per_ha=600, date=FRIDAY, name="Programa semanal",
+    )
+    for i, dose_type in enumerate(['l_per_1000l', 'kg_per_ha', 'pct']):
+        product = SprayingProductFactory(
+            organization=org, spraying_dose=Decimal('1.0'), spraying_dose_type=dose_type, price=Decimal('9.90'),
+        )
+        TreatmentProductFactory(
+            treatment=template, product=product, dose=Decimal('1.25') + i, dose_type=dose_type,
+            organization=org, position=i,
+        )
+    return template
+
+
+@pytest.fixture
+def series(treatment):
+    # Nueve viernes; el primero es la propia plantilla
+    return TreatmentSeries.objects.create(
+        template=treatment, weekday=4, start_date=FRIDAY, end_date=FRIDAY + timedelta(weeks=8),
+    )
+
+
+@pytest.fixture
+def user(treatment):
+    return User.objects.create_user(username="series", password="pass", organization=treatment.organization)
+
+
+@pytest.fixture
+def logged_client(client, user):
+    client.force_login(user)
+    return client
+
+
+def _dates(occurrences):
+    return [o.date for o in occurrences]
+
+
+def test_rule_dates_follow_weekday_and_interval(treatment):
+    rule = TreatmentSeries(template=treatment, weekday=4, interval_weeks=2,
+                           start_date=date(2026, 3, 2), end_date=date(2026, 4, 30))
+
+    assert list(rule.rule_dates()) == [date(2026, 3, 6), date(2026, 3, 20), date(2026, 4, 3), date(2026, 4, 17)]
+    # Empezando a mitad de la serie se mantiene la cadencia
+    assert list(rule.rule_dates(date(2026, 3, 21), date(2026, 4, 10))) == [date(2026, 4, 3)]
+
+
+def test_series_expands_without_creating_rows(series, user):
+    occurrences = expand_series(series_for_user(user))
+
+    assert _dates(occurrences) == [FRIDAY + timedelta(weeks=i) for i in range(1, 9)]
+    assert Treatment.objects.count() == 1
+    assert occurrences[0].treatment.pk is None
+    assert occurrences[0].treatment.status == Treatment.STATUS_PENDING
+
+
+def test_virtual_doses_match_a_materialized_clone(series, user, treatment):
+    occurrence = expand_series(series_for_user(user), with_products=True)[0]
+    clone = clone_treatments(treatment, [CloneTarget(treatment.field, occurrence.date)])[0]
+
+    fields = ('product_id', 'dose', 'dose_type', 'total_dose', 'total_dose_unit', 'unit_price', 'total_price')
+    virtual = [tuple(getattr(tp, name) for name in fields) for tp in occurrence.products]
+    stored = list(TreatmentProduct.objects.filter(treatment=clone).order_by('position').values_list(*fields))
+    assert virtual == stored
+
+
+def test_expansion_queries_do_not_depend_on_occurrences(treatment, user):
+    counts = []
+    for weeks in (2, 40):
+        TreatmentSeries.objects.all().delete()
+        TreatmentSeries.objects.create(template=treatment, weekday=4, start_date=FRIDAY,
+                                       end_date=FRIDAY + timedelta(weeks=weeks))
+        with CaptureQueriesContext(connection) as ctx:
+            expand_series(series_for_user(user), with_products=True)
+        counts.append(len(ctx.captured_queries))
+
+    assert counts[0] == counts[1] == 3
+
+
+def test_calendar_api_lists_virtual_occurrences_in_range(logged_client, series):
+    response = logged_client.get(reverse('api-calendar-treatments'), {
+        'start': FRIDAY.isoformat(),
+        'end': (FRIDAY + timedelta(weeks=2)).isoformat(),
+    })
+
+    events = response.json()
+    assert [e['id'] for e in events] == [
+        series.template_id,
+        occurrence_key(series.pk, FRIDAY + timedelta(weeks=1)),
+        occurrence_key(series.pk, FRIDAY + timedelta(weeks=2)),
+    ]
+    assert events[1]['virtual'] and events[1]['series'] == series.pk
+
+
+def test_occurrence_detail_api(logged_client, series):
+    day = FRIDAY + timedelta(weeks=3)
+
+    data = logged_client.get(reverse('api-series-occurrence', args=[series.pk, day.isoformat()])).json()
+
+    assert data['date'] == day.isoformat()
+    assert data['name'] == "Programa semanal"
+    assert len(data['products']) == 3
+    missing = logged_client.get(reverse('api-series-occurrence', args=[series.pk, (day + timedelta(days=1)).isoformat()]))
+    assert missing.status_code == 404
+
+
+def test_shopping_list_includes_virtual_occurrences(series, user, treatment):
+    template_total = sum(tp.total_dose for tp in treatment.treatmentproduct_set.all())
+
+    items = get_shopping_list(user)
+
+    assert sum(item['treatment_count'] for item in items) == 3 * 9
+    assert sum(item['total_dose'] for item in items) == round(template_total * 9, 2)
+    # Filtrando por tratamientos concretos solo cuentan las filas guardadas
+    assert sum(i['treatment_count'] for i in get_shopping_list(user, treatment_ids=[treatment.pk])) == 3
+
+
+def test_shopping_list_filter_accepts_virtual_occurrences(series, user, treatment):
+    keys = [occurrence_key(series.pk, FRIDAY + timedelta(weeks=w)) for w in (1, 3)]
+
+    only_virtual = get_shopping_list(user, treatment_ids=keys)
+    mixed = get_shopping_list(user, treatment_ids=[str(treatment.pk), *keys])
+
+    assert sum(i['treatment_count'] for i in only_virtual) == 3 * 2
+    assert sum(i['treatment_count'] for i in mixed) == 3 * 3
+    assert get_shopping_list(user, treatment_ids=[occurrence_key(series.pk, FRIDAY + timedelta(days=1))]) == []
+
+
+def test_shopping_list_page_offers_virtual_occurrences(logged_client, series):
+    key = occurrence_key(series.pk, FRIDAY + timedelta(weeks=2))
+
+    page = logged_client.get(reverse('treatment-shopping-list'))
+    filtered = logged_client.get(reverse('treatment-shopping-list'), {'treatment': key})
+
+    assert len(page.context['available_occurrences']) == 8
+    assert f'value="{key}"' in page.content.decode()
+    assert filtered.context['selected_treatments'] == [key]
+    assert sum(i['treatment_count'] for i in filtered.context['product_items']) == 3
+
+
+def test_editing_an_occurrence_materializes_it_once(logged_client, series):
+    day = FRIDAY + timedelta(weeks=2)
+    url = reverse('treatment-series-edit', args=[series.pk, day.isoformat()])
+
+    first = logged_client.post(url)
+    second = logged_client.post(url)
+
+    occurrence = Treatment.objects.get(series=series)
+    assert first.url == second.url == reverse('treatment-edit', args=[occurrence.pk])
+    assert (occurrence.date, occurrence.series_date) == (day, day)
+    assert occurrence.treatmentproduct_set.count() == 3
+    assert day not in _dates(expand_series([series]))
+
+
+def test_finishing_an_occurrence_materializes_and_completes_it(logged_client, series):
+    day = FRIDAY + timedelta(weeks=1)
+
+    response = logged_client.post(reverse('treatment-series-finish', args=[series.pk, day.isoformat()]),
+                                  {'finish_date': day.isoformat()})
+
+    assert response.json() == {'success': True}
+    occurrence = Treatment.objects.get(series=series, series_date=day)
+    assert occurrence.status == Treatment.STATUS_COMPLETED
+
+
+def test_invalid_occurrence_date_creates_nothing(logged_client, series):
+    for day in (FRIDAY, FRIDAY + timedelta(days=1), FRIDAY + timedelta(weeks=9)):
+        response = logged_client.post(reverse('treatment-series-edit', args=[series.pk, day.isoformat()]))
+        assert response.status_code == 404
+    with pytest.raises(ValueError):
+        materialize_occurrence(series, FRIDAY + timedelta(days=2))
+    assert Treatment.objects.count() == 1
+
+
+def test_deleted_occurrence_does_not_come_back(logged_client, series):
+    day = FRIDAY + timedelta(weeks=4)
+    occurrence = materialize_occurrence(series, day)
+
+    logged_client.post(reverse('treatment-delete', args=[occurrence.pk]))
+
+    series.refresh_from_db()
+    assert series.excluded_dates == [day.isoformat()]
+    assert day not in _dates(expand_series([series]))
+
+
+def test_repeat_view_saves_a_series_instead_of_copies(logged_client, treatment):
+    response = logged_client.post(reverse('treatment-repeat', args=[treatment.pk]), {
+        'mode': 'series',
+        'weekday': 4,
+        'interval_weeks': 1,
+        'start_date': FRIDAY.isoformat(),
+        'end_date': (FRIDAY + timedelta(weeks=25)).isoformat(),
+    })
+
+    assert response.status_code == 302
+    series = TreatmentSeries.objects.get()
+    assert series.organization_id == treatment.organization_id
+    assert Treatment.objects.count() == 1
+    assert len(expand_series([series])) == 25
+
+
+def test_repeat_view_rejects_an_inverted_range(logged_client, treatment):
+    response = logged_client.post(reverse('treatment-repeat', args=[treatment.pk]), {
+        'mode': 'series', 'weekday': 4, 'interval_weeks': 1,
+        'start_date': FRIDAY.isoformat(), 'end_date': (FRIDAY - timedelta(days=1)).isoformat(),
+    })
+
+    assert response.status_code == 200
+    assert not TreatmentSeries.objects.exists()
+
+
+def test_series_of_other_organizations_are_not_reachable(client, series):
+    other = User.objects.create_user(username="otro", password="pass",
+                                     organization=OrganizationFactory(name="Otra organización"))
+    client.force_login(other)
+    day = (FRIDAY + timedelta(weeks=1)).isoformat()
+
+    assert client.post(reverse('treatment-series-edit', args=[series.pk, day])).status_code == 404
+    assert client.get(reverse('api-series-occurrence', args=[series.pk, day])).status_code == 404
+    assert Treatment.objects.count() == 1
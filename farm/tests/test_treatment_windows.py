@@ -0,0 +1,89 @@
+from farm.treatment_windows import SprayConstraints, best_windows, hourly_columns, score_hours, upcoming_windows
+
+
+def _hour(dt, wind=5.0, gusts=10.0, prob=0, rain=0.0, temp=18.0, humidity=60):
+    return {
+        "datetime": dt, "wind_speed": wind, "wind_gusts": gusts, "precipitation_probability": prob,
+        "precipitation": rain, "temperature": temp, "humidity": humidity,
+    }
+
+
+def _day(date_str, overrides_by_hour=None):
+    overrides_by_hour = overrides_by_hour or {}
+    return [_hour(f"{date_str}T{h:02d}:00", **overrides_by_hour.get(h, {})) for h in range(24)]
+
+
+def test_ideal_hours_score_one_and_hard_limits_score_zero():
+    hours = [
+        _hour("2025-06-02T08:00"),
+        _hour("2025-06-02T09:00", wind=20.0),
+        _hour("2025-06-02T10:00", prob=20),
+        _hour("2025-06-02T11:00", rain=0.4),
+        _hour("2025-06-02T12:00", temp=31.0),
+        _hour("2025-06-02T13:00", humidity=25),
+        _hour("2025-06-02T14:00", wind=15.0),
+        _hour("2025-06-02T15:00", temp=None, humidity=None),
+    ]
+
+    assert score_hours(hourly_columns(hours)) == [1.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.5, 1.0]
+
+
+def test_windows_are_consecutive_runs_sorted_by_score():
+    overrides = {h: {"wind": 25.0} for h in range(10, 17)}
+    overrides.update({h: {"wind": 18.0} for h in range(0, 4)})  # 0.2: fuera de ventana
+    overrides.update({h: {"wind": 14.0} for h in (4, 5)})  # 0.6: aceptable pero no ideal
+    hours = _day("2025-06-02", overrides)
+
+    windows = best_windows(hours, limit=None)
+
+    assert [(w["start"], w["end"], w["hours"]) for w in windows] == [
+        ("2025-06-02T17:00", "2025-06-03T00:00", 7),
+        ("2025-06-02T04:00", "2025-06-02T10:00", 6),
+    ]
+    assert [w["score"] for w in windows] == [1.0, 0.867]
+    assert windows[1]["min_score"] == 0.6
+
+
+def test_gaps_in_the_series_split_windows_and_short_runs_are_dropped():
+    hours = [_hour("2025-06-02T22:00"), _hour("2025-06-02T23:00"), _hour("2025-06-03T02:00"),
+             _hour("2025-06-03T03:00", prob=50)]
+
+    windows = best_windows(hours, limit=None)
+
+    assert [(w["start"], w["hours"]) for w in windows] == [("2025-06-02T22:00", 2)]
+    assert best_windows(hours, SprayConstraints(min_hours=1), limit=None)[-1]["start"] == "2025-06-03T02:00"
+
+
+def test_upcoming_windows_trims_the_window_in_progress():
+    windows = best_windows(_day("2025-06-02", {12: {"wind": 30.0}}), limit=None)
+
+    upcoming = upcoming_windows(windows, "2025-06-02T15:20")
+
+    afternoon = next(w for w in windows if w["start"] == "2025-06-02T13:00")
+    assert upcoming == [{**afternoon, "start": "2025-06-02T15:00", "hours": 9, "scores": afternoon["scores"][2:]}]
+
+
+def test_trimmed_window_is_scored_on_its_remaining_hours():
+    overrides = {h: {"wind": 14.0} for h in (8, 9)}  # 0.6 al principio de la ventana
+    overrides.update({h: {"wind": 30.0} for h in range(12, 24)})
+    windows = best_windows(_day("2025-06-02", overrides), limit=None)
+    assert (windows[0]["score"], windows[0]["min_score"]) == (0.933, 0.6)
+
+    trimmed = upcoming_windows(windows, "2025-06-02T10:05")[0]
+
+    assert (trimmed["start"], trimmed["hours"]) == ("2025-06-02T10:00", 2)
+    assert (trimmed["score"], trimmed["min_score"], trimmed["scores"]) == (1.0, 1.0, [1.0, 1.0])
+
+
+def test_trimmed_window_is_reranked_or_dropped():
+    overrides = {h: {"wind": 14.0} for h in (10, 11, 14, 15, 16)}  # 0.6
+    overrides.update({h: {"wind": 30.0} for h in (12, 13)})
+    windows = best_windows(_day("2025-06-02", overrides), limit=None)
+    assert [(w["start"], w["score"]) for w in windows] == [("2025-06-02T00:00", 0.933), ("2025-06-02T14:00", 0.88)]
+
+    # A la mañana le quedan dos horas de 0.6: pasa detrás de la de la tarde
+    upcoming = upcoming_windows(windows, "2025-06-02T10:05")
+    assert [(w["start"], w["score"]) for w in upcoming] == [("2025-06-02T14:00", 0.88), ("2025-06-02T10:00", 0.6)]
+
+    # Con una sola hora por delante ya no llega a min_hours
+    assert [w["start"] for w in upcoming_windows(windows, "2025-06-02T11:05")] == ["2025-06-02T14:00"]
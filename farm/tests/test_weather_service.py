@@ -0,0 +1,662 @@
+import json
+import random
+import time
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+import pytest
+import urllib3
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.urls import reverse
+
+from core.models import FeatureFlag, is_enabled, reset_flag_trip, trip_flag
+from farm import weather_service
+from farm.aemet_replay import DEFAULT_RECORDING_DIR, AemetReplayServer, load_recording, replay_aemet
+from farm.models import AemetMunicipality
+from farm.tests.factories import FieldFactory, OrganizationFactory
+
+# Referencia a la función real: el fixture autouse la sustituye por un fake
+aemet_fetch = weather_service._aemet_fetch
+
+MUNICIPIOS = [
+    {"cod": "41091", "nombre": "Sevilla", "lat": 37.38, "lon": -5.98},
+    {"cod": "14021", "nombre": "Córdoba", "lat": 37.88, "lon": -4.77},
+]
+
+MUNICIPIOS_RAW = [
+    {"id": "id41091", "nombre": "Sevilla", "latitud_dec": "37.38", "longitud_dec": "-5.98"},
+    {"id": "id14021", "nombre": "Córdoba", "latitud_dec": "37.88", "longitud_dec": "-4.77"},
+    {"id": "id99999", "nombre": "Sin coordenadas"},
+]
+
+HORARIA = [{
+    "prediccion": {"dia": [{
+        "fecha": "2025-06-02T00:00:00",
+        "temperatura": [{"hora": "06", "value": "14"}, {"hora": "12", "value": "26"}],
+        "humedadRelativa": [{"hora": "06", "value": "80"}, {"hora": "12", "value": "40"}],
+        "precipitacion": [{"periodo": "08", "value": "Ip"}],
+        "probPrecipitacion": [{"periodo": "0814", "value": "10"}],
+        "vientoAndRachaMax": [{"periodo": "0612", "velocidad": ["12"], "direccion": ["N"]}],
+        "estadoCielo": [{"periodo": "0612", "value": "12"}],
+    }]},
+}]
+
+DIARIA = [{
+    "prediccion": {"dia": [
+        {
+            "fecha": "2025-06-02T00:00:00",
+            "temperatura": {"maxima": 27, "minima": 13},
+            "probPrecipitacion": [{"value": 10}],
+            "viento": [{"velocidad": 15}],
+            "estadoCielo": [{"value": "12"}],
+        },
+        {
+            "fecha": "2025-06-03T00:00:00",
+            "temperatura": {"maxima": 30, "minima": 15},
+            "probPrecipitacion": [{"value": 0}],
+            "viento": [{"velocidad": 10}],
+            "estadoCielo": [{"value": "11"}],
+        },
+    ]},
+}]
+
+
+def _geojson_point(lat, lon):
+    return json.dumps({"type": "Point", "coordinates": [lon, lat]})
+
+
+def _point(lat, lon, pk=None):
+    return SimpleNamespace(pk=pk, geometry=_geojson_point(lat, lon))
+
+
+def _fake_fetch(path, deadline=None, timeout=None):
+    if path.endswith("/maestro/municipios"):
+        return MUNICIPIOS_RAW
+    if "/horaria/" in path:
+        return HORARIA
+    if "/diaria/" in path:
+        return DIARIA
+    return None
+
+
+@pytest.fixture(autouse=True)
+def aemet(settings):
+    settings.AEMET_API_KEY = "test-key"
+    cache.clear()
+    with patch.object(weather_service, "_municipios_cache", MUNICIPIOS), \
+            patch.object(weather_service, "_municipios_ts", time.time()), \
+            patch.object(weather_service, "_latency_avg", None), \
+            patch.object(weather_service, "_aemet_fetch", side_effect=_fake_fetch) as fetch:
+        yield fetch
+    cache.clear()
+
+
+def test_fields_in_same_municipality_share_one_download(aemet):
+    first = weather_service.get_weather_for_field(_point(37.39, -5.99))
+    second = weather_service.get_weather_for_field(_point(37.37, -5.97))
+
+    assert aemet.call_count == 2  # horaria + diaria, solo una vez
+    assert first["municipality"] == second["municipality"] == "Sevilla"
+    assert (first["lat"], first["lon"]) == (37.39, -5.99)
+    assert (second["lat"], second["lon"]) == (37.37, -5.97)
+    assert first["daily"] == second["daily"]
+
+
+def test_each_municipality_is_cached_separately(aemet):
+    weather_service.get_weather_for_field(_point(37.39, -5.99))
+    weather_service.get_weather_for_field(_point(37.88, -4.77))
+
+    assert aemet.call_count == 4
+
+
+def test_stale_entry_is_served_and_refreshed_in_background(aemet):
+    municipio = MUNICIPIOS[0]
+    stale = {"timezone": "Europe/Madrid", "municipality": "Sevilla", "daily": ["old"]}
+    cache.set(
+        weather_service._forecast_cache_key(municipio["cod"]),
+        {"fetched_at": time.time() - weather_service._FORECAST_FRESH_TTL - 1, "data": stale},
+    )
+
+    with patch.object(weather_service, "_refresh_in_background") as refresh:
+        result = weather_service.get_forecast_for_municipio(municipio)
+        # Un segundo acceso mientras se refresca no lanza otra descarga
+        weather_service.get_forecast_for_municipio(municipio)
+
+    assert result == stale
+    refresh.assert_called_once_with(municipio)
+    assert aemet.call_count == 0
+
+
+def test_waiting_worker_does_not_download_or_release_a_foreign_lock(aemet):
+    municipio = MUNICIPIOS[0]
+    lock_key = weather_service._forecast_lock_key(municipio["cod"])
+    cache.add(lock_key, 1)  # otro worker está descargando
+
+    with patch.object(weather_service, "_FORECAST_LOCK_WAIT", 0.3):
+        assert weather_service.get_forecast_for_municipio(municipio) is None
+
+    assert aemet.call_count == 0
+    assert cache.get(lock_key) == 1
+
+
+def test_waiting_worker_takes_over_when_the_lock_is_released_empty(aemet):
+    municipio = MUNICIPIOS[0]
+    lock_key = weather_service._forecast_lock_key(municipio["cod"])
+    cache.add(lock_key, 1, timeout=0.1)  # el otro worker termina sin guardar nada
+
+    result = weather_service.get_forecast_for_municipio(municipio)
+
+    assert result["municipality"] == "Sevilla"
+    assert aemet.call_count == 2
+    assert cache.get(lock_key) is None
+
+
+def test_failed_refresh_keeps_previous_entry(aemet):
+    municipio = MUNICIPIOS[0]
+    weather_service.refresh_forecast(municipio)
+    aemet.side_effect = lambda path, deadline=None: None
+
+    assert weather_service.refresh_forecast(municipio) is None
+    entry = cache.get(weather_service._forecast_cache_key(municipio["cod"]))
+    assert entry["data"]["municipality"] == "Sevilla"
+
+
+def test_without_api_key_returns_none(settings, aemet):
+    settings.AEMET_API_KEY = ""
+
+    assert weather_service.get_weather_for_field(_point(37.39, -5.99)) is None
+    assert aemet.call_count == 0
+
+
+def test_hourly_and_daily_are_fetched_concurrently(aemet):
+    def slow_fetch(path, deadline=None):
+        time.sleep(0.3)
+        return _fake_fetch(path)
+
+    aemet.side_effect = slow_fetch
+    started = time.monotonic()
+    forecast = weather_service._fetch_forecast(MUNICIPIOS[0])
+    elapsed = time.monotonic() - started
+
+    assert forecast["_debug"]["horaria_ok"] and forecast["_debug"]["diaria_ok"]
+    assert elapsed < 0.55  # ~ la descarga más lenta, no la suma
+
+
+def test_prediction_missing_the_deadline_is_dropped(aemet):
+    def fetch(path, deadline=None):
+        if "/horaria/" in path:
+            time.sleep(0.5)
+        return _fake_fetch(path)
+
+    aemet.side_effect = fetch
+    with patch.object(weather_service, "_FORECAST_DEADLINE", 0.2):
+        forecast = weather_service._fetch_forecast(MUNICIPIOS[0])
+
+    assert forecast["_debug"]["horaria_ok"] is False
+    assert forecast["_debug"]["diaria_ok"] is True
+    assert forecast["daily"]
+
+
+def test_aemet_fetch_gives_up_when_deadline_has_passed():
+    with patch.object(weather_service, "_http_get") as http_get:
+        assert aemet_fetch("/api/x", deadline=time.monotonic() - 1) is None
+    http_get.assert_not_called()
+
+
+def test_index_matches_linear_scan():
+    rnd = random.Random(7)
+    municipios = [
+        {"cod": str(i), "nombre": str(i), "lat": rnd.uniform(36, 44), "lon": rnd.uniform(-9, 4)}
+        for i in range(500)
+    ]
+    index = weather_service.MunicipioIndex(municipios)
+
+    # Incluye puntos fuera del catálogo (Canarias, mar abierto)
+    points = [(rnd.uniform(27, 46), rnd.uniform(-19, 6)) for _ in range(300)]
+    for lat, lon in points:
+        expected = min(municipios, key=lambda m: (m["lat"] - lat) ** 2 + (m["lon"] - lon) ** 2)
+        assert index.nearest(lat, lon)[0] is expected
+
+
+def test_index_k_nearest_sorted_by_distance():
+    municipios = [
+        {"cod": "a", "nombre": "A", "lat": 37.0, "lon": -5.0},
+        {"cod": "b", "nombre": "B", "lat": 37.1, "lon": -5.0},
+        {"cod": "c", "nombre": "C", "lat": 38.5, "lon": -5.0},
+        {"cod": "d", "nombre": "D", "lat": 40.0, "lon": -3.0},
+    ]
+    index = weather_service.MunicipioIndex(municipios)
+
+    assert [m["cod"] for m in index.nearest(37.09, -5.0, k=3)] == ["b", "a", "c"]
+    assert len(index.nearest(37.0, -5.0, k=10)) == 4
+    assert weather_service.MunicipioIndex([]).nearest(37.0, -5.0) == []
+
+
+def test_nearest_municipio_uses_catalog():
+    assert weather_service._nearest_municipio(37.9, -4.8)["nombre"] == "Córdoba"
+    assert [m["cod"] for m in weather_service.nearest_municipios(37.4, -5.9, k=2)] == ["41091", "14021"]
+
+
+@pytest.mark.django_db
+def test_catalog_is_loaded_from_db_without_calling_aemet(aemet):
+    weather_service.store_municipios(MUNICIPIOS)
+    weather_service.reset_municipios_cache()
+
+    assert weather_service._get_municipios() == MUNICIPIOS
+    assert aemet.call_count == 0
+
+
+@pytest.mark.django_db
+def test_empty_catalog_is_downloaded_once_and_stored(aemet):
+    weather_service.reset_municipios_cache()
+
+    assert [m["cod"] for m in weather_service._get_municipios()] == ["41091", "14021"]
+    assert list(AemetMunicipality.objects.values_list("code", flat=True)) == ["41091", "14021"]
+
+    weather_service.reset_municipios_cache()
+    weather_service._get_municipios()
+    assert aemet.call_count == 1
+
+
+@pytest.mark.django_db
+def test_refresh_municipios_command_replaces_catalog(aemet):
+    AemetMunicipality.objects.create(code="00000", name="Antiguo", lat=0, lon=0)
+
+    call_command("refresh_municipios")
+
+    assert set(AemetMunicipality.objects.values_list("name", flat=True)) == {"Sevilla", "Córdoba"}
+
+
+@pytest.fixture
+def aemet_server():
+    payloads = {
+        "/api/maestro/municipios": MUNICIPIOS_RAW,
+        "/api/prediccion/especifica/municipio/horaria/41091": HORARIA,
+        "/api/prediccion/especifica/municipio/diaria/41091": DIARIA,
+    }
+    with AemetReplayServer(payloads) as server, \
+            patch.object(weather_service, "AEMET_BASE", server.base_url), \
+            patch.object(weather_service, "_aemet_fetch", aemet_fetch), \
+            patch.dict(weather_service._http_pools, clear=True):
+        yield server
+
+
+def test_forecasts_reuse_keep_alive_connections(aemet_server):
+    first = weather_service._fetch_forecast(MUNICIPIOS[0])
+    second = weather_service._fetch_forecast(MUNICIPIOS[0])
+
+    assert first["daily"] == second["daily"]
+    assert aemet_server.requests == 8  # 2 predicciones × 2 saltos × 2 veces
+    # horaria y diaria van en paralelo: como mucho una conexión por descarga simultánea
+    assert aemet_server.connections <= 2
+
+
+def test_http_get_returns_none_on_http_error(aemet_server):
+    assert weather_service._aemet_fetch("/api/prediccion/especifica/municipio/horaria/00000") is None
+    assert aemet_server.requests == 1
+
+
+def test_connection_pools_are_created_once_per_process(aemet_server):
+    assert weather_service._get_pool(True) is weather_service._get_pool(True)
+    assert weather_service._get_pool(False) is not weather_service._get_pool(True)
+
+
+def test_replay_harness_serves_recorded_payloads_for_any_municipality():
+    payloads = load_recording()
+    catalog = weather_service._parse_municipios(payloads["/api/maestro/municipios"])
+    fields = [SimpleNamespace(pk=i, geometry="x", centroid=(m["lat"], m["lon"])) for i, m in enumerate(catalog[:3])]
+
+    with replay_aemet(payloads, municipios=catalog) as server, \
+            patch.object(weather_service, "_aemet_fetch", aemet_fetch):
+        result = weather_service.get_weather_for_fields(fields)
+
+    assert set(result["municipalities"]) == {m["cod"] for m in catalog[:3]}
+    assert result["errors"] == {}
+    assert server.requests == 12  # 3 municipios × 2 predicciones × 2 saltos
+
+
+def test_weather_pipeline_benchmark_runs_offline(capsys):
+    with patch.object(weather_service, "_aemet_fetch", aemet_fetch):
+        call_command("benchmark_weather_pipeline", fields=5, iterations=1, catalog_size=0)
+
+    out = capsys.readouterr().out
+    assert "Lote en frío" in out and "parcelas sin previsión" not in out
+
+
+def test_batch_groups_fields_by_municipality(aemet):
+    fields = [
+        _point(37.39, -5.99, pk=1),
+        _point(37.37, -5.97, pk=2),
+        _point(37.88, -4.77, pk=3),
+        SimpleNamespace(pk=4, geometry=""),
+    ]
+
+    result = weather_service.get_weather_for_fields(fields)
+
+    assert aemet.call_count == 4  # 2 municipios × (horaria + diaria)
+    assert set(result["municipalities"]) == {"41091", "14021"}
+    assert result["fields"][1]["municipality_code"] == result["fields"][2]["municipality_code"] == "41091"
+    assert result["fields"][3] == {"municipality_code": "14021", "lat": 37.88, "lon": -4.77}
+    assert list(result["errors"]) == [4]
+
+
+def test_batch_reports_fields_whose_municipality_failed(aemet):
+    aemet.side_effect = lambda path, deadline=None: None
+
+    result = weather_service.get_weather_for_fields([_point(37.39, -5.99, pk=1)])
+
+    assert result["municipalities"] == {}
+    assert result["fields"] == {}
+    assert 1 in result["errors"]
+
+
+@pytest.mark.django_db
+def test_batch_weather_endpoint_only_returns_own_fields(client, aemet):
+    organization = OrganizationFactory(name="Org Tiempo")
+    user = get_user_model().objects.create_user(username="meteo", password="x", organization=organization)
+    own = FieldFactory(organization=organization, geometry=_geojson_point(37.39, -5.99))
+    other = FieldFactory(organization=OrganizationFactory(name="Otra"), geometry=_geojson_point(37.88, -4.77))
+    client.force_login(user)
+
+    response = client.get(reverse("api-fields-weather"), {"ids": f"{own.pk},{other.pk}"})
+
+    data = response.json()
+    assert response.status_code == 200
+    assert list(data["fields"]) == [str(own.pk)]
+    assert list(data["municipalities"]) == ["41091"]
+    assert aemet.call_count == 2
+
+
+# ── Formato compacto ───────────────────────────────────────────────────
+def test_compact_payload_drops_debug_and_duplicated_hours(aemet):
+    full = weather_service.get_weather_for_field(_point(37.39, -5.99))
+    compact = weather_service.get_weather_for_field(_point(37.39, -5.99), payload="compact")
+
+    assert "_debug" not in compact and "hourly" not in compact
+    assert compact["daily"] == full["daily"]
+    assert full["hourly"] == full["daily"][0]["hours"]
+    assert len(json.dumps(compact)) < len(json.dumps(full))
+
+
+def test_columns_payload_encodes_hours_as_parallel_arrays(aemet):
+    full = weather_service.get_weather_for_field(_point(37.39, -5.99))
+    columns = weather_service.get_weather_for_field(_point(37.39, -5.99), payload="columns")
+
+    for day, col_day in zip(full["daily"], columns["daily"]):
+        hours = col_day["hours"]
+        rows = [dict(zip(hours, values)) for values in zip(*hours.values())]
+        assert rows == [{k: h[k] for k in weather_service.HOUR_COLUMNS} for h in day["hours"]]
+    cached = weather_service.get_forecast_for_municipio(MUNICIPIOS[0])
+    assert "_debug" in cached and isinstance(cached["daily"][0]["hours"], list)  # la caché no se modifica
+
+
+@pytest.mark.django_db
+def test_batch_weather_endpoint_accepts_compact_payload(client, aemet):
+    organization = OrganizationFactory(name="Org Compacta")
+    user = get_user_model().objects.create_user(username="compacto", password="x", organization=organization)
+    field = FieldFactory(organization=organization, geometry=_geojson_point(37.39, -5.99))
+    client.force_login(user)
+
+    data = client.get(reverse("api-fields-weather"), {"ids": field.pk, "payload": "compact"}).json()
+
+    assert set(data["municipalities"]["41091"]) == {"timezone", "source", "municipality", "daily"}
+
+
+# ── Circuit breaker y timeouts adaptativos ─────────────────────────────
+@pytest.fixture
+def failing_pool():
+    pool = MagicMock()
+    pool.request.side_effect = urllib3.exceptions.ReadTimeoutError(None, "/", "timed out")
+    with patch.object(weather_service, "_get_pool", return_value=pool):
+        yield pool
+
+
+def test_repeated_network_failures_open_the_breaker(failing_pool):
+    for _ in range(weather_service._BREAKER_THRESHOLD):
+        assert aemet_fetch("/api/prediccion/especifica/municipio/horaria/41091") is None
+
+    assert weather_service.is_aemet_unavailable()
+    calls = failing_pool.request.call_count
+    assert aemet_fetch("/api/prediccion/especifica/municipio/horaria/41091") is None
+    assert failing_pool.request.call_count == calls  # ya no se llama a AEMET
+
+
+def test_rejected_api_key_opens_the_breaker():
+    pool = MagicMock()
+    pool.request.return_value = MagicMock(status=401)
+    with patch.object(weather_service, "_get_pool", return_value=pool):
+        for _ in range(weather_service._BREAKER_THRESHOLD):
+            assert aemet_fetch("/api/prediccion/especifica/municipio/horaria/41091") is None
+
+    assert weather_service.is_aemet_unavailable()
+
+
+def test_success_resets_failure_count(failing_pool):
+    for _ in range(weather_service._BREAKER_THRESHOLD - 1):
+        weather_service._http_get("https://example.invalid/x")
+    failing_pool.request.side_effect = None
+    failing_pool.request.return_value = MagicMock(status=200, data=b"{}", headers={})
+    weather_service._http_get("https://example.invalid/x")
+    failing_pool.request.side_effect = urllib3.exceptions.ReadTimeoutError(None, "/", "timed out")
+    weather_service._http_get("https://example.invalid/x")
+
+    assert not weather_service.is_aemet_unavailable()
+
+
+def test_open_breaker_serves_stale_entry_without_refreshing(aemet):
+    weather_service.get_forecast_for_municipio(MUNICIPIOS[0])
+    key = weather_service._forecast_cache_key("41091")
+    entry = cache.get(key)
+    cache.set(key, {**entry, "fetched_at": entry["fetched_at"] - weather_service._FORECAST_FRESH_TTL - 1})
+    weather_service.mark_aemet_unavailable()
+    aemet.reset_mock()
+
+    with patch.object(weather_service, "_refresh_in_background") as refresh:
+        assert weather_service.get_forecast_for_municipio(MUNICIPIOS[0]) == entry["data"]
+    refresh.assert_not_called()
+    assert weather_service.get_forecast_for_municipio(MUNICIPIOS[1]) is None
+    assert aemet.call_count == 0
+
+
+def test_adaptive_timeout_follows_observed_latency():
+    assert weather_service._adaptive_timeout() == weather_service._HTTP_TIMEOUT
+    for _ in range(20):
+        weather_service._observe_latency(0.1)
+    assert weather_service._adaptive_timeout() == weather_service._HTTP_TIMEOUT_MIN
+    for _ in range(20):
+        weather_service._observe_latency(1.5)
+    assert weather_service._HTTP_TIMEOUT_MIN < weather_service._adaptive_timeout() < weather_service._HTTP_TIMEOUT
+
+
+def test_catalog_download_uses_its_own_timeout():
+    for _ in range(20):
+        weather_service._observe_latency(0.1)  # AEMET rápido: timeout adaptativo al mínimo
+    pool = MagicMock()
+    pool.request.side_effect = [
+        MagicMock(status=200, data=json.dumps({"estado": 200, "datos": "https://example.invalid/d"}).encode(),
+                  headers={}),
+        MagicMock(status=200, data=b"[]", headers={}),
+    ]
+    with patch.object(weather_service, "_get_pool", return_value=pool), \
+            patch.object(weather_service, "_aemet_fetch", aemet_fetch), \
+            patch.object(time, "monotonic", side_effect=[0, 30, 30, 60]):
+        weather_service.download_municipios()
+
+    timeouts = [call.kwargs["timeout"] for call in pool.request.call_args_list]
+    assert [t.total for t in timeouts] == [weather_service._CATALOG_TIMEOUT] * 2
+    assert weather_service._adaptive_timeout() == weather_service._HTTP_TIMEOUT_MIN  # 30 s no cuentan
+
+
+def test_timeouts_count_as_slow_responses(failing_pool):
+    weather_service._observe_latency(0.6)
+    before = weather_service._adaptive_timeout()
+    weather_service._http_get("https://example.invalid/x")
+
+    assert weather_service._adaptive_timeout() > before
+
+
+@pytest.mark.django_db
+def test_repeated_outages_trip_weather_flag(settings):
+    settings.AEMET_AUTO_DISABLE_WEATHER = True
+    flag = FeatureFlag.objects.create(name="WEATHER", enabled=True)
+    for _ in range(weather_service._FLAG_TRIP_AFTER):
+        weather_service.mark_aemet_unavailable()
+
+    assert not is_enabled("WEATHER")
+    flag.save()  # reactivarlo desde el admin anula la desactivación automática
+    assert is_enabled("WEATHER")
+
+
+@pytest.mark.django_db
+def test_tripped_flag_is_folded_into_the_cached_flags():
+    FeatureFlag.objects.create(name="WEATHER", enabled=True)
+    assert is_enabled("WEATHER")  # llena la caché de flags
+    trip_flag("WEATHER", 60)
+
+    with patch.object(cache, "get_many", wraps=cache.get_many) as get_many:
+        assert not is_enabled("WEATHER")
+        assert not is_enabled("WEATHER")
+
+    assert get_many.call_count == 1  # solo al reconstruir la caché tras el trip
+
+
+@pytest.mark.django_db
+def test_weather_endpoints_follow_the_weather_flag(client, aemet):
+    organization = OrganizationFactory(name="Org Sin Tiempo")
+    user = get_user_model().objects.create_user(username="sintiempo", password="x", organization=organization)
+    field = FieldFactory(organization=organization, geometry=_geojson_point(37.39, -5.99))
+    client.force_login(user)
+    urls = [reverse("api-fields-weather"), reverse("api-fields-treatment-windows"),
+            reverse("api-field-weather", args=[field.pk])]
+    trip_flag("WEATHER", 60)
+
+    assert [client.get(url).status_code for url in urls] == [503, 503, 503]
+    assert aemet.call_count == 0
+
+    reset_flag_trip("WEATHER")
+    assert [client.get(url).status_code for url in urls] == [200, 200, 200]
+
+
+@pytest.mark.django_db
+def test_batch_weather_endpoint_fails_fast_while_aemet_is_down(client, aemet):
+    organization = OrganizationFactory(name="Org Caída")
+    user = get_user_model().objects.create_user(username="caida", password="x", organization=organization)
+    field = FieldFactory(organization=organization, geometry=_geojson_point(37.39, -5.99))
+    client.force_login(user)
+    weather_service.mark_aemet_unavailable()
+
+    response = client.get(reverse("api-fields-weather"), {"ids": field.pk})
+
+    assert response.status_code == 503
+    assert "AEMET no responde" in response.json()["errors"][str(field.pk)]
+    assert aemet.call_count == 0
+
+
+# ── Precalentado ───────────────────────────────────────────────────────
+def test_prewarm_downloads_each_municipality_once(aemet):
+    fields = [_point(37.39, -5.99), _point(37.37, -5.97), _point(37.88, -4.77), SimpleNamespace(pk=4, geometry="")]
+
+    result = weather_service.prewarm_forecasts(fields, concurrency=2)
+
+    assert aemet.call_count == 4  # 2 municipios × (horaria + diaria)
+    assert (result.fields, result.municipalities, result.refreshed) == (4, 2, 2)
+    assert len(result.timings) == 2
+    assert cache.get(weather_service._forecast_cache_key("41091")) is not None
+
+
+def test_prewarm_skips_fresh_entries_unless_forced(aemet):
+    weather_service.prewarm_forecasts([_point(37.39, -5.99)])
+    aemet.reset_mock()
+
+    skipped = weather_service.prewarm_forecasts([_point(37.39, -5.99)])
+    forced = weather_service.prewarm_forecasts([_point(37.39, -5.99)], max_age=0)
+
+    assert skipped.skipped_fresh == 1 and skipped.refreshed == 0
+    assert forced.refreshed == 1
+    assert aemet.call_count == 2
+
+
+def test_prewarm_skips_municipality_already_being_refreshed(aemet):
+    cache.add(weather_service._forecast_lock_key("41091"), 1)
+
+    result = weather_service.prewarm_forecasts([_point(37.39, -5.99)])
+
+    assert result.skipped_locked == 1
+    assert aemet.call_count == 0
+
+
+@pytest.mark.django_db
+def test_prewarm_weather_command_covers_all_organizations(aemet, capsys):
+    FieldFactory(organization=OrganizationFactory(name="Org A"), geometry=_geojson_point(37.39, -5.99))
+    FieldFactory(organization=OrganizationFactory(name="Org B"), geometry=_geojson_point(37.37, -5.97))
+    FieldFactory(organization=OrganizationFactory(name="Org C"), geometry="")
+
+    call_command("prewarm_weather")
+
+    out = capsys.readouterr().out
+    assert "2 parcelas · 1 municipios · 1 refrescados" in out
+    assert aemet.call_count == 2
+
+
+# ── Ventanas de tratamiento ────────────────────────────────────────────
+def test_treatment_windows_are_precomputed_on_refresh(aemet):
+    weather_service.refresh_forecast(MUNICIPIOS[0])
+    windows = cache.get(weather_service._windows_cache_key("41091"))
+
+    assert windows and windows[0]["start"].startswith("2025-06-02")
+    with patch("farm.weather_service.best_windows") as compute:
+        assert weather_service.get_treatment_windows_for_municipio(MUNICIPIOS[0]) == windows
+    compute.assert_not_called()
+
+
+@pytest.mark.django_db
+def test_treatment_windows_endpoint_groups_fields(client, aemet):
+    organization = OrganizationFactory(name="Org Ventanas")
+    user = get_user_model().objects.create_user(username="ventanas", password="x", organization=organization)
+    field = FieldFactory(organization=organization, geometry=_geojson_point(37.39, -5.99))
+    client.force_login(user)
+
+    with patch("farm.weather_service.upcoming_windows", side_effect=lambda windows, now: windows):
+        data = client.get(reverse("api-fields-treatment-windows")).json()
+
+    assert data["fields"][str(field.pk)]["municipality_code"] == "41091"
+    assert data["fields"][str(field.pk)]["windows"]
+
+
+# ── Parser horario ─────────────────────────────────────────────────────
+def _random_horaria(rnd):
+    def periods(step):
+        return [f"{h:02d}{(h + step) % 24:02d}" if step > 1 else f"{h:02d}" for h in range(rnd.randint(0, 6), 24, step)]
+
+    dias = []
+    for d in range(3):
+        dia = {"fecha": f"2025-06-0{d + 2}T00:00:00"}
+        if rnd.random() < 0.8:
+            dia["temperatura"] = [{"hora": f"{h:02d}", "value": str(rnd.randint(5, 35))}
+                                  for h in sorted(rnd.sample(range(24), rnd.randint(1, 12)))]
+        dia["humedadRelativa"] = [{"hora": f"{h:02d}", "value": rnd.choice(["", "40", "75.5", "x"])}
+                                  for h in sorted(rnd.sample(range(24), rnd.randint(0, 8)))]
+        dia["precipitacion"] = [{"periodo": p, "value": rnd.choice(["0", "Ip", "0.3", "2", None])} for p in periods(1)
+                                if rnd.random() < 0.5]
+        dia["probPrecipitacion"] = [{"periodo": p, "value": rnd.choice(["0", "15", "60", ""])} for p in periods(6)]
+        dia["vientoAndRachaMax"] = [
+            rnd.choice([{"periodo": p, "velocidad": [str(rnd.choice([0, 8, 16, 25]))], "direccion": ["N"]},
+                        {"periodo": p, "value": str(rnd.choice([12, 30]))}])
+            for p in periods(rnd.choice([1, 6])) if rnd.random() < 0.7
+        ]
+        dia["estadoCielo"] = [{"periodo": p, "value": rnd.choice(["11", "12n", "46", ""])}
+                              for p in periods(1) + periods(6) if rnd.random() < 0.4]
+        dias.append(dia)
+    return [{"prediccion": {"dia": dias}}]
+
+
+def test_parse_horaria_matches_reference_implementation():
+    from farm.management.commands.benchmark_horaria import parse_horaria_reference
+
+    recorded = json.loads((DEFAULT_RECORDING_DIR / "horaria_41091.json").read_text(encoding="utf-8"))
+    payloads = [recorded, HORARIA] + [_random_horaria(random.Random(seed)) for seed in range(200)]
+
+    for payload in payloads:
+        assert weather_service._parse_horaria(payload) == parse_horaria_reference(payload)
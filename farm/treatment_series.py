@@ -0,0 +1,150 @@
+"""
+Series de tratamientos: repeticiones periódicas que no se guardan fila a fila.
+
+Una TreatmentSeries guarda la regla ("cada viernes del 1/3 al 30/6") y el
+tratamiento plantilla. Sus fechas se expanden al vuelo (expand_series) como
+copias en memoria de la plantilla, calculadas igual que al clonar
+(services.build_clones), para el calendario y la lista de la compra.
+
+Una fecha solo se convierte en un Treatment real cuando se edita o se finaliza
+(materialize_occurrence). A partir de ahí esa fecha la representa la fila
+(Treatment.series / series_date) y deja de expandirse; si se borra la fila, la
+fecha pasa a excluded_dates para que no reaparezca.
+"""
+from dataclasses import dataclass, field as dataclass_field
+from datetime import date
+
+from django.db import transaction
+
+from farm.models import Treatment, TreatmentProduct, TreatmentSeries
+from farm.services import CloneTarget, build_clones, clone_treatments
+
+MAX_SERIES_DAYS = 366  # duración máxima de una serie (una campaña)
+
+
+@dataclass
+class Occurrence:
+    """Fecha de una serie aún sin materializar: `treatment` y `products` no están guardados."""
+    series: TreatmentSeries
+    date: date
+    treatment: Treatment
+    products: list = dataclass_field(default_factory=list)
+
+    @property
+    def key(self) -> str:
+        return occurrence_key(self.series.pk, self.date)
+
+
+def occurrence_key(series_id: int, day: date) -> str:
+    """Identificador estable de una fecha virtual (p. ej. para el calendario)."""
+    return f"serie-{series_id}-{day.isoformat()}"
+
+
+def parse_occurrence_key(key: str):
+    """(id de serie, fecha) de un occurrence_key; None si `key` no lo es."""
+    prefix, _, rest = str(key).partition('-')
+    series_id, _, day = rest.partition('-')
+    if prefix != 'serie' or not series_id.isdigit():
+        return None
+    try:
+        return int(series_id), date.fromisoformat(day)
+    except ValueError:
+        return None
+
+
+def series_for_user(user):
+    """Series visibles para el usuario, con lo que hace falta para expandirlas sin más consultas."""
+    return (
+        TreatmentSeries.ownership_objects
+        .get_queryset_for_user(user)
+        .select_related('template__field__storage_point', 'template__machine')
+    )
+
+
+def _materialized_dates(series_list) -> dict:
+    """{id de serie: fechas ya materializadas} en una consulta."""
+    taken = {s.pk: set() for s in series_list}
+    rows = Treatment.objects.filter(series__in=series_list).values_list('series_id', 'series_date')
+    for series_id, day in rows:
+        taken[series_id].add(day)
+    return taken
+
+
+def pending_dates(series, start=None, end=None, materialized=()) -> list:
+    """Fechas de la regla sin materializar, sin la de la plantilla ni las excluidas."""
+    skip = set(materialized) | {date.fromisoformat(d) for d in series.excluded_dates}
+    skip.add(series.template.date)
+    return [d for d in series.rule_dates(start, end) if d not in skip]
+
+
+def expand_series(series_list, start=None, end=None, with_products=False) -> list:
+    """
+    Fechas virtuales de `series_list` dentro de [start, end], ordenadas por fecha.
+
+    Dos consultas como mucho (fechas materializadas y, con `with_products`, los
+    productos de todas las plantillas), sea cual sea el número de fechas. Las
+    series deben traer plantilla, parcela y máquina cargadas (series_for_user).
+    """
+    series_list = list(series_list)
+    if not series_list:
+        return []
+    taken = _materialized_dates(series_list)
+
+    source_products = {s.template_id: [] for s in series_list}
+    if with_products:
+        items = (
+            TreatmentProduct.objects
+            .filter(treatment_id__in=source_products)
+            .select_related('product__product_type')
+            .order_by('treatment_id', 'position')
+        )
+        for item in items:
+            source_products[item.treatment_id].append(item)
+
+    occurrences = []
+    for series in series_list:
+        template = series.template
+        days = pending_dates(series, start, end, taken[series.pk])
+        targets = [CloneTarget(template.field, day) for day in days]
+        treatments, products = build_clones(template, source_products[template.pk], targets)
+        per_treatment = len(source_products[template.pk])
+        for i, (day, treatment) in enumerate(zip(days, treatments)):
+            treatment.machine = template.machine
+            occurrences.append(Occurrence(
+                series=series,
+                date=day,
+                treatment=treatment,
+                products=products[i * per_treatment:(i + 1) * per_treatment],
+            ))
+    occurrences.sort(key=lambda o: (o.date, o.series.pk))
+    return occurrences
+
+
+def get_occurrence(series, day, with_products=False):
+    """La fecha `day` de la serie si es una fecha virtual válida; None si no (o ya materializada)."""
+    found = expand_series([series], day, day, with_products=with_products)
+    return found[0] if found else None
+
+
+@transaction.atomic
+def materialize_occurrence(series, day):
+    """
+    Crea (o devuelve, si ya existe) el Treatment que representa la fecha `day`
+    de la serie. Lanza ValueError si `day` no es una fecha de la serie.
+    """
+    series = TreatmentSeries.objects.select_for_update().select_related('template__field').get(pk=series.pk)
+    existing = series.occurrences.filter(series_date=day).first()
+    if existing is not None:
+        return existing
+    if not pending_dates(series, day, day):
+        raise ValueError(f'El {day.strftime("%d/%m/%Y")} no es una fecha de esta serie.')
+    template = series.template
+    return clone_treatments(template, [CloneTarget(template.field, day)], series=series)[0]
+
+
+def skip_occurrence(series, day) -> None:
+    """Quita una fecha de la serie (p. ej. al borrar su tratamiento materializado)."""
+    iso = day.isoformat()
+    if iso not in series.excluded_dates:
+        series.excluded_dates = sorted([*series.excluded_dates, iso])
+        series.save(update_fields=['excluded_dates', 'updated_at'])
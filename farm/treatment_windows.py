@@ -0,0 +1,185 @@
+"""
+Ventanas de aplicación de tratamientos a partir de la previsión horaria AEMET.
+
+Cada hora se puntúa de 0 a 1 frente a las condiciones de pulverización
+(viento, rachas, probabilidad de lluvia, lluvia, temperatura y humedad) y
+las horas seguidas con puntuación suficiente forman una ventana.
+
+El cálculo es por columnas: la previsión se convierte en series paralelas
+(una lista por variable, como el formato `columns` de la API) y cada
+restricción produce su propia serie de puntuaciones, que luego se combinan
+elemento a elemento. Las ventanas se calculan al refrescar la caché de
+previsiones (weather_service.refresh_forecast), así que servirlas no cuesta nada.
+"""
+from dataclasses import dataclass
+from datetime import date
+
+
+@dataclass(frozen=True)
+class SprayConstraints:
+    """Límites de pulverización. Entre el valor ideal y el límite la puntuación baja linealmente."""
+    wind_ideal: float = 10.0  # km/h
+    wind_max: float = 20.0  # mismo límite que `treatment_ok`
+    gust_ideal: float = 20.0
+    gust_max: float = 35.0
+    rain_prob_ideal: int = 10  # %
+    rain_prob_max: int = 20  # mismo límite que `treatment_ok`
+    rain_max: float = 0.1  # mm en la hora
+    temp_min: float = 5.0  # °C
+    temp_ideal_min: float = 10.0
+    temp_ideal_max: float = 25.0
+    temp_max: float = 30.0
+    humidity_min: float = 30.0  # % — por debajo el caldo se evapora
+    humidity_ideal_min: float = 50.0
+    humidity_ideal_max: float = 90.0
+    humidity_max: float = 98.0  # % — por encima el producto escurre
+    min_score: float = 0.5  # puntuación mínima de una hora para entrar en una ventana
+    min_hours: int = 2  # duración mínima de una ventana
+
+
+DEFAULT_CONSTRAINTS = SprayConstraints()
+MAX_WINDOWS = 3
+
+
+def _upper(values: list, ideal: float, limit: float) -> list:
+    """1 hasta `ideal`, 0 desde `limit`, lineal entre ambos. Sin dato → 1 (no penaliza)."""
+    span = limit - ideal
+    return [
+        1.0 if v is None or v <= ideal else 0.0 if v >= limit else (limit - v) / span
+        for v in values
+    ]
+
+
+def _lower(values: list, limit: float, ideal: float) -> list:
+    """0 hasta `limit`, 1 desde `ideal`, lineal entre ambos. Sin dato → 1."""
+    span = ideal - limit
+    return [
+        1.0 if v is None or v >= ideal else 0.0 if v <= limit else (v - limit) / span
+        for v in values
+    ]
+
+
+def hourly_columns(hours: list) -> dict:
+    """Lista de horas (formato de weather_service) → series paralelas por variable."""
+    return {
+        "datetime": [h["datetime"] for h in hours],
+        "wind_speed": [h.get("wind_speed") for h in hours],
+        "wind_gusts": [h.get("wind_gusts") for h in hours],
+        "precipitation_probability": [h.get("precipitation_probability") for h in hours],
+        "precipitation": [h.get("precipitation") for h in hours],
+        "temperature": [h.get("temperature") for h in hours],
+        "humidity": [h.get("humidity") for h in hours],
+    }
+
+
+def score_hours(columns: dict, constraints: SprayConstraints = DEFAULT_CONSTRAINTS) -> list:
+    """Puntuación 0–1 de cada hora: producto de la puntuación de cada restricción."""
+    c = constraints
+    series = (
+        _upper(columns["wind_speed"], c.wind_ideal, c.wind_max),
+        _upper(columns["wind_gusts"], c.gust_ideal, c.gust_max),
+        _upper(columns["precipitation_probability"], c.rain_prob_ideal, c.rain_prob_max),
+        [0.0 if v is not None and v > c.rain_max else 1.0 for v in columns["precipitation"]],
+        _lower(columns["temperature"], c.temp_min, c.temp_ideal_min),
+        _upper(columns["temperature"], c.temp_ideal_max, c.temp_max),
+        _lower(columns["humidity"], c.humidity_min, c.humidity_ideal_min),
+        _upper(columns["humidity"], c.humidity_ideal_max, c.humidity_max),
+    )
+    scores = []
+    for parts in zip(*series):
+        total = 1.0
+        for part in parts:
+            total *= part
+        scores.append(round(total, 3))
+    return scores
+
+
+def _hour_index(dt: str) -> int:
+    """'YYYY-MM-DDTHH:MM' → horas desde una época fija (para detectar huecos)."""
+    return date.fromisoformat(dt[:10]).toordinal() * 24 + int(dt[11:13])
+
+
+def _hour_label(index: int) -> str:
+    return f"{date.fromordinal(index // 24).isoformat()}T{index % 24:02d}:00"
+
+
+def find_windows(columns: dict, scores: list, constraints: SprayConstraints = DEFAULT_CONSTRAINTS,
+                 limit: int = MAX_WINDOWS) -> list:
+    """
+    Tramos de horas consecutivas con puntuación >= min_score y al menos
+    min_hours de duración, de mejor a peor (puntuación media, luego duración).
+    """
+    index = [_hour_index(dt) for dt in columns["datetime"]]
+    runs = []
+    start = None
+    for i, score in enumerate(scores):
+        ok = score >= constraints.min_score
+        if start is not None and (not ok or index[i] != index[i - 1] + 1):
+            runs.append((start, i))
+            start = None
+        if ok and start is None:
+            start = i
+    if start is not None:
+        runs.append((start, len(scores)))
+
+    windows = [_window(index, scores, a, b) for a, b in runs if b - a >= constraints.min_hours]
+    windows.sort(key=_rank)
+    return windows[:limit]
+
+
+def _rank(window: dict) -> tuple:
+    """De mejor a peor: puntuación media, luego duración, luego la más temprana."""
+    return -window["score"], -window["hours"], window["start"]
+
+
+def _window(index: list, scores: list, start: int, end: int) -> dict:
+    return {
+        "start": _hour_label(index[start]),
+        "end": _hour_label(index[end - 1] + 1),  # fin exclusivo
+        **_score_summary(scores[start:end]),
+    }
+
+
+def _score_summary(scores: list) -> dict:
+    """Duración y puntuaciones de una ventana a partir de las de sus horas."""
+    return {
+        "hours": len(scores),
+        "score": round(sum(scores) / len(scores), 3),
+        "min_score": min(scores),
+        "scores": scores,  # por hora, para recalcular al recortar (upcoming_windows)
+    }
+
+
+def best_windows(hours: list, constraints: SprayConstraints = DEFAULT_CONSTRAINTS,
+                 limit: int = MAX_WINDOWS) -> list:
+    """Mejores ventanas de aplicación para una lista de horas de la previsión."""
+    if not hours:
+        return []
+    columns = hourly_columns(hours)
+    return find_windows(columns, score_hours(columns, constraints), constraints, limit)
+
+
+def upcoming_windows(windows: list, now: str, constraints: SprayConstraints = DEFAULT_CONSTRAINTS) -> list:
+    """
+    Descarta las ventanas ya terminadas y recorta la que está en curso
+    (`now` = 'YYYY-MM-DDTHH:MM'), con la puntuación de las horas que le quedan;
+    si le quedan menos de min_hours se descarta. Devuelve de mejor a peor.
+    """
+    current = _hour_index(now)
+    result = []
+    for window in windows:
+        end = _hour_index(window["end"])
+        if end <= current:
+            continue
+        start = _hour_index(window["start"])
+        if start < current:
+            window = {
+                **window,
+                "start": _hour_label(current),
+                **_score_summary(window["scores"][current - start:]),
+            }
+            if window["hours"] < constraints.min_hours:
+                continue
+        result.append(window)
+    result.sort(key=_rank)
+    return result
@@ -8,7 +8,7 @@ from farm.views.treatment_views import (
     TreatmentListView, TreatmentDetailView, TreatmentFormView,
     FinishTreatmentView, DeleteTreatmentView, CloneTreatmentView,
     TreatmentCalendarView, TreatmentExportView, ShoppingListView,
-    RepeatTreatmentView,
+    RepeatTreatmentView, SeriesOccurrenceEditView, SeriesOccurrenceFinishView, DeleteTreatmentSeriesView,
 )
 from . import api_views
 from .views.chat_views import ChatView
@@ -38,6 +38,12 @@ urlpatterns = [
     path('tratamientos/<int:pk>/eliminar/', DeleteTreatmentView.as_view(), name='treatment-delete'),
     path('tratamientos/<int:pk>/clonar/', CloneTreatmentView.as_view(), name='treatment-clone'),
     path('tratamientos/<int:pk>/repetir/', RepeatTreatmentView.as_view(), name='treatment-repeat'),
+    path('tratamientos/series/<int:pk>/<str:day>/editar/', SeriesOccurrenceEditView.as_view(),
+         name='treatment-series-edit'),
+    path('tratamientos/series/<int:pk>/<str:day>/finalizar', SeriesOccurrenceFinishView.as_view(),
+         name='treatment-series-finish'),
+    path('tratamientos/series/<int:pk>/eliminar/', DeleteTreatmentSeriesView.as_view(),
+         name='treatment-series-delete'),
     path('tratamientos/calendario/', TreatmentCalendarView.as_view(), name='treatment-calendar'),
     path('tratamientos/<int:pk>/operador/', TreatmentExportView.as_view(), name='treatment-instructions'),
     path('tratamientos/lista-compra/', ShoppingListView.as_view(), name='treatment-shopping-list'),
@@ -90,11 +96,16 @@ urlpatterns = [
 
     # API Endpoints
     path('api/fields/', api_views.get_fields, name='api-fields'),
+    path('api/fields/weather/', api_views.get_fields_weather, name='api-fields-weather'),
+    path('api/fields/treatment-windows/', api_views.get_fields_treatment_windows,
+         name='api-fields-treatment-windows'),
     path('api/fields/<int:field_id>/weather/', api_views.get_field_weather, name='api-field-weather'),
     path('api/machines/', api_views.get_machines, name='api-machines'),
     path('api/products/<str:application_type>/', api_views.get_products, name='api-products'),
     path('api/treatments/', api_views.get_calendar_treatments, name='api-calendar-treatments'),
     path('api/treatments/<int:treatment_id>/', api_views.treatment_detail, name='api-treatment-detail'),
+    path('api/treatments/series/<int:series_id>/<str:day>/', api_views.series_occurrence_detail,
+         name='api-series-occurrence'),
     path('api/field-costs-data/', api_views.field_costs_data, name='api-field-costs-data'),
 
     # AI Assistant
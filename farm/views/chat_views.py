@@ -1,11 +1,14 @@
 import json
 import uuid
 
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
 from django.views import View
 
-from farm.ai_service import chat_with_ai
+from farm.ai_service import (
+    chat_with_ai, chat_with_ai_stream, describe_api_error, normalize_ai_response, record_daily_usage,
+)
+from farm.chat_history import clear_session, compact_in_background, load_history
 from farm.mixins import OwnershipRequiredMixin
 from farm.models import ChatMessage
 
@@ -15,12 +18,14 @@ class ChatView(OwnershipRequiredMixin, View):
     Vista del asistente de IA.
 
     GET  /asistente/  → página de chat con historial de la sesión actual
-    POST /asistente/  → endpoint AJAX; recibe {message} y devuelve {response} o {error}
+    POST /asistente/  → endpoint AJAX; recibe {message} y devuelve {response} o {error}.
+                        Con {stream: true} responde en text/event-stream: eventos
+                        `delta` con cada fragmento y un `done` (o `error`) final
     DELETE /asistente/ → borra el historial de la sesión actual
     """
 
     template_name = 'farm/chat.html'
-    MAX_HISTORY = 20  # mensajes que se envían al modelo como contexto
+    MAX_HISTORY = 20  # tope de mensajes literales al modelo; lo normal es menos (ver farm.chat_history)
 
     # OwnershipRequiredMixin no llama a get_object() para esta vista → pasamos el test
     def test_func(self):
@@ -60,8 +65,10 @@ class ChatView(OwnershipRequiredMixin, View):
         try:
             data = json.loads(request.body)
             user_message = data.get('message', '').strip()
+            stream = bool(data.get('stream'))
         except (json.JSONDecodeError, AttributeError):
             user_message = request.POST.get('message', '').strip()
+            stream = request.POST.get('stream') == '1'
 
         if not user_message:
             return JsonResponse({'error': 'El mensaje no puede estar vacío.'}, status=400)
@@ -69,14 +76,8 @@ class ChatView(OwnershipRequiredMixin, View):
         organization = request.user.organization
         session_id = self._get_or_create_session(request)
 
-        # Historial reciente para contexto (antes de guardar el nuevo mensaje)
-        # Django no soporta índices negativos en querysets: ordenamos desc, cortamos y revertimos
-        history = list(
-            ChatMessage.objects.filter(
-                organization=organization,
-                session_id=session_id,
-            ).order_by('-created_at')[:self.MAX_HISTORY]
-        )[::-1]
+        # Resumen de lo antiguo + mensajes recientes (antes de guardar el nuevo mensaje)
+        summary, history = load_history(organization, session_id, self.MAX_HISTORY)
 
         # Guardar mensaje del usuario
         ChatMessage.objects.create(
@@ -86,8 +87,11 @@ class ChatView(OwnershipRequiredMixin, View):
             content=user_message,
         )
 
+        if stream:
+            return self._stream_response(organization, session_id, user_message, history, summary)
+
         # Llamada a la IA
-        response_text, error = chat_with_ai(organization, user_message, history)
+        response_text, error = chat_with_ai(organization, user_message, history, summary)
 
         if error:
             # Devolvemos el error como texto de respuesta del asistente (código 200)
@@ -101,20 +105,61 @@ class ChatView(OwnershipRequiredMixin, View):
             role='assistant',
             content=response_text,
         )
+        record_daily_usage(organization)
+        compact_in_background(organization, session_id)
 
         return JsonResponse({'response': response_text})
 
+    def _stream_response(self, organization, session_id, user_message, history, summary):
+        """
+        Respuesta SSE con los fragmentos según llegan del modelo. Adelanta el
+        primer token, pero quien sirve la petición sigue ocupado hasta el final
+        de la generación: con workers `sync` de gunicorn es el worker entero; por
+        eso entrypoint.sh arranca con `gthread`, donde solo se ocupa un hilo.
+        """
+        chunks, error = chat_with_ai_stream(organization, user_message, history, summary)
+        if error:
+            # Sin haber empezado a generar: misma respuesta JSON que el modo normal
+            return JsonResponse({'error': error})
+
+        def events():
+            parts = []
+            try:
+                for chunk in chunks:
+                    parts.append(chunk)
+                    yield _sse('delta', {'text': chunk})
+            except Exception as exc:
+                yield _sse('error', {'error': describe_api_error(organization, exc)})
+                return
+            # La respuesta se guarda sólo si el modelo ha terminado de generarla
+            response_text = normalize_ai_response(''.join(parts))
+            ChatMessage.objects.create(
+                organization=organization,
+                session_id=session_id,
+                role='assistant',
+                content=response_text,
+            )
+            record_daily_usage(organization)
+            compact_in_background(organization, session_id)
+            yield _sse('done', {'response': response_text})
+
+        response = StreamingHttpResponse(events(), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'  # que nginx no acumule la respuesta
+        return response
+
     # ── DELETE ────────────────────────────────────────────────────────────────
     def delete(self, request, *args, **kwargs):
         """Borra el historial de la sesión actual y genera un nuevo session_id."""
         session_id = request.session.get('chat_session_id')
         organization = request.user.organization
         if session_id and organization:
-            ChatMessage.objects.filter(
-                organization=organization,
-                session_id=session_id,
-            ).delete()
+            clear_session(organization, session_id)
         # Forzar nueva sesión
         request.session['chat_session_id'] = str(uuid.uuid4())
         return JsonResponse({'ok': True})
 
+
+def _sse(event: str, data: dict) -> str:
+    """Evento Server-Sent Events con `data` en JSON (una sola línea)."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
@@ -6,7 +6,7 @@ from django.contrib import messages
 from django.contrib.messages.views import SuccessMessageMixin
 from django.db.models import DateField, ExpressionWrapper
 from django.db.models.functions import Coalesce
-from django.http import JsonResponse
+from django.http import Http404, JsonResponse
 from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse
 from django.utils import timezone
@@ -16,10 +16,13 @@ from django.views.decorators.http import require_POST
 from django.views.generic import ListView, DetailView, TemplateView
 from django.views.generic.edit import UpdateView
 
-from farm.forms import TreatmentForm, TreatmentProductFormSet
+from farm.forms import TreatmentForm, TreatmentProductFormSet, TreatmentSeriesForm
 from farm.mixins import BaseSecureViewMixin
-from farm.models import Field, Product, ProductType, Treatment, TreatmentProduct
-from farm.services import save_treatment_with_products, get_shopping_list, clone_treatment
+from farm.models import Field, Product, ProductType, Treatment, TreatmentProduct, TreatmentSeries
+from farm.services import CloneTarget, clone_treatments, get_shopping_list, save_treatment_with_products
+from farm.treatment_series import (
+    expand_series, materialize_occurrence, parse_occurrence_key, pending_dates, series_for_user, skip_occurrence,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -253,15 +256,19 @@ class TreatmentCalendarView(BaseSecureViewMixin, TemplateView):
 
 @method_decorator(require_POST, name='dispatch')
 class FinishTreatmentView(BaseSecureViewMixin, View):
-    def post(self, request, pk):
-        treatment = get_object_or_404(Treatment, pk=pk)
+    def get_treatment(self, **kwargs):
+        return get_object_or_404(Treatment, pk=kwargs['pk'])
+
+    def post(self, request, **kwargs):
         finish_date = request.POST.get('finish_date')
         real_water_used = request.POST.get('real_water_used')
 
         if not finish_date:
             return JsonResponse({'success': False}, status=400)
 
-        from datetime import date
+        # Después de validar: en una serie, obtener el tratamiento lo materializa
+        treatment = self.get_treatment(**kwargs)
+
         try:
             finish_date_obj = date.fromisoformat(finish_date) if finish_date else None
         except (ValueError, TypeError):
@@ -301,11 +308,53 @@ class FinishTreatmentView(BaseSecureViewMixin, View):
 class DeleteTreatmentView(BaseSecureViewMixin, View):
     def post(self, request, pk):
         treatment = get_object_or_404(Treatment, pk=pk)
+        if treatment.series_id:
+            # Sin esto la fecha volvería a aparecer como fecha virtual de la serie
+            skip_occurrence(treatment.series, treatment.series_date)
         treatment.delete()
         messages.success(request, f'Tratamiento "{treatment.name}" eliminado')
         return redirect('treatment-list')
 
 
+# ── Series (repeticiones sin materializar) ───────────────────────────────────
+
+def _series_occurrence(request, series_pk, day):
+    """Materializa la fecha `day` (ISO) de la serie y devuelve su Treatment (404 si no es válida)."""
+    series = get_object_or_404(TreatmentSeries, pk=series_pk, organization=request.user.organization)
+    try:
+        return materialize_occurrence(series, date.fromisoformat(day))
+    except ValueError:
+        raise Http404('Fecha fuera de la serie')
+
+
+@method_decorator(require_POST, name='dispatch')
+class SeriesOccurrenceEditView(BaseSecureViewMixin, View):
+    """Editar una fecha de la serie: se crea su tratamiento y se abre el formulario."""
+
+    def post(self, request, pk, day):
+        treatment = _series_occurrence(request, pk, day)
+        return redirect('treatment-edit', pk=treatment.pk)
+
+
+class SeriesOccurrenceFinishView(FinishTreatmentView):
+    """Finalizar una fecha de la serie: se crea su tratamiento y se finaliza como cualquier otro."""
+
+    def get_treatment(self, **kwargs):
+        return _series_occurrence(self.request, kwargs['pk'], kwargs['day'])
+
+
+@method_decorator(require_POST, name='dispatch')
+class DeleteTreatmentSeriesView(BaseSecureViewMixin, View):
+    """Borra la regla; las fechas ya materializadas se quedan como tratamientos sueltos."""
+
+    def post(self, request, pk):
+        series = get_object_or_404(TreatmentSeries, pk=pk, organization=request.user.organization)
+        template_id = series.template_id
+        series.delete()
+        messages.success(request, 'Repetición eliminada. Los tratamientos ya creados se mantienen.')
+        return redirect('treatment-detail', pk=template_id)
+
+
 class CloneTreatmentView(BaseSecureViewMixin, View):
     template_name = 'farm/treatments/treatment_clone.html'
 
@@ -334,9 +383,17 @@ class CloneTreatmentView(BaseSecureViewMixin, View):
             messages.error(request, 'Debes seleccionar al menos una parcela de destino.')
             return redirect('treatment-clone', pk=pk)
 
-        cloned = []
+        # Todas las parcelas de destino en una consulta
+        fields = {
+            str(f.pk): f for f in Field.objects.filter(
+                pk__in=[fid for fid in field_ids if fid.isdigit()],
+                organization=request.user.organization,
+            )
+        }
+        targets = []
         for field_id in field_ids:
-            target_field = get_object_or_404(Field, pk=field_id, organization=request.user.organization)
+            if field_id not in fields:
+                raise Http404('Parcela no encontrada')
             new_name = request.POST.get(f'name_{field_id}', '').strip() or None
             per_field_date = request.POST.get(f'date_{field_id}', '').strip()
             try:
@@ -345,7 +402,13 @@ class CloneTreatmentView(BaseSecureViewMixin, View):
                 )
             except ValueError:
                 new_date = None
-            cloned.append(clone_treatment(treatment, target_field, new_date, new_name))
+            targets.append(CloneTarget(fields[field_id], new_date, new_name))
+
+        try:
+            cloned = clone_treatments(treatment, targets)
+        except ValueError as exc:
+            messages.error(request, str(exc))
+            return redirect('treatment-clone', pk=pk)
 
         if len(cloned) == 1:
             messages.success(request, f'Tratamiento clonado en {cloned[0].field.name}.')
@@ -359,29 +422,44 @@ class CloneTreatmentView(BaseSecureViewMixin, View):
 class RepeatTreatmentView(BaseSecureViewMixin, View):
     """
     Genera copias de un tratamiento en la misma parcela para un conjunto de fechas.
-    Permite seleccionar fechas individualmente o mediante un patrón recurrente
-    (ej: todos los viernes entre dos fechas).
+    Permite seleccionar fechas individualmente o guardar un patrón recurrente
+    (ej: todos los viernes entre dos fechas) como TreatmentSeries, que no crea
+    ninguna fila hasta que se edita o finaliza una de sus fechas.
     """
     template_name = 'farm/treatments/treatment_repeat.html'
 
     def get_treatment(self, pk):
         return get_object_or_404(Treatment, pk=pk, organization=self.request.user.organization)
 
+    def render_page(self, treatment, series_form=None):
+        if series_form is None:
+            series_form = TreatmentSeriesForm(initial={
+                'weekday': treatment.date.weekday(),
+                'interval_weeks': 1,
+                'start_date': treatment.date.isoformat(),
+            })
+        return render(self.request, self.template_name, {
+            'treatment': treatment,
+            'series_form': series_form,
+            'series_rules': treatment.series_rules.all(),
+        })
+
     def get(self, request, pk):
-        treatment = self.get_treatment(pk)
-        return render(request, self.template_name, {'treatment': treatment})
+        return self.render_page(self.get_treatment(pk))
 
     def post(self, request, pk):
         treatment = self.get_treatment(pk)
+        if request.POST.get('mode') == 'series':
+            return self.create_series(treatment)
 
         # La lista de fechas llega como valores múltiples de 'dates'
         raw_dates = request.POST.getlist('dates')
 
         if not raw_dates:
             messages.error(request, 'Debes seleccionar al menos una fecha.')
-            return render(request, self.template_name, {'treatment': treatment})
+            return self.render_page(treatment)
 
-        created = []
+        targets = []
         errors = []
         for raw in raw_dates:
             raw = raw.strip()
@@ -392,14 +470,20 @@ class RepeatTreatmentView(BaseSecureViewMixin, View):
             except ValueError:
                 errors.append(raw)
                 continue
-            created.append(treatment.clone_to_field(treatment.field, new_date=new_date))
+            targets.append(CloneTarget(treatment.field, new_date))
+
+        try:
+            created = clone_treatments(treatment, targets)
+        except ValueError as exc:
+            messages.error(request, str(exc))
+            return self.render_page(treatment)
 
         if errors:
             messages.warning(request, f'Algunas fechas no eran válidas y se ignoraron: {", ".join(errors)}')
 
         if not created:
             messages.error(request, 'No se pudo crear ningún tratamiento. Revisa las fechas.')
-            return render(request, self.template_name, {'treatment': treatment})
+            return self.render_page(treatment)
 
         if len(created) == 1:
             messages.success(request, f'Tratamiento repetido el {created[0].date.strftime("%d/%m/%Y")}.')
@@ -411,6 +495,15 @@ class RepeatTreatmentView(BaseSecureViewMixin, View):
         )
         return redirect('treatment-list')
 
+    def create_series(self, treatment):
+        form = TreatmentSeriesForm(self.request.POST, instance=TreatmentSeries(template=treatment))
+        if not form.is_valid():
+            return self.render_page(treatment, series_form=form)
+        series = form.save()
+        count = len(pending_dates(series))
+        messages.success(self.request, f'{series.describe()}: {count} fechas programadas.')
+        return redirect('treatment-detail', pk=treatment.pk)
+
 
 class TreatmentExportView(BaseSecureViewMixin, DetailView):
     model = Treatment
@@ -430,7 +523,8 @@ class ShoppingListView(BaseSecureViewMixin, ListView):
     context_object_name = 'product_items'
 
     def _selected_treatments(self):
-        return [tid for tid in self.request.GET.getlist('treatment') if tid.isdigit()]
+        # IDs de tratamientos guardados y claves de fechas de series sin materializar
+        return [tid for tid in self.request.GET.getlist('treatment') if tid.isdigit() or parse_occurrence_key(tid)]
 
     def _selected_fields(self):
         return [fid for fid in self.request.GET.getlist('field') if fid.isdigit()]
@@ -454,6 +548,8 @@ class ShoppingListView(BaseSecureViewMixin, ListView):
             .select_related('field')
             .order_by('date')
         )
+        context['available_occurrences'] = expand_series(series_for_user(self.request.user))
+        context['available_count'] = len(context['available_treatments']) + len(context['available_occurrences'])
         total_price = sum(item['total_price'] for item in self.object_list)
         context['total_price'] = round(total_price, 2)
         context['total_count'] = len(self.object_list)
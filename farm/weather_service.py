@@ -2,29 +2,67 @@
 Servicio meteorológico usando AEMET OpenData (https://opendata.aemet.es/).
 Requiere API key configurada en AEMET_API_KEY (settings).
 Flujo:
-  1. Calcula el centroide de la parcela (lat/lon).
-  2. Descarga el catálogo de municipios de AEMET y lo cachea en memoria.
-  3. Encuentra el municipio más cercano a las coordenadas.
-  4. Obtiene predicción horaria (48 h) y diaria (7 días) para ese municipio.
+  1. Lee el centroide de la parcela (lat/lon), guardado en Field al salvarla.
+  2. Carga el catálogo de municipios de AEMET (guardado en BD) y lo cachea en memoria.
+  3. Encuentra el municipio más cercano a las coordenadas (índice en rejilla).
+  4. Obtiene en paralelo la predicción horaria (48 h) y diaria (7 días) del municipio.
   5. Construye un dict unificado con datos diarios y horarios.
+
+La previsión ya construida se guarda en la caché de Django por código de
+municipio (ver get_forecast_for_municipio), de modo que varias parcelas del
+mismo municipio —y varios workers si la caché es compartida— reutilizan una
+única descarga por ventana de refresco.
 """
+import functools
 import json
 import logging
+import math
 import re
 import ssl
+import threading
 import time
-import urllib.error
 import urllib.parse
-import urllib.request
-from datetime import date
+from concurrent.futures import ThreadPoolExecutor, wait
+from dataclasses import dataclass, field as dc_field
+from datetime import date, datetime
+from zoneinfo import ZoneInfo
+
+import urllib3
 from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, connections, transaction
+
+from farm.geo import centroid, parse_geometry
+from farm.treatment_windows import MAX_WINDOWS, best_windows, upcoming_windows
 
 logger = logging.getLogger(__name__)
 AEMET_BASE = "https://opendata.aemet.es/opendata"
-# Caché en memoria del catálogo de municipios
+# Caché en memoria del catálogo de municipios (copia de la tabla AemetMunicipality)
 _municipios_cache: list | None = None
+_municipios_index: "MunicipioIndex | None" = None
 _municipios_ts: float = 0
-_MUNICIPIOS_TTL = 86400 * 7  # refresca cada semana
+_MUNICIPIOS_TTL = 86400  # se relee de BD una vez al día
+# ── Caché de previsiones por municipio (stale-while-revalidate) ──────
+# AEMET regenera las predicciones municipales varias veces al día: durante
+# _FORECAST_FRESH_TTL la entrada se sirve tal cual; después, y hasta
+# _FORECAST_STALE_TTL, se sirve la copia antigua mientras un hilo la refresca.
+_FORECAST_CACHE_PREFIX = "aemet_forecast"
+_FORECAST_FRESH_TTL = 60 * 60 * 2  # 2 h
+_FORECAST_STALE_TTL = 60 * 60 * 24  # margen en el que aún se sirve la copia antigua
+_FORECAST_LOCK_TTL = 60  # máximo que puede tardar una descarga completa
+_FORECAST_LOCK_WAIT = 15  # segundos que espera un worker sin datos al que descarga
+# Plazo total para descargar horaria + diaria (ambas en paralelo, dos saltos cada una)
+_FORECAST_DEADLINE = 20
+_HTTP_TIMEOUT = 10  # máximo por salto HTTP
+_HTTP_TIMEOUT_MIN = 2  # mínimo por salto aunque AEMET responda muy rápido
+_LATENCY_FACTOR = 4  # timeout adaptativo = latencia media observada × factor
+# Timeout fijo por salto del catálogo de municipios (~8k entradas): el adaptativo
+# se ajusta a respuestas pequeñas y cortaría la lectura del cuerpo
+_CATALOG_TIMEOUT = 60
+# Municipios que se descargan a la vez en una petición por lotes
+_BATCH_CONCURRENCY = 4
+# Pool compartido por el proceso para lanzar las descargas en paralelo
+_fetch_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="aemet-fetch")
 # ── Iconos/labels por código AEMET estadoCielo ────────────────────────
 _AEMET_SKY_ICONS = {
     "11": ("fa-sun", "Despejado"),
@@ -84,47 +122,209 @@ def _sky_info(code: str) -> dict:
     return {"icon": icon, "label": label, "adverse": adverse}
 
 
+# ── Circuit breaker AEMET ─────────────────────────────────────────────
+# Mismo esquema que el breaker de cuota de Gemini (ai_service): una clave en la
+# caché de Django, compartida por todos los workers si la caché lo es. Tras
+# _BREAKER_THRESHOLD fallos de red seguidos se deja de llamar a AEMET durante
+# _BREAKER_COOLDOWN segundos: se sirve la copia en caché aunque esté caducada
+# o, si no la hay, la API responde 503 al momento.
+_BREAKER_OPEN_KEY = "aemet_unavailable"
+_BREAKER_FAILURES_KEY = "aemet_failures"
+_BREAKER_TRIPS_KEY = "aemet_breaker_trips"
+_BREAKER_THRESHOLD = 5
+_BREAKER_WINDOW = 120  # segundos en los que se acumulan los fallos
+_BREAKER_COOLDOWN = 300
+_BREAKER_STATUSES = frozenset({401, 403, 429})  # clave rechazada o sin cuota: reintentar no sirve
+# Si el breaker salta _FLAG_TRIP_AFTER veces en _FLAG_TRIP_WINDOW segundos, la caída
+# no es puntual: se desactiva el flag WEATHER durante _FLAG_TRIP_TTL segundos
+# (desactivable con AEMET_AUTO_DISABLE_WEATHER = False).
+_FLAG_TRIP_AFTER = 3
+_FLAG_TRIP_WINDOW = 60 * 60
+_FLAG_TRIP_TTL = 60 * 60
+
+
+def _incr(key: str, ttl: int) -> int:
+    cache.add(key, 0, timeout=ttl)
+    try:
+        return cache.incr(key)
+    except ValueError:  # la clave expiró entre add e incr
+        cache.set(key, 1, timeout=ttl)
+        return 1
+
+
+def is_aemet_unavailable() -> bool:
+    return bool(cache.get(_BREAKER_OPEN_KEY, False))
+
+
+def mark_aemet_unavailable(cooldown: int = _BREAKER_COOLDOWN) -> None:
+    """Abre el circuit breaker durante `cooldown` segundos."""
+    cache.set(_BREAKER_OPEN_KEY, True, timeout=cooldown)
+    cache.delete(_BREAKER_FAILURES_KEY)
+    logger.warning("AEMET no responde — circuit breaker activado por %ds", cooldown)
+    trips = _incr(_BREAKER_TRIPS_KEY, _FLAG_TRIP_WINDOW)
+    if trips >= _FLAG_TRIP_AFTER and getattr(settings, "AEMET_AUTO_DISABLE_WEATHER", True):
+        from core.models import trip_flag
+
+        trip_flag("WEATHER", _FLAG_TRIP_TTL)
+        cache.delete(_BREAKER_TRIPS_KEY)
+        logger.error("AEMET: %d caídas en %ds — módulo WEATHER desactivado %ds", trips, _FLAG_TRIP_WINDOW, _FLAG_TRIP_TTL)
+
+
+def _record_failure() -> None:
+    if _incr(_BREAKER_FAILURES_KEY, _BREAKER_WINDOW) >= _BREAKER_THRESHOLD:
+        mark_aemet_unavailable()
+
+
+def _record_success() -> None:
+    # Solo se escribe si había fallos acumulados (con caché en BD, un DELETE por petición)
+    if cache.get(_BREAKER_FAILURES_KEY):
+        cache.delete(_BREAKER_FAILURES_KEY)
+
+
+# ── Timeouts adaptativos ──────────────────────────────────────────────
+# Media móvil exponencial de la latencia por salto, por proceso. Los timeouts
+# también cuentan como observación, así que si AEMET se ralentiza el timeout
+# crece (hasta _HTTP_TIMEOUT) en vez de fallar una y otra vez.
+_latency_lock = threading.Lock()
+_latency_avg: float | None = None
+
+
+def _observe_latency(seconds: float) -> None:
+    global _latency_avg
+    with _latency_lock:
+        _latency_avg = seconds if _latency_avg is None else 0.8 * _latency_avg + 0.2 * seconds
+
+
+def _adaptive_timeout() -> float:
+    avg = _latency_avg
+    if avg is None:
+        return _HTTP_TIMEOUT
+    return min(_HTTP_TIMEOUT, max(_HTTP_TIMEOUT_MIN, avg * _LATENCY_FACTOR))
+
+
 # ── HTTP helpers ──────────────────────────────────────────────────────
-def _ssl_contexts():
-    ctxs = []
+# Un pool de conexiones keep-alive por proceso (thread-safe): cada host reutiliza
+# sus conexiones TCP+TLS entre peticiones, y los contextos SSL se crean una vez.
+_http_lock = threading.Lock()
+_http_pools: dict[str, urllib3.PoolManager] = {}
+# Hosts cuyo certificado no valida con el almacén del sistema (a AEMET le
+# ocurre en algunos entornos): tras el primer fallo van directos al pool sin verificar.
+_unverified_hosts: set[str] = set()
+
+
+def _get_pool(verified: bool) -> urllib3.PoolManager:
+    kind = "verified" if verified else "unverified"
+    pool = _http_pools.get(kind)
+    if pool is None:
+        with _http_lock:
+            pool = _http_pools.get(kind)
+            if pool is None:
+                if verified:
+                    pool = urllib3.PoolManager(num_pools=4, maxsize=8, ssl_context=ssl.create_default_context())
+                else:
+                    pool = urllib3.PoolManager(
+                        num_pools=4, maxsize=8, cert_reqs=ssl.CERT_NONE,
+                        ssl_context=ssl._create_unverified_context(),  # noqa: S501
+                    )
+                _http_pools[kind] = pool
+    return pool
+
+
+def _decode_json(response):
+    raw_bytes = response.data
+    # AEMET puede devolver ISO-8859-1 en vez de UTF-8
+    charset = "utf-8"
+    ct = response.headers.get("Content-Type", "")
+    if "charset=" in ct.lower():
+        charset = ct.lower().split("charset=")[-1].strip().split(";")[0].strip()
     try:
-        ctxs.append(ssl.create_default_context())
-    except Exception:
-        pass
-    ctxs.append(ssl._create_unverified_context())  # noqa: S501
-    return ctxs
+        text = raw_bytes.decode(charset)
+    except (UnicodeDecodeError, LookupError):
+        text = raw_bytes.decode("iso-8859-1")
+    return json.loads(text)
 
 
-def _http_get(url: str, timeout: int = 10):
+def _http_get(url: str, timeout: float | None = None, observe: bool = True):
+    """
+    GET de un JSON. Los fallos de red, los 5xx y los _BREAKER_STATUSES (clave
+    inválida o límite de peticiones) cuentan como fallos para el circuit breaker.
+    Con `observe=False` la duración no cuenta para el timeout adaptativo.
+    """
+    if timeout is None:
+        timeout = _adaptive_timeout()
     api_key = getattr(settings, "AEMET_API_KEY", "")
     # Las URLs de datos (/opendata/sh/...) son pre-autorizadas: NO añadir api_key
     is_api_endpoint = "opendata.aemet.es" in url and "/opendata/api/" in url
     if is_api_endpoint and api_key:
         sep = "&" if "?" in url else "?"
         url = f"{url}{sep}api_key={urllib.parse.quote(api_key)}"
-    for ctx in _ssl_contexts():
+    host = urllib.parse.urlsplit(url).netloc
+    verified = host not in _unverified_hosts
+    while True:
+        started = time.monotonic()
         try:
-            req = urllib.request.Request(url, headers={"Accept": "application/json"})
-            with urllib.request.urlopen(req, timeout=timeout, context=ctx) as r:
-                raw_bytes = r.read()
-                # AEMET puede devolver ISO-8859-1 en vez de UTF-8
-                charset = "utf-8"
-                ct = r.headers.get("Content-Type", "")
-                if "charset=" in ct.lower():
-                    charset = ct.lower().split("charset=")[-1].strip().split(";")[0].strip()
-                try:
-                    text = raw_bytes.decode(charset)
-                except (UnicodeDecodeError, LookupError):
-                    text = raw_bytes.decode("iso-8859-1")
-                return json.loads(text)
-        except (urllib.error.URLError, OSError) as exc:
+            r = _get_pool(verified).request(
+                "GET", url,
+                headers={"Accept": "application/json"},
+                timeout=urllib3.Timeout(total=timeout),
+                retries=False,
+            )
+            if r.status >= 500 or r.status in _BREAKER_STATUSES:
+                _record_failure()
+            else:
+                if observe:
+                    _observe_latency(time.monotonic() - started)
+                _record_success()
+            if r.status >= 400:
+                logger.debug("HTTP GET %s (%s)", r.status, url[:80])
+                return None
+            return _decode_json(r)
+        except urllib3.exceptions.SSLError as exc:
+            if not verified:
+                logger.debug("HTTP GET failed (%s): %s", url[:80], exc)
+                return None
+            logger.warning("AEMET: certificado no verificable para %s; se usará conexión sin verificar", host)
+            _unverified_hosts.add(host)
+            verified = False
+        except (urllib3.exceptions.HTTPError, OSError) as exc:
+            if observe and isinstance(exc, urllib3.exceptions.TimeoutError):
+                _observe_latency(timeout)
+            _record_failure()
             logger.debug("HTTP GET failed (%s): %s", url[:80], exc)
-    return None
+            return None
+        except ValueError as exc:
+            logger.debug("HTTP GET failed (%s): %s", url[:80], exc)
+            return None
 
 
-def _aemet_fetch(path: str):
-    """Doble petición AEMET: meta → datos URL → datos reales."""
-    meta = _http_get(f"{AEMET_BASE}{path}")
+def _remaining_timeout(deadline: float | None, fixed: float | None = None) -> float | None:
+    """
+    Timeout de un salto HTTP (`fixed` o el adaptativo) acotado por el plazo
+    restante (None = agotado).
+    """
+    timeout = _adaptive_timeout() if fixed is None else fixed
+    if deadline is None:
+        return timeout
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        return None
+    return min(timeout, remaining)
+
+
+def _aemet_fetch(path: str, deadline: float | None = None, timeout: float | None = None):
+    """
+    Doble petición AEMET: meta → datos URL → datos reales.
+    `deadline` (time.monotonic()) limita el tiempo total de ambos saltos.
+    `timeout` fija el de cada salto en lugar del adaptativo (y no cuenta como latencia).
+    Con el circuit breaker abierto no se llama a AEMET.
+    """
+    fixed, observe = timeout, timeout is None
+    if is_aemet_unavailable():
+        return None
+    timeout = _remaining_timeout(deadline, fixed)
+    if timeout is None:
+        return None
+    meta = _http_get(f"{AEMET_BASE}{path}", timeout=timeout, observe=observe)
     if not meta:
         return None
     if meta.get("estado", 0) != 200:
@@ -133,7 +333,21 @@ def _aemet_fetch(path: str):
     datos_url = meta.get("datos")
     if not datos_url:
         return None
-    return _http_get(datos_url)
+    timeout = _remaining_timeout(deadline, fixed)
+    if is_aemet_unavailable():
+        return None
+    if timeout is None:
+        logger.warning("AEMET: plazo agotado antes de descargar datos de %s", path)
+        return None
+    return _http_get(datos_url, timeout=timeout, observe=observe)
+
+
+def _pooled_fetch(path: str, deadline: float | None = None):
+    """_aemet_fetch para los hilos de _fetch_pool, que viven lo que el proceso."""
+    try:
+        return _aemet_fetch(path, deadline)
+    finally:
+        connections.close_all()  # conexiones abiertas por el circuit breaker (caché en BD)
 
 
 # ── Municipios ────────────────────────────────────────────────────────
@@ -155,15 +369,73 @@ def _parse_coord(raw) -> float | None:
     return None
 
 
-def _get_municipios() -> list:
-    global _municipios_cache, _municipios_ts
-    now = time.time()
-    if _municipios_cache is not None and (now - _municipios_ts) < _MUNICIPIOS_TTL:
-        return _municipios_cache
-    raw = _aemet_fetch("/api/maestro/municipios")
-    if not raw or not isinstance(raw, list):
-        logger.warning("AEMET: no se pudo obtener lista de municipios")
-        return _municipios_cache or []
+class MunicipioIndex:
+    """
+    Índice espacial en rejilla para buscar municipios cercanos sin recorrer todo
+    el catálogo. Cada municipio cae en una celda de `cell_size` grados; una
+    búsqueda recorre anillos de celdas alrededor del punto hasta que ningún
+    anillo pendiente puede contener algo más cercano.
+
+    Usa la misma métrica que el recorrido lineal original (distancia euclídea
+    en grados), así que los resultados coinciden con él.
+    """
+
+    def __init__(self, municipios: list, cell_size: float = 0.25):
+        self.cell_size = cell_size
+        self.municipios = municipios
+        # Cada celda guarda (posición en el catálogo, municipio): la posición
+        # desempata igual que min() sobre la lista original.
+        self._cells: dict[tuple[int, int], list] = {}
+        for pos, m in enumerate(municipios):
+            self._cells.setdefault(self._cell(m["lat"], m["lon"]), []).append((pos, m))
+        if self._cells:
+            rows = [c[0] for c in self._cells]
+            cols = [c[1] for c in self._cells]
+            self._bounds = (min(rows), max(rows), min(cols), max(cols))
+
+    def __len__(self):
+        return len(self.municipios)
+
+    def _cell(self, lat: float, lon: float) -> tuple[int, int]:
+        return math.floor(lat / self.cell_size), math.floor(lon / self.cell_size)
+
+    def _ring(self, ci: int, cj: int, r: int):
+        if r == 0:
+            yield ci, cj
+            return
+        for dj in range(-r, r + 1):
+            yield ci - r, cj + dj
+            yield ci + r, cj + dj
+        for di in range(-r + 1, r):
+            yield ci + di, cj - r
+            yield ci + di, cj + r
+
+    def nearest(self, lat: float, lon: float, k: int = 1) -> list:
+        """Devuelve los `k` municipios más cercanos, del más próximo al más lejano."""
+        if not self._cells or k <= 0:
+            return []
+        k = min(k, len(self.municipios))
+        ci, cj = self._cell(lat, lon)
+        min_i, max_i, min_j, max_j = self._bounds
+        # Anillo a partir del cual ya no quedan celdas ocupadas
+        max_r = max(abs(ci - min_i), abs(ci - max_i), abs(cj - min_j), abs(cj - max_j))
+        found: list[tuple[float, int, dict]] = []
+        for r in range(max_r + 1):
+            for cell in self._ring(ci, cj, r):
+                for pos, m in self._cells.get(cell, ()):
+                    d = (m["lat"] - lat) ** 2 + (m["lon"] - lon) ** 2
+                    found.append((d, pos, m))
+            if len(found) >= k:
+                found.sort(key=lambda t: t[:2])
+                del found[k:]
+                # Cualquier punto de un anillo exterior está al menos a r·cell_size
+                if found[-1][0] < (r * self.cell_size) ** 2:
+                    break
+        found.sort(key=lambda t: t[:2])
+        return [m for _, _, m in found[:k]]
+
+
+def _parse_municipios(raw) -> list:
     parsed = []
     for m in raw:
         mid = m.get("id", "")
@@ -173,6 +445,67 @@ def _get_municipios() -> list:
         if lat is None or lon is None:
             continue
         parsed.append({"cod": cod, "nombre": m.get("nombre", ""), "lat": lat, "lon": lon})
+    return parsed
+
+
+def download_municipios() -> list:
+    """Descarga y parsea el catálogo completo de municipios de AEMET."""
+    raw = _aemet_fetch("/api/maestro/municipios", timeout=_CATALOG_TIMEOUT)
+    if not raw or not isinstance(raw, list):
+        logger.warning("AEMET: no se pudo obtener lista de municipios")
+        return []
+    return _parse_municipios(raw)
+
+
+@transaction.atomic
+def store_municipios(municipios: list) -> int:
+    """Sustituye el catálogo guardado en BD por `municipios` (mismo orden)."""
+    from farm.models import AemetMunicipality
+
+    AemetMunicipality.objects.all().delete()
+    AemetMunicipality.objects.bulk_create(
+        [AemetMunicipality(code=m["cod"], name=m["nombre"][:100], lat=m["lat"], lon=m["lon"]) for m in municipios],
+        batch_size=1000,
+    )
+    return len(municipios)
+
+
+def _load_municipios_from_db() -> list:
+    from farm.models import AemetMunicipality
+
+    rows = AemetMunicipality.objects.order_by("id").values_list("code", "name", "lat", "lon")
+    return [{"cod": cod, "nombre": nombre, "lat": lat, "lon": lon} for cod, nombre, lat, lon in rows]
+
+
+def reset_municipios_cache() -> None:
+    """Olvida la copia en memoria; la próxima búsqueda relee el catálogo de BD."""
+    global _municipios_cache, _municipios_index, _municipios_ts
+    _municipios_cache = None
+    _municipios_index = None
+    _municipios_ts = 0
+
+
+def _get_municipios() -> list:
+    """
+    Catálogo de municipios. Orden de búsqueda: memoria → BD (una sola consulta)
+    → AEMET. Si hay que descargarlo de AEMET se guarda en BD para los demás workers.
+    """
+    global _municipios_cache, _municipios_ts
+    now = time.time()
+    if _municipios_cache is not None and (now - _municipios_ts) < _MUNICIPIOS_TTL:
+        return _municipios_cache
+    try:
+        parsed = _load_municipios_from_db()
+    except DatabaseError:
+        logger.exception("AEMET: no se pudo leer el catálogo de municipios de BD")
+        parsed = []
+    if not parsed:
+        parsed = download_municipios()
+        if parsed:
+            try:
+                store_municipios(parsed)
+            except DatabaseError:
+                logger.exception("AEMET: no se pudo guardar el catálogo de municipios en BD")
     if parsed:
         _municipios_cache = parsed
         _municipios_ts = now
@@ -180,11 +513,23 @@ def _get_municipios() -> list:
     return _municipios_cache or []
 
 
-def _nearest_municipio(lat: float, lon: float) -> dict | None:
+def _get_municipios_index() -> MunicipioIndex:
+    """Índice espacial del catálogo; se reconstruye solo cuando el catálogo cambia."""
+    global _municipios_index
     municipios = _get_municipios()
-    if not municipios:
-        return None
-    return min(municipios, key=lambda m: (m["lat"] - lat) ** 2 + (m["lon"] - lon) ** 2)
+    if _municipios_index is None or _municipios_index.municipios is not municipios:
+        _municipios_index = MunicipioIndex(municipios)
+    return _municipios_index
+
+
+def nearest_municipios(lat: float, lon: float, k: int = 1) -> list:
+    """Los `k` municipios AEMET más cercanos a las coordenadas dadas."""
+    return _get_municipios_index().nearest(lat, lon, k)
+
+
+def _nearest_municipio(lat: float, lon: float) -> dict | None:
+    nearest = nearest_municipios(lat, lon, 1)
+    return nearest[0] if nearest else None
 
 
 # ── Parseo predicción horaria ─────────────────────────────────────────
@@ -236,173 +581,179 @@ def _parse_float_precip(v) -> float | None:
         return None
 
 
-def _interpolate_map(known: dict, h_start: int, h_end: int) -> dict:
-    """Interpola linealmente los valores de temp/hum entre horas conocidas."""
-    result = dict(known)
-    hours = sorted(known.keys())
-    if len(hours) < 2:
-        return result
-    for i in range(len(hours) - 1):
-        h0, h1 = hours[i], hours[i + 1]
-        if h1 <= h0:
-            continue
-        v0, v1 = known[h0], known[h1]
+def _interpolate_slots(slots: list) -> None:
+    """Interpola linealmente (in situ) los huecos de temp/hum entre horas conocidas."""
+    known = [h for h, v in enumerate(slots) if v is not None]
+    for h0, h1 in zip(known, known[1:]):
+        v0, v1 = slots[h0], slots[h1]
         for hh in range(h0 + 1, h1):
             t = (hh - h0) / (h1 - h0)
-            result[hh] = round(v0 + (v1 - v0) * t, 1)
-    return result
+            slots[hh] = round(v0 + (v1 - v0) * t, 1)
+
+
+def _hour_slots(entries, key: str, convert) -> tuple[list, bool]:
+    """
+    Valores instantáneos ({key: hora, value}) en un array de 24 posiciones.
+    Devuelve también si se leyó algún valor (aunque fuera de una hora fuera de rango).
+    """
+    slots = [None] * 24
+    found = False
+    for e in entries:
+        h = e.get(key)
+        v = e.get("value")
+        if h is None or v in (None, ""):
+            continue
+        try:
+            h, v = int(h), convert(v)
+        except (ValueError, TypeError):
+            continue
+        found = True
+        if 0 <= h < 24:
+            slots[h] = v
+    return slots, found
+
+
+@functools.lru_cache(maxsize=512)
+def _periodo_hours(periodo: str) -> range | None:
+    """
+    Horas (0-23) cubiertas por un periodo AEMET, o None si no se entiende.
+    Memoizado: una predicción repite los mismos pocos periodos ('07', '0208'...) cientos de veces.
+    """
+    rng = _periodo_range(periodo)
+    if rng is None:
+        return None
+    h_start, h_end = rng
+    return range(max(h_start, 0), min(max(h_end, h_start + 1), 24))
 
 
 def _parse_horaria(raw_list) -> list:
+    """
+    Predicción horaria → lista de horas. Un solo recorrido por variable de cada
+    día, escribiendo en arrays de 24 posiciones (una por hora) que después se
+    interpolan in situ; las horas se generan en un último recorrido lineal.
+    """
     if not raw_list or not isinstance(raw_list, list):
         return []
     pred_root = raw_list[0]
     dias = pred_root.get("prediccion", {}).get("dia", [])
     hourly_list = []
+    sky_cache: dict[str, dict] = {}
     for dia in dias:
         fecha_str = (dia.get("fecha") or "")[:10]
         if not fecha_str:
             continue
 
-        # ── Temperatura instante (puede venir cada 1 o 2 horas) ──
-        temp_map_raw = {}
-        for t in dia.get("temperatura", []):
-            h = t.get("hora")
-            v = t.get("value")
-            if h is not None and v not in (None, ""):
-                try:
-                    temp_map_raw[int(h)] = float(v)
-                except (ValueError, TypeError):
-                    pass
-        # Interpolar temperatura para todas las horas intermedias
-        temp_map = _interpolate_map(temp_map_raw, 0, 24) if temp_map_raw else {}
-
-        # ── Humedad instante ──
-        hum_map_raw = {}
-        for hm in dia.get("humedadRelativa", []):
-            h = hm.get("hora")
-            v = hm.get("value")
-            if h is not None and v not in (None, ""):
-                try:
-                    hum_map_raw[int(h)] = float(v)
-                except (ValueError, TypeError):
-                    pass
-        hum_map = _interpolate_map(hum_map_raw, 0, 24) if hum_map_raw else {}
+        # ── Temperatura y humedad instante (pueden venir cada 1 o 2 horas) ──
+        temps, has_temp = _hour_slots(dia.get("temperatura", []), "hora", float)
+        hums, _ = _hour_slots(dia.get("humedadRelativa", []), "hora", float)
+        _interpolate_slots(temps)
+        _interpolate_slots(hums)
 
-        # ── Precipitación por periodo — expandir a todas las horas del bloque ──
-        # El valor del periodo se reparte entre las horas (solo se muestra en la
-        # hora de inicio del bloque para no inflar el total).
-        precip_map = {}  # hora → mm (solo hora inicio del bloque)
+        # ── Precipitación por periodo: el total del bloque va a su hora de inicio ──
+        precips = [None] * 24
         for p in dia.get("precipitacion", []):
-            rng = _periodo_range(str(p.get("periodo", "")))
+            hours = _periodo_hours(str(p.get("periodo", "")))
             v = _parse_float_precip(p.get("value"))
-            if rng is not None and v is not None:
-                h_start, h_end = rng
-                # Asignar el total del bloque a la hora de inicio
-                precip_map[h_start] = precip_map.get(h_start, 0.0) + v
+            if hours and v is not None:
+                h_start = hours[0]
+                precips[h_start] = (precips[h_start] or 0.0) + v
 
-        # ── Probabilidad precipitación — expandir bloques a horas ──
-        prob_map = {}
+        # ── Probabilidad de precipitación por bloque ──
+        probs = [0] * 24
         for p in dia.get("probPrecipitacion", []):
-            rng = _periodo_range(str(p.get("periodo", "")))
             v = p.get("value")
-            if rng is None or v in (None, ""):
+            if v in (None, ""):
+                continue
+            hours = _periodo_hours(str(p.get("periodo", "")))
+            if hours is None:
                 continue
             try:
                 val = int(v)
             except (ValueError, TypeError):
                 continue
-            h_start, h_end = rng
-            for hh in range(h_start, max(h_end, h_start + 1)):
-                prob_map[hh] = val
+            for hh in hours:
+                probs[hh] = val
 
-        # ── Viento por periodo — expandir a todas las horas del bloque ──
-        wind_map = {}
-        gust_map = {}
+        # ── Viento y rachas por bloque ──
+        winds = [None] * 24
+        gusts = [None] * 24
         for w in dia.get("vientoAndRachaMax", []):
-            rng = _periodo_range(str(w.get("periodo", "")))
-            if rng is None:
+            hours = _periodo_hours(str(w.get("periodo", "")))
+            if hours is None:
                 continue
-            h_start, h_end = rng
             vels = w.get("velocidad", [])
-            wind_val = None
             if vels:
                 try:
                     wind_val = float(vels[0])
                 except (ValueError, TypeError, IndexError):
                     pass
+                else:
+                    for hh in hours:
+                        winds[hh] = wind_val
             racha = w.get("value")
-            gust_val = None
             if racha is not None:
                 try:
                     gust_val = float(racha)
                 except (ValueError, TypeError):
                     pass
-            for hh in range(h_start, max(h_end, h_start + 1)):
-                if wind_val is not None:
-                    wind_map[hh] = wind_val
-                if gust_val is not None:
-                    gust_map[hh] = gust_val
-
-        # ── Estado cielo por periodo — expandir a todas las horas del bloque ──
-        sky_map = {}
-        for s in dia.get("estadoCielo", []):
-            rng = _periodo_range(str(s.get("periodo", "")))
-            v = s.get("value", "")
-            if rng is not None and v:
-                h_start, h_end = rng
-                for hh in range(h_start, max(h_end, h_start + 1)):
-                    if hh not in sky_map:  # no sobreescribir si ya hay dato más específico
-                        sky_map[hh] = v
+                else:
+                    for hh in hours:
+                        gusts[hh] = gust_val
+
+        # ── Estado del cielo por bloque (el primer dato de cada hora manda) ──
+        skies = [None] * 24
+        for sc in dia.get("estadoCielo", []):
+            v = sc.get("value", "")
+            hours = _periodo_hours(str(sc.get("periodo", ""))) if v else None
+            if hours is None:
+                continue
+            for hh in hours:
+                if skies[hh] is None:
+                    skies[hh] = v
 
         # ── Generar horas 0-23 completas cuando hay datos de temperatura ──
-        if temp_map:
-            all_hours = list(range(24))
-        else:
-            all_hours = sorted(
-                set(list(hum_map) + list(precip_map) + list(wind_map) + list(sky_map))
-            )
+        # (sin temperatura, solo las horas con algún dato de humedad, lluvia, viento o cielo)
+        last_sky = last_wind = None  # última hora con cielo / con viento > 0
+        for hr in range(24):
+            sky_code = skies[hr]
+            if sky_code is not None:
+                last_sky = hr
+            elif last_sky is not None and hr - last_sky <= 6:
+                sky_code = skies[last_sky]  # el más cercano anterior
+            w_kmh = winds[hr] or 0.0
+            if w_kmh > 0:
+                last_wind = hr
+            elif last_wind is not None and hr - last_wind <= 6:
+                w_kmh = winds[last_wind]  # el más cercano anterior
+            if not has_temp and hums[hr] is None and precips[hr] is None \
+                    and winds[hr] is None and skies[hr] is None:
+                continue
 
-        for hr in all_hours:
-            sky_code = sky_map.get(hr, "")
-            # Buscar sky_code en horas cercanas si no hay dato exacto
-            if not sky_code:
-                for delta in range(1, 7):
-                    if hr - delta >= 0 and sky_map.get(hr - delta):
-                        sky_code = sky_map[hr - delta]
-                        break
-            sky = _sky_info(sky_code)
-            p_mm = precip_map.get(hr, 0.0)
-            p_prob = prob_map.get(hr, 0)
-            w_kmh = wind_map.get(hr, 0.0)
-            # Para horas sin viento exacto, usar el más cercano anterior
-            if w_kmh == 0.0 and hr > 0:
-                for delta in range(1, 7):
-                    if wind_map.get(hr - delta, 0.0) > 0:
-                        w_kmh = wind_map[hr - delta]
-                        break
-            g_kmh = gust_map.get(hr, w_kmh)
-            temp = temp_map.get(hr)
-            hum = int(hum_map[hr]) if hr in hum_map else None
-            wind_level = 0 if w_kmh <= 10 else 1 if w_kmh <= 15 else 2 if w_kmh < 20 else 3
-            treatment_ok = p_prob < 20 and w_kmh <= 20.0
+            sky_code = sky_code or ""
+            sky = sky_cache.get(sky_code)
+            if sky is None:
+                sky = sky_cache[sky_code] = _sky_info(sky_code)
+            p_prob = probs[hr]
+            g_kmh = gusts[hr] if gusts[hr] is not None else w_kmh
+            temp = temps[hr]
+            hum = hums[hr]
             hour_str = f"{hr:02d}:00"
             hourly_list.append({
                 "datetime": f"{fecha_str}T{hour_str}",
                 "date": fecha_str,
                 "hour": hour_str,
-                "precipitation": round(p_mm, 1),
+                "precipitation": round(precips[hr] or 0.0, 1),
                 "precipitation_probability": p_prob,
                 "wind_speed": round(w_kmh, 1),
                 "wind_gusts": round(g_kmh, 1),
-                "wind_level": wind_level,
+                "wind_level": 0 if w_kmh <= 10 else 1 if w_kmh <= 15 else 2 if w_kmh < 20 else 3,
                 "temperature": round(temp, 1) if temp is not None else None,
-                "humidity": hum,
+                "humidity": int(hum) if hum is not None else None,
                 "weather_code": sky_code,
                 "icon": sky["icon"],
                 "label": sky["label"],
                 "adverse": sky["adverse"],
-                "treatment_ok": treatment_ok,
+                "treatment_ok": p_prob < 20 and w_kmh <= 20.0,
             })
     return hourly_list
 
@@ -569,57 +920,28 @@ def _fix_snow_icon(entry: dict) -> dict:
 
 # ── Geometría ─────────────────────────────────────────────────────────
 def _get_centroid(geometry_json: str):
-    try:
-        geojson = json.loads(geometry_json)
-    except (json.JSONDecodeError, TypeError):
-        return None
-    geo_type = geojson.get("type")
-    coords = geojson.get("coordinates")
-    if not coords:
-        return None
-    if geo_type == "Point":
-        return coords[1], coords[0]
-    if geo_type == "Polygon":
-        ring = coords[0]
-    elif geo_type == "MultiPolygon":
-        ring = coords[0][0]
-    elif geo_type == "Feature":
-        return _get_centroid(json.dumps(geojson.get("geometry", {})))
-    else:
-        return None
-    if not ring:
+    geometry = parse_geometry(geometry_json)
+    if not geometry:
         return None
-    lons = [p[0] for p in ring]
-    lats = [p[1] for p in ring]
-    return sum(lats) / len(lats), sum(lons) / len(lons)
+    return centroid(geometry)
 
 
-# ── Función principal ─────────────────────────────────────────────────
-def get_weather_for_field(field) -> dict | None:
+def _field_coords(field):
+    """Centroide de la parcela: el guardado en Field si existe; si no, se calcula del GeoJSON."""
+    stored = getattr(field, "centroid", None)
+    if stored:
+        return stored
+    return _get_centroid(field.geometry)
+
+
+# ── Previsión por municipio ───────────────────────────────────────────
+def _build_forecast(municipio: dict, horaria_raw, diaria_raw) -> dict | None:
     """
-    Obtiene la previsión meteorológica para una parcela usando AEMET OpenData.
-    Devuelve None si no hay coords, no hay API key, o la API falla.
+    Construye la previsión unificada (horaria + diaria) de un municipio a partir
+    de las respuestas crudas de AEMET. No depende de la parcela: es lo que se cachea.
     """
-    api_key = getattr(settings, "AEMET_API_KEY", "")
-    if not api_key:
-        logger.warning("AEMET_API_KEY no configurada; sin previsión meteorológica")
-        return None
-    if not getattr(field, "geometry", None):
-        return None
-    coords = _get_centroid(field.geometry)
-    if coords is None:
-        return None
-    lat, lon = coords
-    municipio = _nearest_municipio(lat, lon)
-    if not municipio:
-        logger.warning("AEMET: no se encontró municipio para lat=%s lon=%s", lat, lon)
-        return None
     cod = municipio["cod"]
-    logger.debug("AEMET: municipio=%s (%s)", municipio["nombre"], cod)
-    # ── Datos ──
-    horaria_raw = _aemet_fetch(f"/api/prediccion/especifica/municipio/horaria/{cod}")
     hourly_list = _parse_horaria(horaria_raw) if horaria_raw else []
-    diaria_raw = _aemet_fetch(f"/api/prediccion/especifica/municipio/diaria/{cod}")
     daily_summary = _parse_diaria(diaria_raw) if diaria_raw else []
     if not hourly_list and not daily_summary:
         logger.warning("AEMET: sin datos para municipio %s (%s)", municipio["nombre"], cod)
@@ -727,8 +1049,6 @@ def get_weather_for_field(field) -> dict | None:
             }
 
     return {
-        "lat": round(lat, 5),
-        "lon": round(lon, 5),
         "timezone": "Europe/Madrid",
         "source": "aemet",
         "municipality": municipio["nombre"],
@@ -743,3 +1063,382 @@ def get_weather_for_field(field) -> dict | None:
             "sample_horaria": sample_hora_raw,
         },
     }
+
+
+def _fetch_forecast(municipio: dict) -> dict | None:
+    """
+    Descarga de AEMET la predicción horaria y diaria de un municipio en paralelo,
+    con un único plazo (_FORECAST_DEADLINE) para ambas. Lo que no llegue a tiempo
+    se trata como no disponible.
+    """
+    if is_aemet_unavailable():
+        return None
+    cod = municipio["cod"]
+    deadline = time.monotonic() + _FORECAST_DEADLINE
+    futures = {
+        kind: _fetch_pool.submit(_pooled_fetch, f"/api/prediccion/especifica/municipio/{kind}/{cod}", deadline)
+        for kind in ("horaria", "diaria")
+    }
+    done, _ = wait(futures.values(), timeout=_FORECAST_DEADLINE)
+    raw = {}
+    for kind, future in futures.items():
+        if future not in done:
+            logger.warning("AEMET: %s de %s no llegó en %ss", kind, cod, _FORECAST_DEADLINE)
+            future.cancel()
+            raw[kind] = None
+            continue
+        try:
+            raw[kind] = future.result()
+        except Exception:  # noqa: BLE001 — una predicción fallida no invalida la otra
+            logger.exception("AEMET: error descargando %s de %s", kind, cod)
+            raw[kind] = None
+    return _build_forecast(municipio, raw["horaria"], raw["diaria"])
+
+
+def _forecast_cache_key(cod: str) -> str:
+    return f"{_FORECAST_CACHE_PREFIX}:{cod}"
+
+
+def _forecast_lock_key(cod: str) -> str:
+    return f"{_FORECAST_CACHE_PREFIX}:lock:{cod}"
+
+
+def _windows_cache_key(cod: str) -> str:
+    return f"{_FORECAST_CACHE_PREFIX}:windows:v2:{cod}"  # v2: con la puntuación de cada hora
+
+
+def refresh_forecast(municipio: dict) -> dict | None:
+    """
+    Descarga la previsión de un municipio y la guarda en caché, junto con sus
+    ventanas de aplicación de tratamientos (ver farm.treatment_windows).
+    Si AEMET falla se conserva la entrada anterior (si la hay).
+    """
+    cod = municipio["cod"]
+    forecast = _fetch_forecast(municipio)
+    if forecast is not None:
+        timeout = _FORECAST_FRESH_TTL + _FORECAST_STALE_TTL
+        cache.set(_forecast_cache_key(cod), {"fetched_at": time.time(), "data": forecast}, timeout=timeout)
+        cache.set(_windows_cache_key(cod), best_windows(forecast["hourly"], limit=None), timeout=timeout)
+    return forecast
+
+
+def _refresh_in_background(municipio: dict) -> None:
+    """Refresca una entrada caducada sin bloquear la petición que la ha servido."""
+    def run():
+        try:
+            refresh_forecast(municipio)
+        except Exception:  # noqa: BLE001 — un fallo aquí nunca debe tumbar el worker
+            logger.exception("AEMET: error refrescando previsión de %s", municipio["cod"])
+        finally:
+            cache.delete(_forecast_lock_key(municipio["cod"]))
+            connections.close_all()
+
+    threading.Thread(target=run, name=f"aemet-refresh-{municipio['cod']}", daemon=True).start()
+
+
+def get_forecast_for_municipio(municipio: dict) -> dict | None:
+    """
+    Devuelve la previsión de un municipio usando la caché de Django.
+
+    - Entrada fresca (< _FORECAST_FRESH_TTL): se devuelve sin tocar AEMET.
+    - Entrada caducada (< _FORECAST_STALE_TTL): se devuelve la copia antigua y
+      se lanza un refresco en segundo plano.
+    - Sin entrada: se descarga en línea.
+
+    Un lock en caché (cache.add es atómico) garantiza que solo un proceso
+    descarga cada municipio a la vez; el resto sirve la copia antigua o
+    espera brevemente a que aparezca la nueva (None si no llega a tiempo).
+
+    Con el circuit breaker abierto se sirve la copia que haya (fresca o no)
+    y, si no hay ninguna, se devuelve None sin esperar a AEMET.
+    """
+    cod = municipio["cod"]
+    key = _forecast_cache_key(cod)
+    lock_key = _forecast_lock_key(cod)
+    entry = cache.get(key)
+
+    if entry is not None:
+        if time.time() - entry["fetched_at"] < _FORECAST_FRESH_TTL or is_aemet_unavailable():
+            return entry["data"]
+        if cache.add(lock_key, 1, timeout=_FORECAST_LOCK_TTL):
+            _refresh_in_background(municipio)
+        return entry["data"]
+
+    if is_aemet_unavailable():
+        return None
+
+    locked = cache.add(lock_key, 1, timeout=_FORECAST_LOCK_TTL)
+    if not locked:
+        # Otro worker está descargando este municipio: esperamos su resultado
+        deadline = time.monotonic() + _FORECAST_LOCK_WAIT
+        while time.monotonic() < deadline:
+            time.sleep(0.25)
+            entry = cache.get(key)
+            if entry is not None:
+                return entry["data"]
+            # Si el otro worker ha terminado sin guardar nada, lo intentamos nosotros
+            if cache.get(lock_key) is None and cache.add(lock_key, 1, timeout=_FORECAST_LOCK_TTL):
+                locked = True
+                break
+    if not locked:
+        # Sigue descargando otro: no lanzamos una segunda descarga ni tocamos su lock
+        return None
+    try:
+        return refresh_forecast(municipio)
+    finally:
+        cache.delete(lock_key)
+
+
+# ── Formato de respuesta ──────────────────────────────────────────────
+PAYLOAD_FULL = "full"
+PAYLOAD_COMPACT = "compact"
+PAYLOAD_COLUMNS = "columns"
+PAYLOAD_MODES = (PAYLOAD_FULL, PAYLOAD_COMPACT, PAYLOAD_COLUMNS)
+
+# Columnas de cada hora en el modo por columnas. `date` y `datetime` se omiten:
+# se deducen de daily[i].date y de la columna `hour`.
+HOUR_COLUMNS = (
+    "hour", "precipitation", "precipitation_probability", "wind_speed", "wind_gusts",
+    "wind_level", "temperature", "humidity", "weather_code", "icon", "label", "adverse",
+    "treatment_ok",
+)
+
+
+def _hours_to_columns(hours: list) -> dict:
+    return {col: [h.get(col) for h in hours] for col in HOUR_COLUMNS}
+
+
+def compact_forecast(forecast: dict, mode: str = PAYLOAD_COMPACT) -> dict:
+    """
+    Versión ligera de una previsión para enviar al navegador.
+
+    - compact: sin `_debug` ni la lista `hourly` de primer nivel (cada hora ya
+      va en daily[i].hours, así que se enviaba dos veces).
+    - columns: además, las horas de cada día van como arrays paralelos
+      ({"hour": [...], "temperature": [...], ...}) en lugar de una lista de objetos.
+
+    No modifica `forecast` (puede ser la copia de la caché).
+    """
+    if mode == PAYLOAD_FULL:
+        return forecast
+    result = {k: v for k, v in forecast.items() if k not in ("hourly", "_debug")}
+    if mode == PAYLOAD_COLUMNS:
+        result["daily"] = [
+            {**day, "hours": _hours_to_columns(day.get("hours", []))} for day in forecast.get("daily", [])
+        ]
+    return result
+
+
+# ── Función principal ─────────────────────────────────────────────────
+def _locate_field(field):
+    """(lat, lon, municipio) de una parcela, o None si no se puede ubicar."""
+    if not getattr(field, "geometry", None):
+        return None
+    coords = _field_coords(field)
+    if coords is None:
+        return None
+    lat, lon = coords
+    municipio = _nearest_municipio(lat, lon)
+    if not municipio:
+        logger.warning("AEMET: no se encontró municipio para lat=%s lon=%s", lat, lon)
+        return None
+    return lat, lon, municipio
+
+
+def get_weather_for_field(field, payload: str = PAYLOAD_FULL) -> dict | None:
+    """
+    Obtiene la previsión meteorológica para una parcela usando AEMET OpenData.
+    Devuelve None si no hay coords, no hay API key, o la API falla.
+    `payload`: formato de la respuesta (ver compact_forecast).
+    """
+    api_key = getattr(settings, "AEMET_API_KEY", "")
+    if not api_key:
+        logger.warning("AEMET_API_KEY no configurada; sin previsión meteorológica")
+        return None
+    located = _locate_field(field)
+    if located is None:
+        return None
+    lat, lon, municipio = located
+    logger.debug("AEMET: municipio=%s (%s)", municipio["nombre"], municipio["cod"])
+    forecast = get_forecast_for_municipio(municipio)
+    if forecast is None:
+        return None
+    return {"lat": round(lat, 5), "lon": round(lon, 5), **compact_forecast(forecast, payload)}
+
+
+def _forecast_task(municipio: dict) -> dict | None:
+    try:
+        return get_forecast_for_municipio(municipio)
+    finally:
+        connections.close_all()  # conexiones abiertas por este hilo (p.ej. caché en BD)
+
+
+def get_weather_for_fields(fields, payload: str = PAYLOAD_FULL) -> dict:
+    """
+    Previsión de varias parcelas de una vez. Las parcelas se agrupan por su
+    municipio más cercano y cada municipio se descarga una sola vez, con
+    hasta _BATCH_CONCURRENCY municipios en paralelo. `payload` como en
+    get_weather_for_field.
+
+    Devuelve:
+        {
+          "municipalities": {cod: previsión del municipio (sin lat/lon)},
+          "fields": {field_id: {"municipality_code", "lat", "lon"}},
+          "errors": {field_id: motivo},
+        }
+    """
+    result = {"municipalities": {}, "fields": {}, "errors": {}}
+    fields = list(fields)
+    if not getattr(settings, "AEMET_API_KEY", ""):
+        logger.warning("AEMET_API_KEY no configurada; sin previsión meteorológica")
+        for field in fields:
+            result["errors"][field.pk] = "El servicio meteorológico no está configurado."
+        return result
+
+    by_municipio: dict[str, dict] = {}
+    for field in fields:
+        located = _locate_field(field)
+        if located is None:
+            result["errors"][field.pk] = "La parcela no tiene coordenadas definidas."
+            continue
+        lat, lon, municipio = located
+        by_municipio[municipio["cod"]] = municipio
+        result["fields"][field.pk] = {"municipality_code": municipio["cod"], "lat": round(lat, 5), "lon": round(lon, 5)}
+
+    if by_municipio:
+        workers = min(_BATCH_CONCURRENCY, len(by_municipio))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="aemet-batch") as pool:
+            forecasts = dict(zip(by_municipio, pool.map(_forecast_task, by_municipio.values())))
+        result["municipalities"] = {
+            cod: compact_forecast(f, payload) for cod, f in forecasts.items() if f is not None
+        }
+
+    for field_id, location in list(result["fields"].items()):
+        if location["municipality_code"] not in result["municipalities"]:
+            del result["fields"][field_id]
+            result["errors"][field_id] = (
+                "AEMET no responde en este momento; inténtalo de nuevo en unos minutos."
+                if is_aemet_unavailable()
+                else "No se pudieron obtener datos de AEMET para esta parcela."
+            )
+    return result
+
+
+# ── Ventanas de tratamiento ───────────────────────────────────────────
+def get_treatment_windows_for_municipio(municipio: dict) -> list | None:
+    """
+    Todas las ventanas de aplicación de la previsión horaria del municipio,
+    precalculadas al refrescar la caché. None si no hay previsión.
+    """
+    forecast = get_forecast_for_municipio(municipio)
+    if forecast is None:
+        return None
+    key = _windows_cache_key(municipio["cod"])
+    windows = cache.get(key)
+    if windows is None:  # entrada guardada antes de existir las ventanas
+        windows = best_windows(forecast.get("hourly", []), limit=None)
+        cache.set(key, windows, timeout=_FORECAST_FRESH_TTL + _FORECAST_STALE_TTL)
+    return windows
+
+
+def get_treatment_windows_for_fields(fields, limit: int = MAX_WINDOWS) -> dict:
+    """
+    Mejores ventanas de aplicación próximas de varias parcelas, agrupadas por municipio.
+
+    Devuelve:
+        {
+          "fields": {field_id: {"municipality_code", "windows": [{start, end, hours, score, min_score, scores}]}},
+          "errors": {field_id: motivo},
+        }
+    """
+    weather = get_weather_for_fields(fields, payload=PAYLOAD_COMPACT)
+    now = datetime.now(ZoneInfo("Europe/Madrid")).strftime("%Y-%m-%dT%H:%M")
+    by_municipio = {}
+    result = {"fields": {}, "errors": weather["errors"]}
+    for field_id, location in weather["fields"].items():
+        cod = location["municipality_code"]
+        if cod not in by_municipio:
+            municipio = {"cod": cod, "nombre": weather["municipalities"][cod]["municipality"]}
+            windows = get_treatment_windows_for_municipio(municipio) or []
+            by_municipio[cod] = upcoming_windows(windows, now)[:limit]
+        result["fields"][field_id] = {"municipality_code": cod, "windows": by_municipio[cod]}
+    return result
+
+
+# ── Precalentado de la caché ──────────────────────────────────────────
+@dataclass
+class ForecastPrewarmResult:
+    fields: int = 0
+    municipalities: int = 0
+    refreshed: int = 0
+    skipped_fresh: int = 0
+    skipped_locked: int = 0
+    failed: int = 0
+    elapsed: float = 0.0
+    timings: list = dc_field(default_factory=list)  # segundos por municipio descargado
+
+
+def _prewarm_one(municipio: dict, max_age: float) -> tuple[str, float]:
+    """Refresca un municipio si su entrada es más antigua que `max_age`. Devuelve (estado, segundos)."""
+    cod = municipio["cod"]
+    try:
+        entry = cache.get(_forecast_cache_key(cod))
+        if entry is not None and time.time() - entry["fetched_at"] < max_age:
+            return "fresh", 0.0
+        lock_key = _forecast_lock_key(cod)
+        if not cache.add(lock_key, 1, timeout=_FORECAST_LOCK_TTL):
+            return "locked", 0.0
+        started = time.monotonic()
+        try:
+            forecast = refresh_forecast(municipio)
+        finally:
+            cache.delete(lock_key)
+        return ("refreshed" if forecast is not None else "failed"), time.monotonic() - started
+    except Exception:  # noqa: BLE001 — un municipio fallido no debe parar el resto
+        logger.exception("AEMET: error precalentando %s", cod)
+        return "failed", 0.0
+    finally:
+        connections.close_all()
+
+
+def prewarm_forecasts(fields, concurrency: int = 4, max_age: float | None = None) -> ForecastPrewarmResult:
+    """
+    Refresca en caché la previsión de los municipios de `fields` antes de que
+    los pida un usuario. Las parcelas se deduplican por municipio y se descargan
+    como mucho `concurrency` municipios a la vez.
+
+    `max_age`: se saltan las entradas más recientes que esto (por defecto la
+    mitad de _FORECAST_FRESH_TTL, para que nunca lleguen a caducar entre pasadas).
+    """
+    result = ForecastPrewarmResult()
+    started = time.monotonic()
+    if max_age is None:
+        max_age = _FORECAST_FRESH_TTL / 2
+
+    municipios: dict[str, dict] = {}
+    for field in fields:
+        result.fields += 1
+        located = _locate_field(field)
+        if located is not None:
+            municipio = located[2]
+            municipios[municipio["cod"]] = municipio
+    result.municipalities = len(municipios)
+
+    if municipios:
+        with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="aemet-prewarm") as pool:
+            outcomes = list(pool.map(lambda m: _prewarm_one(m, max_age), municipios.values()))
+        for status, seconds in outcomes:
+            if status == "refreshed":
+                result.refreshed += 1
+                result.timings.append(seconds)
+            elif status == "fresh":
+                result.skipped_fresh += 1
+            elif status == "locked":
+                result.skipped_locked += 1
+            else:
+                result.failed += 1
+                if seconds:
+                    result.timings.append(seconds)
+
+    result.elapsed = time.monotonic() - started
+    return result
@@ -87,7 +87,19 @@ document.addEventListener('DOMContentLoaded', function () {
         // Mostrar información básica inmediatamente
         document.querySelector('.treatment-title').textContent = event.title;
         document.getElementById('detail-meta').textContent = formatDate(event.start);
-        document.getElementById('view-treatment').href = `/tratamientos/${treatmentId}`;
+
+        // Las fechas de una serie sin materializar no tienen página: se editan o finalizan desde aquí
+        const props = event.extendedProps;
+        const viewLink = document.getElementById('view-treatment');
+        const occurrenceActions = document.getElementById('series-occurrence-actions');
+        viewLink.classList.toggle('d-none', Boolean(props.virtual));
+        occurrenceActions.classList.toggle('d-none', !props.virtual);
+        if (props.virtual) {
+            occurrenceActions.action = API_URLS.seriesOccurrenceEdit(props.series, props.date);
+            document.getElementById('finish-occurrence').onclick = () => finishOccurrence(props);
+        } else {
+            viewLink.href = `/tratamientos/${treatmentId}`;
+        }
 
         // Resetear estado del modal
         const statusContainer = document.getElementById('status-container');
@@ -106,7 +118,10 @@ document.addEventListener('DOMContentLoaded', function () {
 
         new bootstrap.Modal(treatmentModal).show();
 
-        fetch(API_URLS.treatmentDetail(treatmentId))
+        const detailUrl = props.virtual
+            ? API_URLS.seriesOccurrence(props.series, props.date)
+            : API_URLS.treatmentDetail(treatmentId);
+        fetch(detailUrl)
             .then(response => {
                 if (!response.ok) throw new Error('Error al cargar los detalles');
                 return response.json();
@@ -158,6 +173,43 @@ document.addEventListener('DOMContentLoaded', function () {
             });
     }
 
+    function finishOccurrence(props) {
+        const form = document.getElementById('series-occurrence-actions');
+        Swal.fire({
+            title: 'Finalizar tratamiento',
+            html: '<input type="date" class="form-control" id="swalOccurrenceFinishDate">',
+            showCancelButton: true,
+            confirmButtonText: 'Finalizar',
+            cancelButtonText: 'Cancelar',
+            confirmButtonColor: '#198754',
+            heightAuto: false,
+            didOpen: () => {
+                document.getElementById('swalOccurrenceFinishDate').value = props.date;
+            },
+            preConfirm: () => {
+                const finishDate = document.getElementById('swalOccurrenceFinishDate').value;
+                if (!finishDate) {
+                    Swal.showValidationMessage('Por favor, ingresa una fecha de finalización');
+                    return false;
+                }
+                return finishDate;
+            }
+        }).then((result) => {
+            if (!result.isConfirmed) return;
+            fetch(API_URLS.seriesOccurrenceFinish(props.series, props.date), {
+                method: 'POST',
+                headers: { 'X-CSRFToken': form.querySelector('[name=csrfmiddlewaretoken]').value },
+                body: new URLSearchParams({ finish_date: result.value })
+            })
+                .then(r => { if (!r.ok) throw new Error(); return r.json(); })
+                .then(() => {
+                    bootstrap.Modal.getInstance(document.getElementById('treatment-detail'))?.hide();
+                    calendar.refetchEvents();
+                })
+                .catch(() => Swal.fire({ icon: 'error', title: 'Error', text: 'No se pudo finalizar el tratamiento.' }));
+        });
+    }
+
     function formatNumber(value, decimals = 2) {
         const parsed = Number(value);
         const safe = Number.isFinite(parsed) ? parsed : 0;